@@ -1,21 +1,82 @@
 import asyncio
 import json
-import threading
+import os
 from concurrent.futures import ThreadPoolExecutor
-from fastapi import FastAPI, Request
+from contextlib import aclosing, asynccontextmanager, closing
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 from sse_starlette.sse import EventSourceResponse
-from config import BolchaiSettings
-from engine.interpreter import BolchaiInterpreter
+from api.streaming import ChunkChannel, encode_chunk
+from config import BolchaiSettings, SidecarSettings
+from engine.completion_cache import completion_cache
+from engine.history import MessageStore
+from engine.http_clients import llm_clients
+from engine.interpreter import warmup_limiter
+from engine.monitor import ExecutorMonitor
+from engine.rate_limits import llm_scheduler
+from engine.routing import llm_router
+from engine.sessions import DEFAULT_SESSION, SessionManager
+from execution.blobs import blob_store
+from execution.kernel_pool import kernel_pool
+from execution.limits import execution_limits
+from execution.output import output_store
 
 
-executor = ThreadPoolExecutor(max_workers=2)
+executor = ThreadPoolExecutor(max_workers=32)
 
 
 def create_app() -> FastAPI:
-    app = FastAPI(title="Bolchai Engine")
     settings = BolchaiSettings.load()
-    interpreter = BolchaiInterpreter(settings)
+    config = SidecarSettings()
+    store = None
+    if config.history:
+        store = MessageStore(config.history_path or BolchaiSettings.settings_path().with_name("history.db"))
+    sessions = SessionManager(settings, config, store)
+    monitor = ExecutorMonitor(sessions, config)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        # Before the pool starts kernels, so they get the rlimits
+        execution_limits.configure(config)
+        kernel_pool.start(config.kernel_pool_size)
+        output_store.max_entries = config.max_spilled_outputs
+        blob_store.max_bytes = config.max_blob_mb * 1024 * 1024
+        warmup_limiter.limit = config.max_warmups
+        completion_cache.configure(
+            config, config.llm_cache_path or BolchaiSettings.settings_path().with_name("llm-cache")
+        )
+        llm_clients.configure(config)
+        llm_router.configure(config)
+        llm_scheduler.configure(config)
+        warm_llm_connection()
+        sessions.start()
+        monitor.start()
+        yield
+        monitor.shutdown()
+        sessions.shutdown()
+        if store is not None:
+            store.close()
+        kernel_pool.shutdown()
+        output_store.shutdown()
+        blob_store.shutdown()
+        await llm_clients.ashutdown()
+
+    def warm_llm_connection():
+        """Open a connection to the model's endpoint before the first turn needs it."""
+        if not config.llm_warmup:
+            return
+        if config.async_llm:
+            warm = llm_clients.awarm(sessions.settings)
+        else:
+            warm = asyncio.to_thread(llm_clients.warm, sessions.settings)
+        task = asyncio.ensure_future(warm)
+        warmups.add(task)
+        task.add_done_callback(warmups.discard)
+
+    warmups = set()
+
+    app = FastAPI(title="Bolchai Engine", lifespan=lifespan)
 
     app.add_middleware(
         CORSMiddleware,
@@ -32,39 +93,69 @@ def create_app() -> FastAPI:
     async def chat(request: Request):
         body = await request.json()
         message = body.get("message", "")
+        session_id = body.get("session_id") or DEFAULT_SESSION
 
         async def event_generator():
-            loop = asyncio.get_event_loop()
-            queue: asyncio.Queue = asyncio.Queue()
-            stop_event = threading.Event()
+            loop = asyncio.get_running_loop()
+            channel = ChunkChannel(loop, maxsize=config.stream_queue_size)
 
             def run_interpreter():
                 try:
-                    for chunk in interpreter.chat(message):
-                        asyncio.run_coroutine_threadsafe(
-                            queue.put(chunk), loop
-                        )
+                    with sessions.acquire(session_id) as interpreter:
+                        channel.on_cancel(interpreter.stop)
+                        # Leaving the loop closes the generator chain, which
+                        # ends the LLM stream and skips any remaining blocks
+                        with closing(interpreter.chat(message)) as chunks:
+                            for chunk in chunks:
+                                if not channel.put(chunk):
+                                    break
+                except Exception as e:
+                    channel.put({
+                        "role": "computer",
+                        "type": "error",
+                        "content": str(e),
+                    })
+                finally:
+                    channel.close()
+
+            async def pump_interpreter():
+                try:
+                    async with sessions.acquire_async(session_id) as interpreter:
+                        channel.on_cancel(interpreter.stop)
+                        async with aclosing(interpreter.achat(message)) as chunks:
+                            async for chunk in chunks:
+                                if not await channel.aput(chunk):
+                                    break
+                except asyncio.CancelledError:
+                    raise
                 except Exception as e:
-                    asyncio.run_coroutine_threadsafe(
-                        queue.put({
-                            "role": "computer",
-                            "type": "error",
-                            "content": str(e),
-                        }),
-                        loop,
-                    )
+                    await channel.aput({
+                        "role": "computer",
+                        "type": "error",
+                        "content": str(e),
+                    })
                 finally:
-                    stop_event.set()
-                    asyncio.run_coroutine_threadsafe(queue.put(None), loop)
+                    channel.close()
 
-            loop.run_in_executor(executor, run_interpreter)
+            if config.async_llm:
+                task = loop.create_task(pump_interpreter())
+                channel.on_cancel(task.cancel)
+            else:
+                loop.run_in_executor(executor, run_interpreter)
 
-            while True:
-                chunk = await queue.get()
-                if chunk is None:
-                    yield {"data": "[DONE]"}
-                    break
-                yield {"data": json.dumps(chunk)}
+            try:
+                if config.stream_coalesce:
+                    async for chunk in channel.frames(
+                        config.stream_coalesce_ms / 1000, config.stream_coalesce_chars
+                    ):
+                        yield {"data": encode_chunk(chunk)}
+                else:
+                    while (chunk := await channel.get()) is not None:
+                        yield {"data": encode_chunk(chunk)}
+                yield {"data": "[DONE]"}
+            finally:
+                # Runs when the client disconnects too: stop the worker early
+                channel.cancel()
 
         return EventSourceResponse(event_generator())
 
@@ -72,24 +163,123 @@ def create_app() -> FastAPI:
     async def confirm(request: Request):
         body = await request.json()
         approved = body.get("approved", False)
+        interpreter = sessions.peek(body.get("session_id") or DEFAULT_SESSION)
+        if interpreter is None:
+            raise HTTPException(status_code=404, detail="Unknown session")
         interpreter.confirm(approved)
         return {"status": "ok"}
 
+    @app.post("/stop")
+    async def stop(request: Request):
+        """Stop a session's turn: its LLM stream, confirmation and running code."""
+        body = await _optional_json(request)
+        interpreter = sessions.peek(body.get("session_id") or DEFAULT_SESSION)
+        if interpreter is None:
+            raise HTTPException(status_code=404, detail="Unknown session")
+        await asyncio.to_thread(interpreter.stop)
+        return {"status": "ok"}
+
     @app.get("/settings")
     async def get_settings():
-        return interpreter.settings.model_dump()
+        return sessions.settings.model_dump()
 
     @app.post("/settings")
     async def update_settings(request: Request):
         body = await request.json()
-        new_settings = BolchaiSettings(**body)
+        # Fields the client doesn't know about keep their current values
+        new_settings = BolchaiSettings(**{**sessions.settings.model_dump(), **body})
         new_settings.save()
-        interpreter.update_settings(new_settings)
+        sessions.update_settings(new_settings)
+        warm_llm_connection()
         return {"status": "ok"}
 
     @app.post("/reset")
-    async def reset():
-        interpreter.reset()
+    async def reset(request: Request):
+        body = await _optional_json(request)
+        session_id = body.get("session_id") or DEFAULT_SESSION
+        interpreter = sessions.peek(session_id)
+        if interpreter is not None:
+            interpreter.reset()
+        elif store is not None:
+            # Not loaded since the last restart; its stored history still goes
+            store.reset(session_id)
+        return {"status": "ok"}
+
+    @app.get("/sessions")
+    async def list_sessions():
+        return sessions.stats()
+
+    @app.get("/sessions/{session_id}/messages")
+    async def session_messages(session_id: str, before: int | None = None, limit: int = 50):
+        """A page of a session's stored history, oldest first; pass `before` to page back."""
+        if store is None:
+            raise HTTPException(status_code=404, detail="History is disabled")
+        limit = max(1, min(limit, 500))
+        page = await asyncio.to_thread(store.page, session_id, before, limit)
+        return {
+            "messages": [{"seq": seq, **message} for seq, message in page],
+            # Cursor for the next (older) page, if there may be one
+            "before": page[0][0] if len(page) == limit else None,
+        }
+
+    @app.get("/kernels")
+    async def kernel_stats():
+        return kernel_pool.stats()
+
+    @app.get("/executors")
+    async def executor_stats():
+        return monitor.stats()
+
+    @app.get("/llm-connections")
+    async def llm_connection_stats():
+        return llm_clients.stats()
+
+    @app.get("/llm-routes")
+    async def llm_route_stats():
+        return llm_router.stats()
+
+    @app.get("/llm-limits")
+    async def llm_limit_stats():
+        return llm_scheduler.stats()
+
+    @app.get("/llm-cache")
+    async def llm_cache_stats():
+        return completion_cache.stats()
+
+    @app.get("/outputs/{output_id}")
+    async def get_output(output_id: str):
+        path = output_store.path(output_id)
+        if path is None or not os.path.exists(path):
+            raise HTTPException(status_code=404, detail="Unknown output")
+        return FileResponse(path, media_type="text/plain; charset=utf-8")
+
+    @app.get("/blobs/{blob_id}")
+    async def get_blob(blob_id: str, preview: bool = False):
+        found = blob_store.get(blob_id, preview=preview)
+        if found is None or not os.path.exists(found[0]):
+            raise HTTPException(status_code=404, detail="Unknown blob")
+        path, media_type = found
+        # Content-addressed: a blob id always names the same bytes. A preview
+        # may still be the full image, so that answer isn't cached.
+        cache = "no-cache" if preview else "public, max-age=31536000, immutable"
+        return FileResponse(path, media_type=media_type, headers={"Cache-Control": cache})
+
+    @app.delete("/sessions/{session_id}")
+    async def close_session(session_id: str):
+        if not await asyncio.to_thread(sessions.remove, session_id):
+            raise HTTPException(status_code=404, detail="Unknown session")
         return {"status": "ok"}
 
     return app
+
+
+async def _optional_json(request: Request) -> dict:
+    """Parse a JSON body if one was sent; older clients post empty bodies."""
+    raw = await request.body()
+    if not raw:
+        return {}
+    try:
+        body = json.loads(raw)
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
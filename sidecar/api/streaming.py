@@ -0,0 +1,215 @@
+import asyncio
+import json
+import threading
+from collections import deque
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Chunk types whose content can be concatenated into one frame
+MERGEABLE_TYPES = ("message", "code", "console")
+
+
+def encode_chunk(chunk):
+    """Serialize a chunk for an SSE data field."""
+    if orjson is not None:
+        return orjson.dumps(chunk).decode()
+    return json.dumps(chunk)
+
+
+def coalesce(chunks, max_chars=2048):
+    """
+    Merge runs of adjacent text deltas with the same role, type and format
+    into single chunks of at most max_chars. Start/end markers, confirmations
+    and anything else pass through untouched; a start chunk may absorb the
+    deltas that follow it, since a client treats its content the same way.
+    """
+    merged = []
+    owned = False
+    for chunk in chunks:
+        last = merged[-1] if merged else None
+        if last is not None and _can_merge(last, chunk, max_chars):
+            # Copy before extending so the caller's chunks are left alone
+            if not owned:
+                last = merged[-1] = dict(last)
+                owned = True
+            last["content"] += chunk["content"]
+        else:
+            merged.append(chunk)
+            owned = False
+    return merged
+
+
+def _can_merge(last, chunk, max_chars):
+    return (
+        last.get("type") in MERGEABLE_TYPES
+        and not last.get("end")
+        and not chunk.get("start")
+        and not chunk.get("end")
+        and chunk.keys() <= {"role", "type", "format", "content"}
+        and chunk.get("role") == last.get("role")
+        and chunk.get("type") == last.get("type")
+        and chunk.get("format") == last.get("format")
+        and isinstance(chunk.get("content"), str)
+        and isinstance(last.get("content"), str)
+        and len(last["content"]) + len(chunk["content"]) <= max_chars
+    )
+
+
+class ChunkChannel:
+    """
+    Bounded hand-off of chunks from a worker thread, or a task on the loop
+    via aput(), to the event loop.
+
+    put() blocks the worker while `maxsize` chunks are waiting, so a slow
+    client slows the producer down instead of growing a queue. The loop is
+    only woken when the consumer is actually waiting, so a burst of tokens
+    costs one call_soon_threadsafe rather than one future per chunk.
+
+    cancel() makes every later put() return False and runs the callbacks
+    registered with on_cancel(), which is how the worker learns the client
+    is gone.
+    """
+
+    def __init__(self, loop, maxsize=64):
+        self.loop = loop
+        self.maxsize = maxsize
+        self._items = deque()
+        self._lock = threading.Lock()
+        self._not_full = threading.Condition(self._lock)
+        self._ready = asyncio.Event()
+        self._space = asyncio.Event()
+        self._waiting = False
+        self._closed = False
+        self._cancelled = False
+        self._callbacks = []
+
+    @property
+    def cancelled(self):
+        return self._cancelled
+
+    def put(self, item):
+        """Called from the worker. Returns False once the consumer has cancelled."""
+        with self._not_full:
+            while len(self._items) >= self.maxsize and not self._cancelled:
+                self._not_full.wait()
+            if self._cancelled:
+                return False
+            self._items.append(item)
+            wake = self._waiting
+            self._waiting = False
+        if wake:
+            self.loop.call_soon_threadsafe(self._ready.set)
+        return True
+
+    async def aput(self, item):
+        """put() for a producer running on the loop itself; waits instead of blocking."""
+        while True:
+            with self._lock:
+                if self._cancelled:
+                    return False
+                if len(self._items) < self.maxsize:
+                    self._items.append(item)
+                    wake = self._waiting
+                    self._waiting = False
+                    break
+                self._space.clear()
+            await self._space.wait()
+        if wake:
+            self._ready.set()
+        return True
+
+    def close(self):
+        """Called from the worker when it has nothing more to send."""
+        with self._lock:
+            self._closed = True
+            wake = self._waiting
+            self._waiting = False
+        if wake:
+            self.loop.call_soon_threadsafe(self._ready.set)
+
+    async def get(self):
+        """Next item, or None once the worker closed the channel and it is drained."""
+        while True:
+            with self._not_full:
+                if self._items:
+                    item = self._items.popleft()
+                    self._not_full.notify()
+                    self._space.set()
+                    return item
+                if self._closed:
+                    return None
+                self._ready.clear()
+                self._waiting = True
+            await self._ready.wait()
+
+    def _drain(self):
+        with self._not_full:
+            items = list(self._items)
+            self._items.clear()
+            self._not_full.notify_all()
+            self._space.set()
+        return items
+
+    async def _wait(self, timeout=None):
+        """Wait until items are queued or the channel closes, or timeout passes."""
+        with self._lock:
+            if self._items or self._closed:
+                return
+            self._ready.clear()
+            self._waiting = True
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def frames(self, window=0.0, max_chars=2048):
+        """
+        Yield coalesced chunks. Once the first item of a frame arrives, keeps
+        collecting for up to `window` seconds, or until about max_chars of
+        content is pending, so bursts of tokens share one event.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            await self._wait()
+            items = self._drain()
+            if not items:
+                return
+            pending = sum(len(item.get("content") or "") for item in items)
+            deadline = loop.time() + window
+            while pending < max_chars and not self._closed:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                await self._wait(remaining)
+                more = self._drain()
+                items.extend(more)
+                pending += sum(len(item.get("content") or "") for item in more)
+            for chunk in coalesce(items, max_chars):
+                yield chunk
+
+    def on_cancel(self, callback):
+        """Run `callback` on cancel(), or right away if that already happened."""
+        with self._lock:
+            if not self._cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def cancel(self):
+        """Called from the loop when the client went away. No-op once the worker closed."""
+        with self._not_full:
+            if self._cancelled or self._closed:
+                return
+            self._cancelled = True
+            self._items.clear()
+            self._not_full.notify_all()
+            self._space.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
@@ -0,0 +1,96 @@
+"""
+Size of the SSE events for kernel images and HTML tables, inline versus
+through the blob store.
+
+The kernel displays the same 1200x900 PNG five times (a plot redrawn in a
+loop) and one 500-row HTML table. For each output the script compares the
+encoded event with what an inline base64 or HTML event would have been,
+then reports how many bytes the blob store keeps and how soon a preview
+is ready. The PNG is built with zlib, so the kernel needs no imaging
+library; previews need Pillow in the sidecar.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_blob_outputs
+"""
+import base64
+import os
+import time
+
+os.environ.setdefault("BOLCHAI_KERNEL_POOL_SIZE", "0")
+
+from api.streaming import encode_chunk
+from execution.blobs import Image, blob_store
+from execution.python_kernel import PythonKernel
+
+CODE = r'''
+import random, struct, zlib
+from IPython.display import HTML, Image, display
+
+def png(width, height):
+    rng = random.Random(0)
+    rows = b"".join(b"\0" + bytes(rng.getrandbits(8) for _ in range(width * 3)) for _ in range(height))
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+image = png(1200, 900)
+for _ in range(5):
+    display(Image(data=image))
+
+class Table:
+    def _repr_html_(self):
+        rows = "".join(f"<tr><td>{i}</td><td>{i * i}</td><td>{i / 7:.4f}</td></tr>" for i in range(500))
+        return f"<table><tr><th>n</th><th>square</th><th>n/7</th></tr>{rows}</table>"
+    def __repr__(self):
+        return "Table(500 rows x 3 columns)"
+
+display(Table())
+'''
+
+
+def main():
+    kernel = PythonKernel()
+    try:
+        start = time.perf_counter()
+        chunks = list(kernel.run(CODE))
+        elapsed = time.perf_counter() - start
+    finally:
+        kernel.terminate()
+
+    inline_total = blob_total = 0
+    for chunk in chunks:
+        sent = len(encode_chunk({"role": "computer", **chunk}))
+        if chunk["type"] == "image":
+            path, _ = blob_store.get(chunk["content"].rsplit("/", 1)[1])
+            with open(path, "rb") as f:
+                data = base64.b64encode(f.read()).decode()
+            inline = len(encode_chunk({"role": "computer", "type": "image", "format": "base64.png", "content": data}))
+        elif "html" in chunk:
+            path, _ = blob_store.get(chunk["html"].rsplit("/", 1)[1])
+            with open(path, encoding="utf-8") as f:
+                html = f.read()
+            inline = len(encode_chunk({"role": "computer", "type": "console", "format": "output", "content": html}))
+        else:
+            continue
+        inline_total += inline
+        blob_total += sent
+        print(f"{chunk['type']:<8} inline {inline:>9,} B   blob link {sent:>4} B")
+
+    print(f"events total: inline {inline_total:,} B, with blobs {blob_total:,} B")
+    print(f"blob store: {blob_store.stats()}  (run took {elapsed:.2f} s)")
+
+    if Image is None:
+        print("previews: Pillow not installed")
+    else:
+        image_id = next(c["content"] for c in chunks if c["type"] == "image").rsplit("/", 1)[1]
+        start = time.perf_counter()
+        while blob_store.get(image_id, preview=True)[0].endswith(image_id) and time.perf_counter() - start < 10:
+            time.sleep(0.01)
+        path, _ = blob_store.get(image_id, preview=True)
+        print(f"preview ready {(time.perf_counter() - start) * 1000:.0f} ms after the run, {os.path.getsize(path):,} B")
+    blob_store.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Throughput of code-fence detection on long streamed text responses.
+
+"before" is the previous _run_text_llm loop, which searches and splits the
+whole accumulated block on every chunk. "after" is CodeFenceParser.
+The previous loop stops at the first closing fence, so the comparison uses
+a response with one long code block; the parser is also timed on a
+response with many blocks.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_code_fences [code_kb] [chunk_chars]
+"""
+import sys
+import time
+
+from engine.parsers import CodeFenceParser
+
+
+def before(chunks):
+    inside_code_block = False
+    accumulated_block = ""
+    language = None
+    emitted = 0
+
+    for content in chunks:
+        accumulated_block += content
+        if accumulated_block.endswith("`"):
+            continue
+        if "```" in accumulated_block and not inside_code_block:
+            inside_code_block = True
+            accumulated_block = accumulated_block.split("```")[1]
+        if inside_code_block and "```" in accumulated_block:
+            return emitted
+        if inside_code_block:
+            if language is None and "\n" in accumulated_block:
+                language = accumulated_block.split("\n")[0] or "python"
+            if language:
+                emitted += len(content.replace(language, ""))
+        else:
+            emitted += len(content)
+    return emitted
+
+
+def after(chunks):
+    parser = CodeFenceParser()
+    emitted = 0
+    for content in chunks:
+        for chunk in parser.feed(content):
+            emitted += len(chunk["content"])
+    for chunk in parser.finish():
+        emitted += len(chunk["content"])
+    return emitted
+
+
+def split(text, chunk_chars):
+    return [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+
+
+def timed(label, parse, chunks, total_chars):
+    start = time.perf_counter()
+    parse(chunks)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<16} {elapsed * 1000:9.1f} ms   "
+        f"{total_chars / elapsed / 1e6:8.2f} M chars/s   {len(chunks) / elapsed:12,.0f} chunks/s"
+    )
+
+
+def main():
+    code_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    chunk_chars = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+
+    line = "    total = sum(value * 2 for value in values if value % 3)\n"
+    code = (line * (code_kb * 1024 // len(line) + 1))[:code_kb * 1024]
+    single = f"Here is the script:\n```python\n{code}```\nRun it and check the output.\n"
+    block = f"Step:\n```python\n{line * 20}```\nNext, some prose about it.\n"
+    multi = block * (len(single) // len(block) + 1)
+
+    print(f"{len(single) // 1024} KB response, {chunk_chars}-char chunks")
+    timed("before", before, split(single, chunk_chars), len(single))
+    timed("after", after, split(single, chunk_chars), len(single))
+    timed("after, multi", after, split(multi, chunk_chars), len(multi))
+
+
+if __name__ == "__main__":
+    main()
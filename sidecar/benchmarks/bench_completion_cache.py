@@ -0,0 +1,99 @@
+"""
+The completion cache: a repeated temperature-0 request answered from disk.
+
+Starts a mock OpenAI-compatible server that streams slowly: a text reply
+with a code fence, or a tool call when the request offers tools. Each
+request is sent twice with the cache on. The script compares the wall time
+of the first (provider) and second (replayed) stream, and checks that both
+decode to the same LMC chunks. It then checks that an entry expires after
+its TTL, and that a size cap evicts the oldest entry.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_completion_cache
+"""
+import asyncio
+import tempfile
+import time
+from functools import partial
+
+from benchmarks.mock_llm import openai_mock, serving
+from config import BolchaiSettings, SidecarSettings
+from engine.completion_cache import completion_cache
+from engine.llm import LLMWrapper
+
+TOKEN_DELAY = 0.05
+TEXT_REPLY = ["Listing ", "files:\n", "```shell\n", "ls -la\n", "```\n", "Done."]
+TOOL_ARGUMENTS = ['{"language": ', '"python", ', '"code": "print(', "1 + 1", ')"}']
+
+
+def make_llm(port, tools):
+    llm = LLMWrapper(BolchaiSettings(
+        model="openai/bolchai-mock",
+        api_key="sk-mock",
+        api_base=f"http://127.0.0.1:{port}/v1",
+        max_tokens=256,
+    ))
+    llm.supports_functions = tools
+    return llm
+
+
+def converse(port, tools, question):
+    llm = make_llm(port, tools)
+    messages = [{"role": "user", "type": "message", "content": question}]
+    start = time.perf_counter()
+    chunks = list(llm.run("You are a test.", messages))
+    return time.perf_counter() - start, chunks, llm.stats.get("cache")
+
+
+async def aconverse(port, tools, question):
+    llm = make_llm(port, tools)
+    messages = [{"role": "user", "type": "message", "content": question}]
+    start = time.perf_counter()
+    chunks = [chunk async for chunk in llm.arun("You are a test.", messages)]
+    return time.perf_counter() - start, chunks, llm.stats.get("cache")
+
+
+def compare(label, first, second):
+    (cold, cold_chunks, cold_state), (warm, warm_chunks, warm_state) = first, second
+    same = "same chunks" if cold_chunks == warm_chunks else "CHUNKS DIFFER"
+    print(f"{label:<12} {cold_state} {cold * 1000:6.0f} ms   {warm_state} {warm * 1000:6.1f} ms   "
+          f"{len(warm_chunks)} LMC chunks, {same}")
+
+
+def configure(path, mb=256, ttl=3600.0):
+    config = SidecarSettings(llm_cache=True, llm_cache_mb=mb, llm_cache_ttl=ttl)
+    completion_cache.configure(config, path)
+
+
+def main():
+    mock = partial(openai_mock, reply=TEXT_REPLY, tool_arguments=TOOL_ARGUMENTS, token_delay=TOKEN_DELAY)
+    with serving(mock) as port:
+        configure(tempfile.mkdtemp(prefix="bolchai_llm_cache_"))
+        for tools in (False, True):
+            label = "tool call" if tools else "text"
+            compare(label, converse(port, tools, "sync"), converse(port, tools, "sync"))
+
+        async def both():
+            return await aconverse(port, True, "async"), await aconverse(port, True, "async")
+        compare("async", *asyncio.run(both()))
+        stats = completion_cache.stats()
+        print(f"hits {stats['hits']}, misses {stats['misses']}, entries {stats['entries']}, {stats['bytes']} bytes")
+
+        configure(tempfile.mkdtemp(prefix="bolchai_llm_cache_"), ttl=0.2)
+        converse(port, False, "ttl")
+        time.sleep(0.3)
+        print(f"after the TTL: {converse(port, False, 'ttl')[2]}")
+
+        # Room for about one entry
+        configure(tempfile.mkdtemp(prefix="bolchai_llm_cache_"))
+        converse(port, False, "first")
+        completion_cache.max_bytes = completion_cache.stats()["bytes"] * 3 // 2
+        converse(port, False, "second")
+        print(f"over the size cap: first again {converse(port, False, 'first')[2]}")
+
+        completion_cache.enabled = False
+        print(f"cache off: {converse(port, False, 'sync')[2]}")
+
+
+if __name__ == "__main__":
+    main()
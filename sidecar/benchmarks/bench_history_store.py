@@ -0,0 +1,107 @@
+"""
+The SQLite conversation store: cost on the streaming path, batching,
+rehydration after a restart and history paging.
+
+A fake LLM answers every turn with a shell block, so each turn adds four
+messages. Turns run against a store, the store is closed (a restart), and
+a fresh SessionManager on the same file must continue the conversation.
+Then one session gets a 20,000-message history, and the script times a
+full rehydrate against fetching one page.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_history_store [turns]
+"""
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("BOLCHAI_KERNEL_POOL_SIZE", "0")
+
+from config import BolchaiSettings, SidecarSettings
+from engine.history import MessageStore
+from engine.llm import LLMWrapper
+from engine.sessions import SessionManager
+
+LONG_HISTORY = 20000
+
+
+def fake_run(self, system_message, messages, converter=None):
+    if messages[-1]["role"] == "computer":
+        yield {"type": "message", "content": "Done."}
+        return
+    yield {"type": "message", "content": "Running it."}
+    yield {"type": "code", "format": "shell", "content": "echo hi", "start": True}
+
+
+def turns(sessions, session_id, count):
+    interpreter = sessions.get(session_id)
+    start = time.perf_counter()
+    for i in range(count):
+        for _ in interpreter.chat(f"turn {i}"):
+            pass
+    return time.perf_counter() - start
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    LLMWrapper.run = fake_run
+    settings = BolchaiSettings(auto_run=True)
+    config = SidecarSettings()
+    path = os.path.join(tempfile.mkdtemp(prefix="bolchai_history_"), "history.db")
+
+    baseline = SessionManager(settings, config)
+    try:
+        plain = turns(baseline, "s", count)
+    finally:
+        baseline.shutdown()
+
+    store = MessageStore(path)
+    sessions = SessionManager(settings, config, store)
+    try:
+        stored = turns(sessions, "s", count)
+        before_restart = list(sessions.get("s").messages)
+    finally:
+        sessions.shutdown()
+        store.close()
+    print(f"{count} turns: in memory {plain:.2f} s, with store {stored:.2f} s")
+    print(f"writes {store.writes} in {store.batches} transactions")
+
+    # Restart: a new store and manager on the same file
+    store = MessageStore(path)
+    sessions = SessionManager(settings, config, store)
+    try:
+        interpreter = sessions.get("s")
+        print(f"before first turn after restart: {len(interpreter.messages)} messages loaded")
+        for _ in interpreter.chat("after restart"):
+            pass
+        carried = interpreter.messages[:len(before_restart)] == before_restart
+        print(f"after it: {len(interpreter.messages)} messages, history carried over: {carried}")
+
+        for seq in range(LONG_HISTORY):
+            store.put("long", seq, {"role": "user", "type": "message", "content": f"message {seq} " * 8})
+        store.flush()
+        start = time.perf_counter()
+        loaded = store.load("long")
+        full = time.perf_counter() - start
+        start = time.perf_counter()
+        page = store.page("long", limit=50)
+        newest = time.perf_counter() - start
+        start = time.perf_counter()
+        older = store.page("long", before=page[0][0], limit=50)
+        paged = time.perf_counter() - start
+        print(f"{len(loaded)}-message history: full load {full * 1000:.0f} ms, "
+              f"newest page {newest * 1000:.2f} ms, next page {paged * 1000:.2f} ms "
+              f"(seq {older[0][0]}-{older[-1][0]})")
+
+        interpreter.reset()
+        store.flush()
+        print(f"after reset: {len(store.load('s'))} stored messages in the current conversation")
+    finally:
+        sessions.shutdown()
+        store.close()
+    print(f"database {os.path.getsize(path) / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+Round-trip time of trivial cells through PythonKernel.
+
+Compares the current blocking iopub capture with the previous approach
+(per-run listener thread polling every 50 ms plus fixed sleeps in the
+consumer), reproduced here against the same kernel. Then times arun()
+and checks that the batch left nothing queued on the sync client's iopub
+channel, which no one reads while arun() runs code.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_kernel_roundtrip [cells]
+"""
+import asyncio
+import queue
+import statistics
+import sys
+import threading
+import time
+
+from execution.python_kernel import PythonKernel
+
+
+def legacy_run(kernel, code):
+    """The pre-change capture loop: listener thread + sleep/poll consumer."""
+    message_queue = queue.Queue()
+    finished = threading.Event()
+
+    def iopub_listener():
+        while True:
+            try:
+                msg = kernel.kc.iopub_channel.get_msg(timeout=0.05)
+            except queue.Empty:
+                continue
+            if (
+                msg["header"]["msg_type"] == "status"
+                and msg["content"]["execution_state"] == "idle"
+            ):
+                finished.set()
+                return
+            chunk = kernel._output_chunk(msg["msg_type"], msg["content"])
+            if chunk is not None:
+                message_queue.put(chunk)
+
+    threading.Thread(target=iopub_listener).start()
+    kernel.kc.execute(code)
+
+    while True:
+        time.sleep(0.05)
+        try:
+            yield message_queue.get(timeout=0.1)
+        except queue.Empty:
+            if finished.is_set():
+                time.sleep(0.1)
+                try:
+                    yield message_queue.get(timeout=0.1)
+                except queue.Empty:
+                    break
+
+
+def measure(run, cells):
+    timings = []
+    for i in range(cells):
+        start = time.perf_counter()
+        for _ in run(f"print({i})"):
+            pass
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+async def ameasure(kernel, cells):
+    timings = []
+    for i in range(cells):
+        start = time.perf_counter()
+        async for _ in kernel.arun(f"print({i})"):
+            pass
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def stale_iopub(kernel):
+    """Messages waiting unread on the sync client's iopub channel."""
+    channel = kernel.kc.iopub_channel
+    stale = 0
+    while channel.is_alive():
+        try:
+            channel.get_msg(timeout=0)
+        except queue.Empty:
+            break
+        stale += 1
+    return stale
+
+
+def report(label, timings):
+    timings = sorted(timings)
+    p95 = timings[int(len(timings) * 0.95) - 1]
+    print(
+        f"{label:<10} median {statistics.median(timings):7.1f} ms   "
+        f"p95 {p95:7.1f} ms   total {sum(timings) / 1000:6.2f} s"
+    )
+
+
+def main():
+    cells = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    kernel = PythonKernel()
+    try:
+        # Warm both paths once so imports and caches don't skew the first cell
+        measure(lambda code: legacy_run(kernel, code), 2)
+        measure(kernel.run, 2)
+
+        print(f"{cells} trivial cells")
+        report("before", measure(lambda code: legacy_run(kernel, code), cells))
+        report("after", measure(kernel.run, cells))
+        report("async", asyncio.run(ameasure(kernel, cells)))
+        stale = stale_iopub(kernel)
+        print(f"{stale} stale iopub messages on the sync client after the async cells")
+        if stale:
+            raise SystemExit(1)
+    finally:
+        kernel.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Concurrent LLM streams: threads versus coroutines.
+
+Starts a mock OpenAI-compatible server that streams a fixed reply slowly,
+then runs many conversations against it at once. "threads" drives
+LLMWrapper.run from the /chat worker pool, as the sync path does; "async"
+awaits LLMWrapper.arun on the event loop. Reports wall time, median time to
+first token and the peak number of threads.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_llm_concurrency [conversations]
+"""
+import asyncio
+import statistics
+import sys
+import threading
+import time
+from functools import partial
+
+from api.routes import executor
+from benchmarks.mock_llm import openai_mock, serving
+from config import BolchaiSettings
+from engine.llm import LLMWrapper
+
+REPLY_TOKENS = 10
+TOKEN_DELAY = 0.2
+
+
+def make_llm(port):
+    return LLMWrapper(BolchaiSettings(
+        model="openai/bolchai-mock",
+        api_key="sk-mock",
+        api_base=f"http://127.0.0.1:{port}/v1",
+        max_tokens=256,
+    ))
+
+
+MESSAGES = [{"role": "user", "type": "message", "content": "Say something."}]
+
+
+class ThreadPeak:
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+
+    def _watch(self):
+        while not self._stop.wait(0.01):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+async def run_threads(port, conversations):
+    def converse():
+        start = time.perf_counter()
+        first = None
+        for _ in make_llm(port).run("You are a test.", MESSAGES):
+            if first is None:
+                first = time.perf_counter() - start
+        return first
+
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(
+        loop.run_in_executor(executor, converse) for _ in range(conversations)
+    ))
+
+
+async def run_async(port, conversations):
+    async def converse():
+        start = time.perf_counter()
+        first = None
+        async for _ in make_llm(port).arun("You are a test.", MESSAGES):
+            if first is None:
+                first = time.perf_counter() - start
+        return first
+
+    return await asyncio.gather(*(converse() for _ in range(conversations)))
+
+
+async def compare(port, conversations):
+    # Warm up litellm's clients so neither side pays for imports. litellm
+    # keeps its async client per loop, so everything runs in this one.
+    await run_threads(port, 1)
+    await run_async(port, 1)
+
+    ideal = REPLY_TOKENS * TOKEN_DELAY
+    print(f"{conversations} conversations, {REPLY_TOKENS} tokens each, {ideal:.1f} s per stream")
+    for label, run in (("threads", run_threads), ("async", run_async)):
+        with ThreadPeak() as threads:
+            start = time.perf_counter()
+            firsts = await run(port, conversations)
+            elapsed = time.perf_counter() - start
+        print(
+            f"{label:<8} {elapsed:6.2f} s wall   first token p50 "
+            f"{statistics.median(firsts) * 1000:7.0f} ms   peak threads {threads.peak}"
+        )
+
+
+def main():
+    conversations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    reply = [f"tok{i} " for i in range(REPLY_TOKENS)]
+    with serving(partial(openai_mock, reply=reply, token_delay=TOKEN_DELAY)) as port:
+        asyncio.run(compare(port, conversations))
+
+
+if __name__ == "__main__":
+    main()
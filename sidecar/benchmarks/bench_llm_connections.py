@@ -0,0 +1,87 @@
+"""
+Keep-alive LLM connections: new connections and time to first token per turn.
+
+Starts a mock OpenAI-compatible server that counts the TCP connections
+it accepts. Then it runs a few turns, pausing between them for longer
+than httpx keeps an idle connection by default (5 s). The turns run on
+the async and the sync path, first with litellm's default clients and
+then with the pooled client, which is warmed first as the sidecar does at
+startup. The mock is plain HTTP on localhost, so connect_ms is small
+here. Against a real endpoint, every new connection also pays DNS and a
+TLS handshake.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_llm_connections [turns] [pause]
+"""
+import asyncio
+import json
+import sys
+
+import httpx
+
+from benchmarks.mock_llm import openai_mock, serving
+from config import BolchaiSettings, SidecarSettings
+from engine.http_clients import llm_clients
+from engine.llm import LLMWrapper
+
+MESSAGES = [{"role": "user", "type": "message", "content": "Say something."}]
+
+
+def connections(port):
+    return httpx.get(f"http://127.0.0.1:{port}/connections").json()
+
+
+async def turns(settings, port, count, pause, pooled, sync=False):
+    llm = LLMWrapper(settings)
+    if pooled and sync:
+        await asyncio.to_thread(llm_clients.warm, settings)
+    elif pooled:
+        await llm_clients.awarm(settings)
+    before = await asyncio.to_thread(connections, port)
+    timings = []
+    for turn in range(count):
+        if turn:
+            await asyncio.sleep(pause)
+        if sync:
+            await asyncio.to_thread(lambda: list(llm.run("You are a test.", MESSAGES)))
+        else:
+            async for _ in llm.arun("You are a test.", MESSAGES):
+                pass
+        timings.append(llm.stats["timing"])
+    opened = await asyncio.to_thread(connections, port) - before
+    label = ("pooled" if pooled else "litellm") + (" sync" if sync else "")
+    ttfts = " ".join(f"{timing['ttft_ms']:6.1f}" for timing in timings)
+    print(f"{label:<13} {opened} new connections over {count} turns   ttft ms: {ttfts}")
+    if pooled:
+        for turn, timing in enumerate(timings):
+            print(f"  turn {turn}: reused {timing['reused']}, connect {timing['connect_ms']} ms, "
+                  f"wait {timing['wait_ms']} ms")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    pause = float(sys.argv[2]) if len(sys.argv) > 2 else 6.0
+    with serving(openai_mock, timeout_keep_alive=300) as port:
+        settings = BolchaiSettings(
+            model="openai/bolchai-mock", api_key="sk-mock",
+            api_base=f"http://127.0.0.1:{port}/v1", max_tokens=64,
+        )
+        llm_clients.configure(SidecarSettings())
+        client = llm_clients.client
+
+        async def compare():
+            # litellm's own clients first: the pool hands out none
+            llm_clients.client = lambda *args: None
+            await turns(settings, port, count, pause, pooled=False)
+            await turns(settings, port, count, pause, pooled=False, sync=True)
+            llm_clients.client = client
+            await turns(settings, port, count, pause, pooled=True)
+            await turns(settings, port, count, pause, pooled=True, sync=True)
+
+        asyncio.run(compare())
+        print(json.dumps(llm_clients.stats()["endpoints"]))
+        llm_clients.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Fallback routing against misbehaving endpoints.
+
+Starts one mock OpenAI-compatible server whose URL path picks its
+behaviour: /ok/v1 answers normally, /slow/v1 waits before the first
+token, /error/v1 returns 500, /stall/v1 and /stallcode/v1 go quiet
+before or inside the reply's code block, and /other/v1 answers with
+different text. /flaky/v1 answers until told to fail, then
+returns 500, and /lag/v1 is slow but within the deadline. Each scenario sets a primary
+and a fallback, then prints time to first token, total time, the
+endpoint that answered and whether the text came out whole. The
+first-token deadline and the stall timeout are both 0.5 s. The first
+scenario's text is the reference for "whole reply".
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_llm_failover
+"""
+import asyncio
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.mock_llm import SSE_DONE, chunk_event, serving, tool_call_deltas
+from config import BolchaiSettings, ModelEndpoint, SidecarSettings
+from engine.routing import llm_router
+from engine.llm import LLMWrapper
+
+REPLY = ["The ", "answer:\n", "```python\n", "print(6 ", "* 7)\n", "```\n", "Done."]
+OTHER = ["Forty-two ", "it ", "is."]
+TOOL = ['{"language": ', '"python", ', '"code": "', "print(6 ", "* 7)", '"}']
+# Wait before the first token: past the deadline, or within it
+FIRST_TOKEN = {"slow": 3.0, "lag": 0.3}
+# Chunks sent before going quiet: before the code fence, or inside it
+STALL_AT = {"stall": 2, "stallcode": 4}
+MESSAGES = [{"role": "user", "type": "message", "content": "What is the answer?"}]
+
+
+def mock_server():
+    app = FastAPI()
+    counts = {}
+    flaky = {"failing": False}
+
+    # The scenario tag keeps each scenario's endpoints apart in the router
+    @app.post("/{mode}/{tag}/v1/chat/completions")
+    async def completions(mode: str, tag: str, request: Request):
+        counts[mode] = counts.get(mode, 0) + 1
+        body = await request.json()
+        if mode == "error" or (mode == "flaky" and flaky["failing"]):
+            return JSONResponse({"error": {"message": "overloaded"}}, status_code=500)
+        tools = bool(body.get("tools"))
+        if tools:
+            deltas = tool_call_deltas(TOOL)
+        else:
+            deltas = [{"content": part} for part in (OTHER if mode == "other" else REPLY)]
+
+        async def stream():
+            await asyncio.sleep(FIRST_TOKEN.get(mode, 0))
+            for i, delta in enumerate(deltas):
+                if i == STALL_AT.get(mode):
+                    await asyncio.sleep(3600)
+                await asyncio.sleep(0.02)
+                yield chunk_event(delta)
+            yield SSE_DONE
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.post("/flaky")
+    async def break_flaky():
+        flaky["failing"] = True
+
+    @app.get("/counts")
+    async def get_counts():
+        return counts
+
+    return app
+
+
+def make_llm(port, tag, primary, fallback, tools=False):
+    base = f"http://127.0.0.1:{port}"
+    llm = LLMWrapper(BolchaiSettings(
+        model="openai/mock", api_key="sk-mock", api_base=f"{base}/{primary}/{tag}/v1", max_tokens=64,
+        fallbacks=[
+            ModelEndpoint(model="openai/mock", api_base=f"{base}/{fallback}/{tag}/v1", api_key="sk-mock")
+        ] if fallback else [],
+    ))
+    llm.supports_functions = tools
+    return llm
+
+
+def text_of(chunks):
+    return "".join(chunk["content"] for chunk in chunks)
+
+
+EXPECTED = {}
+
+
+def report(label, start, first, chunks, llm, error=None):
+    total = time.perf_counter() - start
+    route = llm.stats.get("route", {})
+    answered = (route.get("endpoint") or "-").split("/")[-3] if route.get("endpoint") else "-"
+    text = text_of(chunks)
+    if error:
+        outcome = f"error: {error}"
+    elif text == EXPECTED.setdefault("text", text):
+        outcome = "whole reply"
+    else:
+        outcome = repr(text)
+    ttft = f"{(first - start) * 1000:6.0f}" if first else "     -"
+    print(f"{label:<30} ttft {ttft} ms  total {total * 1000:6.0f} ms  from {answered:<6} "
+          f"hedges {route.get('hedges', 0)} failovers {route.get('failovers', 0)}  {outcome}")
+
+
+def converse(label, llm):
+    start = time.perf_counter()
+    first, chunks, error = None, [], None
+    try:
+        for chunk in llm.run("You are a test.", MESSAGES):
+            first = first or time.perf_counter()
+            chunks.append(chunk)
+    except Exception as e:
+        error = e
+    report(label, start, first, chunks, llm, error)
+    return chunks
+
+
+async def aconverse(label, llm):
+    start = time.perf_counter()
+    first, chunks, error = None, [], None
+    try:
+        async for chunk in llm.arun("You are a test.", MESSAGES):
+            first = first or time.perf_counter()
+            chunks.append(chunk)
+    except Exception as e:
+        error = e
+    report(label, start, first, chunks, llm, error)
+    return chunks
+
+
+def main():
+    with serving(mock_server) as port:
+        llm_router.configure(SidecarSettings(llm_first_token_timeout=0.5, llm_stall_timeout=0.5))
+
+        converse("slow, no fallback", make_llm(port, "a", "slow", None))
+        converse("slow -> ok (hedged)", make_llm(port, "b", "slow", "ok"))
+        converse("slow again (ranked by ttft)", make_llm(port, "b", "slow", "ok"))
+        converse("error -> ok", make_llm(port, "c", "error", "ok"))
+        converse("stall -> ok (same text)", make_llm(port, "d", "stall", "ok"))
+        converse("stall -> other text", make_llm(port, "e", "stall", "other"))
+        converse("stall in code -> other", make_llm(port, "f", "stallcode", "other"))
+        chunks = converse("stall in tool call -> ok", make_llm(port, "g", "stall", "ok", tools=True))
+        code = "".join(chunk["content"] for chunk in chunks if chunk["type"] == "code")
+        print(f"{'':<30} code: {code!r}")
+
+        async def async_scenarios():
+            await aconverse("async slow -> ok (hedged)", make_llm(port, "h", "slow", "ok"))
+            await aconverse("async stall -> ok", make_llm(port, "i", "stall", "ok"))
+            await aconverse("async error -> slow", make_llm(port, "j", "error", "slow"))
+        asyncio.run(async_scenarios())
+
+        # An endpoint measured fastest that starts failing stays ranked
+        # first until three failures in a row open its breaker
+        converse("flaky, healthy", make_llm(port, "k", "flaky", "lag"))
+        httpx.post(f"http://127.0.0.1:{port}/flaky")
+        for _ in range(3):
+            converse("flaky failing -> lag", make_llm(port, "k", "flaky", "lag"))
+        before = httpx.get(f"http://127.0.0.1:{port}/counts").json()["flaky"]
+        converse("flaky again (breaker open)", make_llm(port, "k", "flaky", "lag"))
+        after = httpx.get(f"http://127.0.0.1:{port}/counts").json()["flaky"]
+        print(f"{'':<30} requests sent to the flaky endpoint: {after - before}")
+        for endpoint in llm_router.stats()["endpoints"]:
+            if "/k/" in endpoint["endpoint"]:
+                print(f"  {endpoint['endpoint'].split('//')[1]:<30} breaker {endpoint['breaker']:<9} "
+                      f"ttft {endpoint['ttft_ms']} ms, {endpoint['requests']} requests, "
+                      f"{endpoint['errors']} errors")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Cost of building the OpenAI payload over a long agentic session.
+
+Each turn adds a user message, an assistant message, a code block and its
+output, then makes one LLM call. "before" is the pipeline LLMWrapper.run
+used to run on every call: the system message prepended to a copy of the
+history, all of it converted by convert_to_openai_messages, then rewritten
+to tool calls by _process_messages_for_tools. Both are copied below as
+they were. "after" reuses one MessageConverter.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_message_conversion [turns]
+"""
+import json
+import sys
+import time
+
+from engine.conversion import MessageConverter
+from engine.system_message import build_system_message
+
+
+def convert_to_openai_messages(messages, function_calling=True):
+    """
+    Converts LMC messages into OpenAI API compatible messages: the
+    baseline, as it was in engine/utils.py.
+    """
+    new_messages = []
+
+    for message in messages:
+        new_message = {}
+
+        if message["type"] == "message":
+            new_message["role"] = message["role"]
+            new_message["content"] = message["content"]
+
+        elif message["type"] == "code":
+            new_message["role"] = "assistant"
+            if function_calling:
+                new_message["function_call"] = {
+                    "name": "execute",
+                    "arguments": json.dumps(
+                        {"language": message["format"], "code": message["content"]}
+                    ),
+                }
+                new_message["content"] = ""
+            else:
+                new_message["content"] = (
+                    f"```{message['format']}\n{message['content']}\n```"
+                )
+
+        elif message["type"] == "console" and message.get("format") == "output":
+            if function_calling:
+                new_message["role"] = "function"
+                new_message["name"] = "execute"
+                content = message.get("content", "")
+                if not isinstance(content, str):
+                    content = str(content)
+                new_message["content"] = content if content.strip() else "No output"
+            else:
+                new_message["role"] = "user"
+                content = message.get("content", "")
+                if content.strip():
+                    new_message["content"] = f"Code output:\n```\n{content}\n```"
+                else:
+                    new_message["content"] = "Code executed successfully (no output)."
+
+        elif message["type"] == "error":
+            continue
+
+        else:
+            continue
+
+        if isinstance(new_message.get("content"), str):
+            new_message["content"] = new_message["content"].strip()
+
+        if new_message:
+            new_messages.append(new_message)
+
+    # For non-function-calling models, combine adjacent same-role messages
+    if not function_calling:
+        combined = []
+        for msg in new_messages:
+            if combined and combined[-1]["role"] == msg["role"] and isinstance(msg.get("content"), str):
+                combined[-1]["content"] += "\n" + msg["content"]
+            else:
+                combined.append(msg)
+        new_messages = combined
+
+    return new_messages
+
+
+def _process_messages_for_tools(messages):
+    """Convert function_call format to tool_calls format: the baseline, as it was in engine/llm.py."""
+    processed = []
+    last_tool_id = 0
+
+    i = 0
+    while i < len(messages):
+        message = messages[i]
+
+        if message.get("function_call"):
+            last_tool_id += 1
+            tool_id = f"toolu_{last_tool_id}"
+            msg = dict(message)
+            function = msg.pop("function_call")
+            msg["tool_calls"] = [
+                {"id": tool_id, "type": "function", "function": function}
+            ]
+            processed.append(msg)
+
+            if i + 1 < len(messages) and messages[i + 1].get("role") == "function":
+                next_msg = dict(messages[i + 1])
+                next_msg["role"] = "tool"
+                next_msg["tool_call_id"] = tool_id
+                processed.append(next_msg)
+                i += 1
+            else:
+                processed.append(
+                    {"role": "tool", "tool_call_id": tool_id, "content": ""}
+                )
+        elif message.get("role") == "function":
+            last_tool_id += 1
+            tool_id = f"toolu_{last_tool_id}"
+            processed.append({
+                "role": "assistant",
+                "tool_calls": [{
+                    "id": tool_id,
+                    "type": "function",
+                    "function": {
+                        "name": "execute",
+                        "arguments": "{}",
+                    },
+                }],
+            })
+            msg = dict(message)
+            msg["role"] = "tool"
+            msg["tool_call_id"] = tool_id
+            processed.append(msg)
+        else:
+            processed.append(message)
+
+        i += 1
+
+    return processed
+
+
+def legacy_convert(system_message, history, function_calling):
+    """One call's conversion as respond() and LLMWrapper.run did it."""
+    rendered_system_message = {"role": "system", "type": "message", "content": system_message}
+    messages_for_llm = [rendered_system_message] + history.copy()
+    chat_messages = convert_to_openai_messages(messages_for_llm, function_calling=function_calling)[1:]
+    if function_calling:
+        chat_messages = _process_messages_for_tools(chat_messages)
+    return chat_messages
+
+
+def make_turn(i):
+    code = "\n".join(f"df_{i}_{j} = load('file_{j}.csv').describe()" for j in range(20))
+    return [
+        {"role": "user", "type": "message", "content": f"Step {i}: summarize the next file."},
+        {"role": "assistant", "type": "message", "content": "Let me look at it first. " * 10},
+        {"role": "assistant", "type": "code", "format": "python", "content": code},
+        {"role": "computer", "type": "console", "format": "output", "content": "count  mean  std\n" * 40},
+    ]
+
+
+def simulate(turns, function_calling, incremental):
+    system_message = build_system_message()
+    history = []
+    converter = MessageConverter()
+    start = time.perf_counter()
+    for i in range(turns):
+        history.extend(make_turn(i))
+        if incremental:
+            converter.convert(history, function_calling)
+        else:
+            legacy_convert(system_message, history, function_calling)
+    return time.perf_counter() - start
+
+
+def main():
+    turns = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"{turns} turns, one LLM call per turn")
+    for function_calling in (True, False):
+        mode = "tool calls" if function_calling else "text"
+        for label, incremental in (("before", False), ("after", True)):
+            elapsed = simulate(turns, function_calling, incremental)
+            print(
+                f"{mode:<10} {label:<7} {elapsed * 1000:9.1f} ms total   "
+                f"{elapsed / turns * 1e6:9.1f} us/call"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Two independent tool calls in one response versus one call per response.
+
+A fake LLM takes ROUND_TRIP seconds per reply. "one per reply" asks for a
+shell command, waits for its output, then asks for a Python cell, as a
+single-call model has to; "parallel" asks for both at once, so they run
+side by side on their own executors and the model needs one turn fewer.
+Each step sleeps for STEP seconds. Also checks that the converter answers
+each call with its own tool message.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_parallel_tool_calls
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault("BOLCHAI_KERNEL_POOL_SIZE", "0")
+
+from config import BolchaiSettings
+from engine.interpreter import BolchaiInterpreter
+from engine.llm import LLMWrapper
+
+ROUND_TRIP = 0.5
+STEP = 1.0
+
+SHELL = {"type": "code", "format": "shell", "content": f"sleep {STEP}; echo from-shell", "start": True}
+PYTHON = {"type": "code", "format": "python", "content": f"import time; time.sleep({STEP}); print('from-python')", "start": True}
+
+
+round_trips = 0
+
+
+async def parallel_arun(self, system_message, messages, converter=None):
+    global round_trips
+    round_trips += 1
+    await asyncio.sleep(ROUND_TRIP)
+    if messages[-1]["role"] == "computer":
+        yield {"type": "message", "content": "Done."}
+        return
+    yield SHELL
+    yield PYTHON
+
+
+async def serial_arun(self, system_message, messages, converter=None):
+    global round_trips
+    round_trips += 1
+    await asyncio.sleep(ROUND_TRIP)
+    calls = sum(1 for m in messages if m["type"] == "code")
+    if calls == 0:
+        yield SHELL
+    elif calls == 1:
+        yield PYTHON
+    else:
+        yield {"type": "message", "content": "Done."}
+
+
+async def one_turn(label, arun, interpreter):
+    global round_trips
+    LLMWrapper.arun = arun
+    round_trips = 0
+    interpreter.reset()
+    # Start both executors first so kernel start-up isn't measured
+    await asyncio.to_thread(interpreter.get_language, "python")
+    await asyncio.to_thread(interpreter.get_language, "shell")
+
+    start = time.perf_counter()
+    async for _ in interpreter.achat("Check both."):
+        pass
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {elapsed:5.2f} s  LLM round trips {round_trips}")
+    return interpreter.converter.convert(interpreter.messages)
+
+
+async def compare():
+    interpreter = BolchaiInterpreter(BolchaiSettings(auto_run=True))
+    interpreter.llm.supports_functions = True
+    try:
+        await one_turn("one per reply", serial_arun, interpreter)
+        converted = await one_turn("parallel", parallel_arun, interpreter)
+    finally:
+        interpreter.cleanup()
+
+    calls = [m for m in converted if m.get("tool_calls")]
+    replies = [m for m in converted if m["role"] == "tool"]
+    print(f"parallel turn: {len(calls)} assistant message with {len(calls[0]['tool_calls'])} calls")
+    for call, reply in zip(calls[0]["tool_calls"], replies):
+        print(f"  {call['id']} -> {reply['tool_call_id']}: {reply['content']!r}")
+
+
+def main():
+    asyncio.run(compare())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Turns from several sessions against a provider's tokens-per-minute limit.
+
+Starts a mock OpenAI-compatible server that charges each request its
+prompt plus max_tokens against a 60,000 tokens-per-minute bucket. The
+server sends x-ratelimit-* headers, and returns 429 with Retry-After
+when a request doesn't fit. One busy session then sends 36 turns at
+once, and three other sessions send two each: 42 turns, about 30 of
+which fit in the bucket.
+
+With the scheduler off, requests beyond the bucket rely on the OpenAI
+client's two retries, and the ones still refused end their turn. With
+the scheduler on, one turn first learns the limit from the headers.
+Then the rest wait for room, the other sessions taking turns with the
+busy one. Each run prints turns answered and failed, the 429s the
+server sent, and when each session's last turn finished. Each run uses
+its own bucket on the server.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_rate_limits
+"""
+import asyncio
+import math
+import time
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.mock_llm import SSE_DONE, chunk_event, serving
+from config import BolchaiSettings, SidecarSettings
+from engine.llm import LLMWrapper
+from engine.rate_limits import llm_scheduler
+
+TPM = 60000
+MAX_TOKENS = 2000
+BUSY_TURNS = 36
+OTHER_SESSIONS = 3
+OTHER_TURNS = 2
+REPLY = ["Rate ", "limited ", "reply."]
+
+
+def mock_server():
+    app = FastAPI()
+    buckets = {}
+    refused = {}
+
+    @app.post("/{tag}/v1/chat/completions")
+    async def completions(tag: str, request: Request):
+        body = await request.json()
+        # Charged as OpenAI does: a rough prompt count plus max_tokens
+        text = sum(len(str(message.get("content", ""))) for message in body["messages"])
+        cost = body.get("max_tokens", 0) + text // 4 + 4 * len(body["messages"])
+        now = time.monotonic()
+        level, updated = buckets.get(tag, (TPM, now))
+        level = min(TPM, level + (now - updated) * TPM / 60)
+        if cost > level:
+            buckets[tag] = (level, now)
+            refused[tag] = refused.get(tag, 0) + 1
+            wait = math.ceil((cost - level) * 60 / TPM)
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached for tokens per min", "type": "tokens"}},
+                status_code=429,
+                headers={"retry-after": str(wait), **limit_headers(level, TPM)},
+            )
+        level -= cost
+        buckets[tag] = (level, now)
+
+        async def stream():
+            for part in REPLY:
+                await asyncio.sleep(0.02)
+                yield chunk_event({"content": part})
+            yield SSE_DONE
+
+        return StreamingResponse(stream(), media_type="text/event-stream", headers=limit_headers(level, TPM))
+
+    @app.get("/refused/{tag}")
+    async def get_refused(tag: str):
+        return refused.get(tag, 0)
+
+    return app
+
+
+def limit_headers(level, limit):
+    # Seconds until the bucket is full again, as OpenAI writes them
+    reset = (limit - level) * 60 / limit
+    return {
+        "x-ratelimit-limit-tokens": str(limit),
+        "x-ratelimit-remaining-tokens": str(max(0, int(level))),
+        "x-ratelimit-reset-tokens": f"{reset:.3f}s",
+    }
+
+
+def make_llm(port, tag):
+    llm = LLMWrapper(BolchaiSettings(
+        model="openai/mock", api_key="sk-mock", api_base=f"http://127.0.0.1:{port}/{tag}/v1",
+        max_tokens=MAX_TOKENS,
+    ))
+    llm.supports_functions = False
+    return llm
+
+
+async def turn(llm, session, start, results):
+    messages = [{"role": "user", "type": "message", "content": f"Hello from {session}"}]
+    try:
+        async for _ in llm.arun("You are a test.", messages):
+            pass
+        ok = True
+    except Exception:
+        ok = False
+    results.append((session, ok, time.perf_counter() - start))
+
+
+async def run(label, port, tag, warm):
+    if warm:
+        # One turn first, so the scheduler knows the limit before the burst
+        await turn(make_llm(port, tag), "warm", time.perf_counter(), [])
+    start = time.perf_counter()
+    results = []
+    busy = make_llm(port, tag)
+    turns = [turn(busy, "busy", start, results) for _ in range(BUSY_TURNS)]
+    for i in range(OTHER_SESSIONS):
+        llm = make_llm(port, tag)
+        turns += [turn(llm, f"session {i + 1}", start, results) for _ in range(OTHER_TURNS)]
+    await asyncio.gather(*turns)
+    total = time.perf_counter() - start
+
+    answered = sum(ok for _, ok, _ in results)
+    async with httpx.AsyncClient() as client:
+        refused = (await client.get(f"http://127.0.0.1:{port}/refused/{tag}")).json()
+    print(f"{label}: {answered}/{len(results)} turns answered, {len(results) - answered} failed, "
+          f"{refused} 429s from the server, {total:.1f} s")
+    sessions = {}
+    for session, ok, finished in results:
+        sessions.setdefault(session, []).append((ok, finished))
+    for session, turns in sessions.items():
+        failed = sum(not ok for ok, _ in turns)
+        print(f"  {session:<10} last turn done at {max(finished for _, finished in turns):5.1f} s"
+              + (f", {failed} failed" if failed else ""))
+
+
+def main():
+    with serving(mock_server, backlog=256) as port:
+        llm_scheduler.configure(SidecarSettings(llm_rate_limits=False))
+        asyncio.run(run("scheduler off", port, "off", warm=False))
+        llm_scheduler.configure(SidecarSettings(llm_rate_limits=True))
+        asyncio.run(run("scheduler on", port, "on", warm=True))
+        for endpoint in llm_scheduler.stats()["endpoints"]:
+            print(f"  limits learned: {endpoint['tpm']} tokens/min, {endpoint['throttled']} 429s seen, "
+                  f"{endpoint['wait_s']} s queued in total")
+
+
+if __name__ == "__main__":
+    main()
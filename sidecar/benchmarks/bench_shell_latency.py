@@ -0,0 +1,68 @@
+"""
+Latency of short shell blocks: a new process per block versus the
+persistent shell session.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_shell_latency [blocks]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from execution.subprocess_lang import PowerShellLanguage, ShellLanguage
+
+
+def spawn_per_block(argv_prefix, code):
+    """The previous behaviour: one fresh process for every code block."""
+    proc = subprocess.Popen(
+        argv_prefix + [code],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        bufsize=1,
+    )
+    for line in iter(proc.stdout.readline, ""):
+        yield line
+    proc.wait()
+
+
+def measure(run, blocks):
+    timings = []
+    for i in range(blocks):
+        start = time.perf_counter()
+        for _ in run(f"echo block {i}"):
+            pass
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def report(label, timings):
+    print(f"{label:<22} median {statistics.median(timings):7.2f} ms   max {max(timings):7.2f} ms")
+
+
+def main():
+    blocks = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    if os.name == "nt":
+        cases = [
+            ("cmd", ["cmd", "/c"], ShellLanguage),
+            ("powershell", ["powershell", "-Command"], PowerShellLanguage),
+        ]
+    else:
+        cases = [("bash", ["bash", "-c"], ShellLanguage)]
+
+    print(f"{blocks} blocks of `echo`")
+    for name, argv_prefix, language in cases:
+        report(f"{name} spawn-per-block", measure(lambda code: spawn_per_block(argv_prefix, code), blocks))
+        shell = language()
+        try:
+            # The first block pays for starting the shell; report it separately
+            report(f"{name} persistent (1st)", measure(shell.run, 1))
+            report(f"{name} persistent", measure(shell.run, blocks))
+        finally:
+            shell.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Time from the end of a streamed Python block to its first output, with and
+without speculative executor warm-up.
+
+A fake LLM streams a short Python block over about two seconds, about the
+pace of a real model. Each run uses a fresh session and no kernel pool, so
+the kernel starts cold. A final run denies the confirmation to show a
+wasted warm-up being counted and torn down.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_speculative_warmup [runs]
+"""
+import statistics
+import sys
+import threading
+import time
+
+from config import BolchaiSettings
+from engine.interpreter import BolchaiInterpreter, warmup_limiter
+from engine.llm import LLMWrapper
+
+CODE_TOKENS = ["import ", "math", "\n", "print", "(", "math", ".", "pi", ")", "\n"] * 4
+TOKEN_DELAY = 0.05
+
+
+def fake_run(self, system_message, messages, converter=None):
+    if messages[-1]["role"] == "computer":
+        yield {"type": "message", "content": "Done."}
+        return
+    yield {"type": "message", "content": "Let me compute that."}
+    for i, token in enumerate(CODE_TOKENS):
+        time.sleep(TOKEN_DELAY)
+        chunk = {"type": "code", "format": "python", "content": token}
+        if i == 0:
+            chunk["start"] = True
+        yield chunk
+    fake_run.finished = time.perf_counter()
+
+
+def one_turn(auto_run=True, approve=True):
+    """Returns (seconds from last code token to first output, warmup stats)."""
+    interpreter = BolchaiInterpreter(BolchaiSettings(auto_run=auto_run))
+    first_output = None
+    try:
+        for chunk in interpreter.chat("What is pi?"):
+            if chunk.get("type") == "confirmation":
+                threading.Timer(0.1, interpreter.confirm, args=(approve,)).start()
+            if chunk.get("type") == "console" and first_output is None:
+                first_output = time.perf_counter()
+        stats = dict(interpreter.warmup_stats)
+        live = interpreter.kernel_count()
+    finally:
+        interpreter.cleanup()
+    latency = first_output - fake_run.finished if first_output else None
+    return latency, stats, live
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    LLMWrapper.run = fake_run
+    stream_time = len(CODE_TOKENS) * TOKEN_DELAY
+    print(f"code streams for {stream_time:.1f} s; cold kernel each run")
+
+    for label, limit in (("no warm-up", 0), ("warm-up", 2)):
+        warmup_limiter.limit = limit
+        latencies = [one_turn()[0] for _ in range(runs)]
+        print(f"{label:<11} end of code -> first output  median {statistics.median(latencies) * 1000:7.0f} ms")
+
+    warmup_limiter.limit = 2
+    _, stats, live = one_turn(auto_run=False, approve=False)
+    print(f"denied run: warmups {stats}, executors left running {live}")
+
+
+if __name__ == "__main__":
+    main()
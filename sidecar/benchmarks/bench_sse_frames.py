@@ -0,0 +1,88 @@
+"""
+SSE framing cost for a fast token stream.
+
+A worker thread pushes 10k one-token deltas through a ChunkChannel as fast
+as it can, and the loop turns them into encoded SSE events, as /chat does.
+"before" sends one json.dumps event per chunk; "after" coalesces adjacent
+deltas and uses the fast encoder. Reports events sent, events/s, tokens/s
+and CPU time per 10k tokens.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_sse_frames [tokens]
+"""
+import asyncio
+import json
+import sys
+import threading
+import time
+
+from sse_starlette.sse import ServerSentEvent
+
+from api.streaming import ChunkChannel, encode_chunk, orjson
+
+
+def make_stream(tokens):
+    """A turn of prose, a code block and its output, one token per chunk."""
+    chunks = []
+    third = tokens // 3
+    for i in range(third):
+        chunks.append({"role": "assistant", "type": "message", "content": f" word{i}"})
+    chunks.append({"role": "assistant", "type": "code", "format": "python", "content": "", "start": True})
+    for i in range(third):
+        chunks.append({"role": "assistant", "type": "code", "format": "python", "content": f"x{i} = {i}\n"})
+    chunks.append({"role": "assistant", "type": "code", "format": "python", "content": "", "end": True})
+    for i in range(tokens - 2 * third):
+        chunks.append({"role": "computer", "type": "console", "format": "output", "content": f"line {i}\n"})
+    return chunks
+
+
+async def serve(chunks, coalesce_window):
+    loop = asyncio.get_running_loop()
+    channel = ChunkChannel(loop)
+
+    def produce():
+        for chunk in chunks:
+            channel.put(chunk)
+        channel.close()
+
+    events = 0
+    wire_bytes = 0
+    threading.Thread(target=produce).start()
+    if coalesce_window is None:
+        while (chunk := await channel.get()) is not None:
+            wire_bytes += len(ServerSentEvent(data=json.dumps(chunk)).encode())
+            events += 1
+    else:
+        async for chunk in channel.frames(coalesce_window):
+            wire_bytes += len(ServerSentEvent(data=encode_chunk(chunk)).encode())
+            events += 1
+    return events, wire_bytes
+
+
+def measure(chunks, coalesce_window):
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    events, wire_bytes = asyncio.run(serve(chunks, coalesce_window))
+    return events, wire_bytes, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def main():
+    tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    chunks = make_stream(tokens)
+    print(f"{len(chunks)} chunks, encoder: {'orjson' if orjson else 'json'}")
+    cases = [
+        ("before", None),
+        ("coalesce 0 ms", 0.0),
+        ("coalesce 15 ms", 0.015),
+    ]
+    for label, window in cases:
+        events, wire_bytes, wall, cpu = measure(chunks, window)
+        print(
+            f"{label:<15} {events:6d} events  {events / wall:9.0f} events/s  "
+            f"{len(chunks) / wall:9.0f} tokens/s  "
+            f"{cpu / tokens * 10000 * 1000:7.1f} ms CPU/10k tokens  {wire_bytes / 1024:7.0f} KiB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Cost of turning streamed tool-call arguments into code deltas.
+
+"before" accumulates the arguments string and re-parses it with
+parse_partial_json on every delta, as _run_tool_calling_llm used to.
+"after" feeds each delta to ToolArgumentsParser.
+
+Run from the sidecar directory:
+    python -m benchmarks.bench_tool_arguments [payload_kb] [delta_chars]
+"""
+import json
+import sys
+import time
+
+from engine.parsers import ToolArgumentsParser
+
+
+def parse_partial_json(s):
+    """
+    Parses incomplete/malformed JSON from streaming LLM responses: the
+    baseline, as it was in engine/utils.py.
+    """
+    try:
+        return json.loads(s)
+    except Exception:
+        pass
+
+    new_s = ""
+    stack = []
+    is_inside_string = False
+    escaped = False
+
+    for char in s:
+        if is_inside_string:
+            if char == '"' and not escaped:
+                is_inside_string = False
+            elif char == "\n" and not escaped:
+                char = "\\n"
+            elif char == "\\":
+                escaped = not escaped
+            else:
+                escaped = False
+        else:
+            if char == '"':
+                is_inside_string = True
+                escaped = False
+            elif char == "{":
+                stack.append("}")
+            elif char == "[":
+                stack.append("]")
+            elif char == "}" or char == "]":
+                if stack and stack[-1] == char:
+                    stack.pop()
+                else:
+                    return None
+
+        new_s += char
+
+    if is_inside_string:
+        new_s += '"'
+
+    for closing_char in reversed(stack):
+        new_s += closing_char
+
+    try:
+        return json.loads(new_s)
+    except Exception:
+        return None
+
+
+def make_payload(size):
+    line = 'for i in range(10):\n    print(f"row {i}: \\"value\\"\\t", i * 2)\n'
+    code = (line * (size // len(line) + 1))[:size]
+    return code, json.dumps({"language": "python", "code": code})
+
+
+def split(arguments, delta_chars):
+    return [arguments[i:i + delta_chars] for i in range(0, len(arguments), delta_chars)]
+
+
+def before(deltas):
+    accumulated = ""
+    code = ""
+    for delta in deltas:
+        accumulated += delta
+        arguments = parse_partial_json(accumulated)
+        if arguments and "code" in arguments:
+            code = arguments["code"]
+    return code
+
+
+def after(deltas):
+    parser = ToolArgumentsParser()
+    parts = []
+    for delta in deltas:
+        parts.extend(text for key, text in parser.feed(delta) if key == "code")
+    return "".join(parts)
+
+
+def main():
+    size_kb = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    delta_chars = int(sys.argv[2]) if len(sys.argv) > 2 else 16
+    code, arguments = make_payload(size_kb * 1024)
+    deltas = split(arguments, delta_chars)
+    print(f"{size_kb} KB of code, {len(deltas)} deltas of {delta_chars} chars")
+
+    for label, parse in (("before", before), ("after", after)):
+        start = time.perf_counter()
+        result = parse(deltas)
+        elapsed = time.perf_counter() - start
+        assert result == code, f"{label} produced wrong code"
+        print(
+            f"{label:<7} {elapsed * 1000:10.1f} ms total   "
+            f"{elapsed / len(deltas) * 1e6:9.1f} us/delta"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Executor monitoring and recycling, in process.
+
+One session fills its Python kernel with a large object, another leaves
+its shell idle. A monitor sample must recycle the kernel for memory and
+the shell for idleness, and the next run in each must open with the
+"restarted, state lost" notice. Also reports what a sample costs as the
+number of executors grows.
+
+Run from the sidecar directory:
+    python -m benchmarks.load_kernel_recycling [executors]
+"""
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("BOLCHAI_KERNEL_POOL_SIZE", "0")
+
+from config import BolchaiSettings, SidecarSettings
+from engine.monitor import MB, ExecutorMonitor
+from engine.sessions import SessionManager
+
+MEMORY_LIMIT_MB = 300
+IDLE_TIMEOUT = 2.0
+
+
+def run(interpreter, language, code):
+    return "".join(c.get("content", "") for c in interpreter.run_code(language, code))
+
+
+def recycling():
+    config = SidecarSettings(
+        executor_max_memory_mb=MEMORY_LIMIT_MB, executor_idle_timeout=IDLE_TIMEOUT,
+    )
+    sessions = SessionManager(BolchaiSettings(auto_run=True), config)
+    monitor = ExecutorMonitor(sessions, config)
+    try:
+        heavy = sessions.get("heavy")
+        run(heavy, "python", "block = bytearray(500 * 1024 ** 2)\nblock[::4096] = b'x' * len(block[::4096])")
+        idle = sessions.get("idle")
+        run(idle, "shell", "cd /tmp && export MARK=1")
+
+        time.sleep(IDLE_TIMEOUT + 0.5)
+        monitor.sample()
+        for sample in monitor.stats()["executors"]:
+            print(f"{sample['session_id']:<6} {sample['language']:<7} rss {sample['rss_bytes'] / MB:6.0f} MB  idle {sample['idle_seconds']} s")
+        print(f"recycled {monitor.stats()['recycled']}")
+
+        after_kernel = run(heavy, "python", "print(len(block))")
+        after_shell = run(idle, "shell", "pwd; echo MARK=$MARK")
+        print("next python run:", after_kernel.splitlines()[0])
+        print("next shell run: ", after_shell.splitlines()[0])
+        return (
+            monitor.recycled == {"memory": 1, "idle": 1}
+            and "Python kernel restarted" in after_kernel
+            and "NameError" in after_kernel
+            and "Shell restarted" in after_shell
+        )
+    finally:
+        sessions.shutdown()
+
+
+def sample_cost(count):
+    config = SidecarSettings()
+    sessions = SessionManager(BolchaiSettings(auto_run=True), SidecarSettings(max_sessions=count + 1))
+    monitor = ExecutorMonitor(sessions, config)
+    try:
+        for i in range(count):
+            run(sessions.get(f"s{i}"), "shell", "true")
+        times = []
+        for _ in range(20):
+            start = time.perf_counter()
+            monitor.sample()
+            times.append(time.perf_counter() - start)
+        return statistics.median(times)
+    finally:
+        sessions.shutdown()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+    if sys.platform != "linux":
+        print("The monitor reads /proc and needs Linux")
+        return
+    ok = recycling()
+    cost = sample_cost(count)
+    print(f"one sample of {count} shells: {cost * 1000:.1f} ms")
+    print("OK" if ok else "FAILED")
+
+
+if __name__ == "__main__":
+    main()
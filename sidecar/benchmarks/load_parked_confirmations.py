@@ -0,0 +1,154 @@
+"""
+Many turns parked at a confirmation prompt while another session streams.
+
+The LLM is replaced by a local fake. Parked sessions get a reply with one
+shell block, which stops at the confirmation prompt (auto_run is off). With
+them all waiting, a separate session streams a 200-token reply, and its
+duration is compared with the same stream on an idle server. Finally every
+parked turn is approved and must run to completion.
+
+Run from the sidecar directory:
+    python -m benchmarks.load_parked_confirmations [parked]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Keep the user's settings and kernel pool out of it
+os.environ["HOME"] = os.environ["APPDATA"] = tempfile.mkdtemp(prefix="bolchai_load_")
+os.environ.setdefault("BOLCHAI_KERNEL_POOL_SIZE", "0")
+os.environ.setdefault("BOLCHAI_MAX_SESSIONS", "100000")
+
+import httpx
+import uvicorn
+
+from api.routes import create_app
+from benchmarks.mock_llm import free_port
+from engine.llm import LLMWrapper
+from execution.procinfo import rss_bytes
+
+STREAM_TOKENS = 200
+TOKEN_DELAY = 0.005
+
+
+async def fake_arun(self, system_message, messages, converter=None):
+    """Stream tokens for "stream"; otherwise ask to run one shell block."""
+    last = messages[-1]
+    if last["role"] == "computer":
+        yield {"type": "message", "content": "Done."}
+    elif last["content"] == "stream":
+        for i in range(STREAM_TOKENS):
+            await asyncio.sleep(TOKEN_DELAY)
+            yield {"type": "message", "content": f"token{i} "}
+    else:
+        yield {"type": "code", "format": "bash", "content": "echo approved", "start": True}
+
+
+def fake_run(self, system_message, messages, converter=None):
+    """Sync stand-in with the same behaviour, for BOLCHAI_ASYNC_LLM=0."""
+    last = messages[-1]
+    if last["role"] == "computer":
+        yield {"type": "message", "content": "Done."}
+    elif last["content"] == "stream":
+        for i in range(STREAM_TOKENS):
+            time.sleep(TOKEN_DELAY)
+            yield {"type": "message", "content": f"token{i} "}
+    else:
+        yield {"type": "code", "format": "bash", "content": "echo approved", "start": True}
+
+
+async def events(http, base, session_id, message):
+    body = {"message": message, "session_id": session_id}
+    async with http.stream("POST", f"{base}/chat", json=body) as response:
+        async for line in response.aiter_lines():
+            if line.startswith("data:") and line != "data: [DONE]":
+                yield json.loads(line[5:])
+
+
+async def parked_turn(http, base, session_id, parked):
+    """Returns True once the turn ran its code after being approved."""
+    ran = False
+    async for chunk in events(http, base, session_id, "run something"):
+        if chunk["type"] == "confirmation":
+            parked.release()
+        elif chunk["type"] == "console" and "approved" in chunk["content"]:
+            ran = True
+    return ran
+
+
+async def timed_stream(http, base, session_id):
+    start = time.perf_counter()
+    tokens = 0
+    async for chunk in events(http, base, session_id, "stream"):
+        tokens += chunk["type"] == "message"
+    return time.perf_counter() - start, tokens
+
+
+async def scenario(base, parked_count):
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(timeout=120, limits=limits) as http:
+        await http.post(f"{base}/settings", json={"auto_run": False})
+
+        idle, _ = await timed_stream(http, base, "warmup")
+        idle, _ = await timed_stream(http, base, "baseline")
+
+        rss_before = rss_bytes(os.getpid())
+        parked = asyncio.Semaphore(0)
+        turns = [
+            asyncio.create_task(parked_turn(http, base, f"parked-{i}", parked))
+            for i in range(parked_count)
+        ]
+        start = time.perf_counter()
+        for _ in range(parked_count):
+            await asyncio.wait_for(parked.acquire(), 60)
+        park_time = time.perf_counter() - start
+        rss_parked = rss_bytes(os.getpid())
+        threads_parked = threading.active_count()
+
+        sessions = (await http.get(f"{base}/sessions")).json()["sessions"]
+        waiting = sum(1 for s in sessions if s["awaiting_confirmation"])
+
+        busy, tokens = await timed_stream(http, base, "live")
+
+        for i in range(parked_count):
+            await http.post(f"{base}/confirm", json={"approved": True, "session_id": f"parked-{i}"})
+        completed = sum(await asyncio.gather(*turns))
+
+    print(f"{parked_count} turns parked in {park_time:.1f} s, {waiting} awaiting confirmation")
+    print(f"threads while parked     {threads_parked}")
+    if rss_before and rss_parked:
+        per_turn = (rss_parked - rss_before) / parked_count / 1024
+        print(f"memory per parked turn   {per_turn:.0f} KiB (server and client share this process)")
+    print(f"live stream, idle server {idle * 1000:7.0f} ms")
+    print(f"live stream, all parked  {busy * 1000:7.0f} ms  ({tokens} tokens)")
+    print(f"completed after approval {completed}/{parked_count}")
+    ok = waiting == parked_count and tokens == STREAM_TOKENS and completed == parked_count
+    print("OK" if ok else "FAILED")
+
+
+def main():
+    parked = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    LLMWrapper.arun = fake_arun
+    LLMWrapper.run = fake_run
+
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(), port=port, log_level="warning", backlog=4096,
+    ))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    asyncio.run(scenario(f"http://127.0.0.1:{port}", parked))
+
+    server.should_exit = True
+    thread.join(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
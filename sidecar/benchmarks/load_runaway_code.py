@@ -0,0 +1,109 @@
+"""
+Runaway code against the execution limits: how long each case runs before
+it is stopped, what the output says, and whether the executor works
+afterwards.
+
+Cases: a shell `sleep` past the wall-clock limit, a Python busy loop past
+the CPU limit, a Python loop that ignores Ctrl-C (the kernel has to be
+killed and restarted), an allocation over the memory cap, and a shell
+command stopped from another thread as the /stop endpoint does. Every case
+runs on both the sync and the async path.
+
+Run from the sidecar directory:
+    python -m benchmarks.load_runaway_code
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+
+os.environ.setdefault("BOLCHAI_KERNEL_POOL_SIZE", "0")
+
+from config import BolchaiSettings, SidecarSettings
+from engine.interpreter import BolchaiInterpreter
+from execution.limits import execution_limits
+
+LIMITS = {"exec_timeout": 3.0, "exec_cpu_seconds": 2.0, "exec_memory_mb": 1024}
+
+CASES = [
+    ("wall clock", "shell", "sleep 60", None),
+    ("cpu time", "python", "while True:\n    pass", None),
+    ("ignores SIGINT", "python",
+     "import signal\nsignal.signal(signal.SIGINT, signal.SIG_IGN)\nwhile True:\n    pass", None),
+    ("memory", "python", "block = bytearray(4 * 1024 ** 3)", None),
+    ("stop endpoint", "shell", "sleep 60", 1.0),
+]
+
+FOLLOW_UP = {"python": "print('alive')", "shell": "echo alive"}
+
+
+def notices(output):
+    """The bracketed notices at the end of a run's output, or its last line."""
+    lines = [line for line in output.strip().splitlines() if line]
+    found = [line for line in lines if line.startswith("[")]
+    return " ".join(found) if found else (lines[-1] if lines else "")
+
+
+def sync_cases(interpreter):
+    for label, language, code, stop_after in CASES:
+        if stop_after:
+            threading.Timer(stop_after, interpreter.stop).start()
+        start = time.perf_counter()
+        output = "".join(c.get("content", "") for c in interpreter.run_code(language, code))
+        elapsed = time.perf_counter() - start
+        interpreter._stopped = False
+        after = "".join(c.get("content", "") for c in interpreter.run_code(language, FOLLOW_UP[language]))
+        yield label, elapsed, output, "alive" in after
+
+
+async def async_cases(interpreter):
+    async def run(language, code):
+        return "".join([c.get("content", "") async for c in interpreter.arun_code(language, code)])
+
+    results = []
+    loop = asyncio.get_running_loop()
+    try:
+        for label, language, code, stop_after in CASES:
+            if stop_after:
+                loop.call_later(stop_after, threading.Thread(target=interpreter.stop).start)
+            start = time.perf_counter()
+            output = await run(language, code)
+            elapsed = time.perf_counter() - start
+            interpreter._stopped = False
+            after = await run(language, FOLLOW_UP[language])
+            results.append((label, elapsed, output, "alive" in after))
+    finally:
+        interpreter.cleanup()
+    return results
+
+
+def main():
+    if sys.platform != "linux":
+        print("The CPU limit reads /proc and needs Linux")
+        return
+    execution_limits.configure(SidecarSettings(**LIMITS))
+    print(f"limits: {LIMITS}")
+
+    ok = True
+    for path in ("sync", "async"):
+        interpreter = BolchaiInterpreter(BolchaiSettings(auto_run=True))
+        # Start the kernel up front so its start-up isn't counted
+        interpreter.get_language("python")
+        if path == "sync":
+            try:
+                results = list(sync_cases(interpreter))
+            finally:
+                interpreter.cleanup()
+        else:
+            # One loop throughout: the async shell belongs to the loop that started it
+            results = asyncio.run(async_cases(interpreter))
+        for label, elapsed, output, alive in results:
+            print(f"{path:<5} {label:<15} stopped after {elapsed:5.1f} s  usable after: {alive}")
+            print(f"      {notices(output)[:110]}")
+            ok = ok and alive and elapsed < 15
+    print("OK" if ok else "FAILED")
+
+
+if __name__ == "__main__":
+    main()
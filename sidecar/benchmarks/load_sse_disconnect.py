@@ -0,0 +1,154 @@
+"""
+Disconnect storm against /chat: checks that nothing keeps running after
+clients go away.
+
+The LLM (sync and async paths) is replaced by a local fake that streams tokens slowly and then asks
+to run `sleep` in the shell, so no API key or network is needed. Half of the
+clients hang up while tokens are streaming, the other half while the shell
+command runs. Afterwards the script counts fake LLM streams still open,
+sessions still busy and sleep processes still alive; all should be zero.
+
+Run from the sidecar directory:
+    python -m benchmarks.load_sse_disconnect [clients]
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+# Keep the user's settings and kernel pool out of it
+os.environ["HOME"] = os.environ["APPDATA"] = tempfile.mkdtemp(prefix="bolchai_load_")
+os.environ.setdefault("BOLCHAI_KERNEL_POOL_SIZE", "0")
+os.environ.setdefault("BOLCHAI_MAX_SESSIONS", "1000")
+
+import httpx
+import uvicorn
+
+from api.routes import create_app
+from benchmarks.mock_llm import free_port
+from engine.llm import LLMWrapper
+
+SLEEP_SECONDS = "37.25"  # odd value so stray processes are easy to find
+TOKEN_DELAY = 0.005
+
+open_streams = 0
+streams_lock = threading.Lock()
+
+
+def fake_run(self, system_message, messages, converter=None):
+    """Stand-in for LLMWrapper.run: a slow token stream, then a shell block."""
+    global open_streams
+    with streams_lock:
+        open_streams += 1
+    try:
+        if messages[-1]["role"] == "computer":
+            yield {"type": "message", "content": "Done."}
+            return
+        for i in range(200):
+            time.sleep(TOKEN_DELAY)
+            yield {"type": "message", "content": f"token{i} "}
+        yield {"type": "code", "format": "bash", "content": f"sleep {SLEEP_SECONDS}", "start": True}
+    finally:
+        with streams_lock:
+            open_streams -= 1
+
+
+async def fake_arun(self, system_message, messages, converter=None):
+    """Stand-in for LLMWrapper.arun, with the same stream as fake_run."""
+    global open_streams
+    with streams_lock:
+        open_streams += 1
+    try:
+        if messages[-1]["role"] == "computer":
+            yield {"type": "message", "content": "Done."}
+            return
+        for i in range(200):
+            await asyncio.sleep(TOKEN_DELAY)
+            yield {"type": "message", "content": f"token{i} "}
+        yield {"type": "code", "format": "bash", "content": f"sleep {SLEEP_SECONDS}", "start": True}
+    finally:
+        with streams_lock:
+            open_streams -= 1
+
+
+def stray_sleeps():
+    count = 0
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/cmdline", "rb") as f:
+                if f.read().split(b"\0")[:2] == [b"sleep", SLEEP_SECONDS.encode()]:
+                    count += 1
+        except OSError:
+            pass
+    return count
+
+
+async def client(http, base, index):
+    """Open a chat and hang up early: during tokens (even) or during code (odd)."""
+    wait_for_code = index % 2 == 1
+    body = {"message": "go", "session_id": f"load-{index}"}
+    async with http.stream("POST", f"{base}/chat", json=body) as response:
+        events = 0
+        async for line in response.aiter_lines():
+            if not line.startswith("data:") or line == "data: [DONE]":
+                continue
+            events += 1
+            if wait_for_code and json.loads(line[5:]).get("type") == "code":
+                await asyncio.sleep(0.3)  # let the sleep start
+                return
+            if not wait_for_code and events >= 20:
+                return
+
+
+async def storm(base, clients):
+    async with httpx.AsyncClient(timeout=30) as http:
+        await http.post(f"{base}/settings", json={"auto_run": True})
+        await asyncio.gather(*(client(http, base, i) for i in range(clients)))
+        # Give the workers a moment to notice
+        deadline = time.monotonic() + 10
+        while time.monotonic() < deadline:
+            sessions = (await http.get(f"{base}/sessions")).json()
+            busy = sum(1 for s in sessions["sessions"] if s["busy"])
+            if not (open_streams or busy or stray_sleeps()):
+                break
+            await asyncio.sleep(0.2)
+        return busy
+
+
+def main():
+    clients = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    if sys.platform != "linux":
+        print("This load test reads /proc and needs Linux")
+        return
+
+    LLMWrapper.run = fake_run
+    LLMWrapper.arun = fake_arun
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(create_app(), port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    start = time.perf_counter()
+    busy = asyncio.run(storm(f"http://127.0.0.1:{port}", clients))
+    elapsed = time.perf_counter() - start
+
+    sleeps = stray_sleeps()
+    print(f"{clients} clients disconnected early, settled in {elapsed:.1f} s")
+    print(f"open LLM streams   {open_streams}")
+    print(f"busy sessions      {busy}")
+    print(f"running sleeps     {sleeps}")
+    print("OK" if not (open_streams or busy or sleeps) else "ORPHANED WORK")
+
+    server.should_exit = True
+    thread.join(timeout=10)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+A mock OpenAI-compatible endpoint for the LLM benchmarks, served from a
+separate process so it doesn't compete for the benchmark's GIL.
+
+openai_mock() streams a fixed reply, or a tool call when the request
+offers tools, and counts the connections it accepts. Benchmarks that
+need the endpoint to misbehave build their own app from chunk_event()
+and tool_call_deltas(). serving() runs either kind.
+"""
+import asyncio
+import json
+import multiprocessing
+import socket
+import time
+from contextlib import contextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+SSE_DONE = "data: [DONE]\n\n"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def chunk_event(delta):
+    """One SSE event carrying a chat.completion.chunk with `delta`."""
+    chunk = {
+        "id": "mock",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": "mock",
+        "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+    }
+    return f"data: {json.dumps(chunk)}\n\n"
+
+
+def tool_call_deltas(arguments):
+    """Deltas of one execute tool call whose arguments arrive in these parts."""
+    return [
+        {"tool_calls": [{"index": 0, "id": "call_0", "type": "function",
+                         "function": {"name": "execute", "arguments": part}}]}
+        for part in arguments
+    ]
+
+
+def openai_mock(reply=("tok0 ", "tok1 ", "tok2 "), tool_arguments=None, token_delay=0.01):
+    """
+    An app streaming `reply` at /v1/chat/completions, or `tool_arguments`
+    as a tool call when the request offers tools. GET /connections counts
+    the client connections seen; HEAD /v1 answers warm-ups.
+    """
+    app = FastAPI()
+    peers = set()
+
+    @app.post("/v1/chat/completions")
+    async def completions(request: Request):
+        peers.add(request.client)
+        body = await request.json()
+        if body.get("tools") and tool_arguments:
+            deltas = tool_call_deltas(tool_arguments)
+        else:
+            deltas = [{"content": part} for part in reply]
+
+        async def stream():
+            for delta in deltas:
+                await asyncio.sleep(token_delay)
+                yield chunk_event(delta)
+            yield SSE_DONE
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    @app.head("/v1")
+    async def head(request: Request):
+        peers.add(request.client)
+
+    @app.get("/connections")
+    async def connections():
+        return len(peers)
+
+    return app
+
+
+def _serve(make_app, port, options):
+    uvicorn.run(make_app(), port=port, log_level="warning", **options)
+
+
+@contextmanager
+def serving(make_app, **options):
+    """
+    Serve make_app() on a free local port in another process until the
+    block ends; yields the port. `options` go to uvicorn.run. make_app
+    must be picklable: a module-level function or a partial of one.
+    """
+    port = free_port()
+    server = multiprocessing.Process(target=_serve, args=(make_app, port, options), daemon=True)
+    server.start()
+    try:
+        while True:
+            try:
+                socket.create_connection(("127.0.0.1", port), timeout=1).close()
+                break
+            except OSError:
+                time.sleep(0.05)
+        yield port
+    finally:
+        server.terminate()
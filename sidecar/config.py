@@ -2,6 +2,15 @@ import json
 import os
 from pathlib import Path
 from pydantic import BaseModel
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class ModelEndpoint(BaseModel):
+    """A fallback model; an empty api_base or api_key means the provider's default."""
+
+    model: str
+    api_base: str = ""
+    api_key: str = ""
 
 
 class BolchaiSettings(BaseModel):
@@ -13,6 +22,9 @@ class BolchaiSettings(BaseModel):
     context_window: int = 128000
     max_tokens: int = 4096
     temperature: float = 0.0
+    prompt_caching: bool = False
+    # Tried in order when the model fails or is slow; see engine/routing.py
+    fallbacks: list[ModelEndpoint] = []
 
     @classmethod
     def settings_path(cls) -> Path:
@@ -39,3 +51,59 @@ class BolchaiSettings(BaseModel):
         path = self.settings_path()
         path.parent.mkdir(parents=True, exist_ok=True)
         path.write_text(self.model_dump_json(indent=2))
+
+
+class SidecarSettings(BaseSettings):
+    """Process-level limits, read from BOLCHAI_* environment variables."""
+
+    model_config = SettingsConfigDict(env_prefix="BOLCHAI_")
+
+    max_sessions: int = 32
+    session_idle_timeout: float = 1800.0
+    max_kernels: int = 16
+    max_kernel_memory_mb: int = 0
+    reap_interval: float = 30.0
+    kernel_pool_size: int = 1
+    max_warmups: int = 2
+    max_spilled_outputs: int = 64
+    async_llm: bool = True
+    stream_queue_size: int = 64
+    stream_coalesce: bool = False
+    stream_coalesce_ms: float = 15.0
+    stream_coalesce_chars: int = 2048
+    # Per-execution limits for model-written code; 0 turns one off
+    exec_timeout: float = 0.0
+    exec_cpu_seconds: float = 0.0
+    exec_memory_mb: int = 0
+    exec_max_files: int = 0
+    # Executor monitor: sampling period, and per-executor recycling thresholds
+    monitor_interval: float = 5.0
+    executor_max_memory_mb: int = 0
+    executor_idle_timeout: float = 0.0
+    max_blob_mb: int = 256
+    # Conversation history database; empty means history.db next to settings.json
+    history: bool = True
+    history_path: str = ""
+    # On-disk cache of temperature-0 completions; empty path means llm-cache/ next to settings.json
+    llm_cache: bool = False
+    llm_cache_path: str = ""
+    llm_cache_mb: int = 256
+    llm_cache_ttl: float = 7 * 24 * 3600.0
+    # Keep-alive clients for OpenAI-compatible LLM endpoints
+    llm_idle_connections: int = 16
+    llm_keepalive: float = 120.0
+    llm_http2: bool = False
+    llm_warmup: bool = True
+    # Fallback routing: wait for a first token before hedging, longest
+    # silence mid-stream before failing over, and the circuit breaker
+    llm_first_token_timeout: float = 10.0
+    llm_stall_timeout: float = 30.0
+    llm_breaker_failures: int = 3
+    llm_breaker_cooldown: float = 30.0
+    # Outbound rate limits per endpoint, requests and tokens per minute; 0
+    # means none until the provider's headers give one. A request waits at
+    # most llm_max_queue_wait seconds for room, 429s included.
+    llm_rate_limits: bool = True
+    llm_rpm: int = 0
+    llm_tpm: int = 0
+    llm_max_queue_wait: float = 120.0
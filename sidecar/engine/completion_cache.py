@@ -0,0 +1,208 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+# Request parameters that don't change what the model answers
+UNKEYED = ("api_key", "client", "stream", "stream_options")
+
+
+class CompletionCache:
+    """
+    Streamed completions kept on disk and keyed by a hash of the request.
+    A request made again with the same model, parameters and trimmed
+    messages is answered without calling the provider. Off unless
+    configured. Only temperature-0 requests are cached, since only those
+    are meant to give the same answer every time.
+
+    An entry is a file holding the stream's deltas. It expires `ttl`
+    seconds after it was written. The least recently used entries are
+    deleted once the total size goes over max_bytes.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.path = None
+        self.max_bytes = 0
+        self.ttl = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        # key -> (size, time written), in LRU order
+        self._entries = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def configure(self, config, path):
+        self.enabled = config.llm_cache
+        self.max_bytes = config.llm_cache_mb * 1024 * 1024
+        self.ttl = config.llm_cache_ttl
+        self.path = str(path)
+        if self.enabled:
+            os.makedirs(self.path, exist_ok=True)
+            self._scan()
+
+    def _scan(self):
+        """Index the entries already on disk, oldest first."""
+        found = []
+        with os.scandir(self.path) as entries:
+            for entry in entries:
+                if entry.name.endswith(".json"):
+                    stat = entry.stat()
+                    found.append((stat.st_mtime, entry.name[:-5], stat.st_size))
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            for written, key, size in sorted(found):
+                self._entries[key] = (size, written)
+                self._size += size
+            evicted = self._evict()
+        self._unlink(evicted)
+
+    def key(self, params):
+        """Cache key of a completion request, or None if it isn't cacheable."""
+        if not self.enabled or params.get("temperature") != 0:
+            return None
+        request = {
+            name: value for name, value in params.items()
+            if name not in UNKEYED and value is not None
+        }
+        request["messages"] = [_normalize(message) for message in request.get("messages", ())]
+        data = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()
+
+    def get(self, key):
+        """The deltas stored under a key, or None (a miss)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl and time.time() - entry[1] > self.ttl:
+                self._size -= self._entries.pop(key)[0]
+                self.evictions += 1
+                expired, entry = key, None
+            else:
+                expired = None
+            if entry is None:
+                self.misses += 1
+            else:
+                self._entries.move_to_end(key)
+        if expired:
+            self._unlink([expired])
+        if entry is None:
+            return None
+        try:
+            with open(self._file(key), "rb") as f:
+                deltas = json.loads(f.read())["deltas"]
+        except (OSError, ValueError, KeyError):
+            # Deleted or damaged underneath us; forget it and count a miss
+            with self._lock:
+                if self._entries.pop(key, None) is not None:
+                    self._size -= entry[0]
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return deltas
+
+    def put(self, key, deltas):
+        """Store the deltas of a complete stream."""
+        data = json.dumps({"deltas": deltas}, separators=(",", ":"), ensure_ascii=False).encode()
+        path = self._file(key)
+        # Written under a temp name, so a reader never sees part of an entry
+        partial = f"{path}.{threading.get_ident()}.part"
+        try:
+            with open(partial, "wb") as f:
+                f.write(data)
+            os.replace(partial, path)
+        except OSError:
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._size -= old[0]
+            self._entries[key] = (len(data), time.time())
+            self._size += len(data)
+            self.stores += 1
+            evicted = self._evict(keep=key)
+        self._unlink(evicted)
+
+    def _evict(self, keep=None):
+        """Pop expired entries, then least recently used ones while over max_bytes. Caller holds the lock."""
+        now = time.time()
+        evicted = []
+        for key, (size, written) in list(self._entries.items()):
+            over = self.max_bytes and self._size > self.max_bytes
+            expired = self.ttl and now - written > self.ttl
+            if key == keep or not (over or expired):
+                continue
+            self._size -= size
+            del self._entries[key]
+            evicted.append(key)
+        self.evictions += len(evicted)
+        return evicted
+
+    def _unlink(self, keys):
+        for key in keys:
+            try:
+                os.unlink(self._file(key))
+            except OSError:
+                pass
+
+    def _file(self, key):
+        return os.path.join(self.path, key + ".json")
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+                "stores": self.stores,
+                "evictions": self.evictions,
+            }
+
+
+completion_cache = CompletionCache()
+
+
+def _normalize(message):
+    """
+    A message without cache_control markers, so that turning prompt caching
+    on or off doesn't change its key.
+    """
+    content = message.get("content")
+    if isinstance(content, list) and all(part.get("type") == "text" for part in content):
+        message = {**message, "content": "".join(part["text"] for part in content)}
+    return message
+
+
+def record_delta(chunk):
+    """The parts of a stream chunk that the LMC decoders read, as plain data."""
+    if "choices" not in chunk or len(chunk["choices"]) == 0:
+        return None
+    delta = chunk["choices"][0]["delta"]
+    record = {}
+    if delta.get("content"):
+        record["content"] = delta["content"]
+    tool_calls = []
+    for tool_call in delta.get("tool_calls") or ():
+        function = tool_call.function
+        tool_calls.append({
+            "index": getattr(tool_call, "index", None),
+            "id": getattr(tool_call, "id", None),
+            "type": getattr(tool_call, "type", None) or "function",
+            "function": {
+                "name": getattr(function, "name", None),
+                "arguments": getattr(function, "arguments", None),
+            },
+        })
+    if tool_calls:
+        record["tool_calls"] = tool_calls
+    return record or None
@@ -0,0 +1,114 @@
+from .utils import convert_message
+
+
+class MessageConverter:
+    """
+    Incremental LMC -> OpenAI conversion for one conversation.
+
+    Each LMC message is converted once and its result kept, so a request only
+    pays for messages added since the previous one. Tool-calling output uses
+    the tool_calls format directly, with ids derived from the message index so
+    they stay the same across turns. Consecutive code messages become one
+    assistant message with several tool calls, and the outputs that follow
+    answer them in order. Messages are treated as append-only:
+    anything that rewrites an existing message must call invalidate() with its
+    index, which drops the cached results from that point on.
+    """
+
+    def __init__(self):
+        self.function_calling = None
+        self._output = []
+        # Per LMC message: (output length, last output message, open tool ids)
+        # as they were before the message was converted
+        self._marks = []
+        self._open_tool_ids = ()
+        self._valid = 0
+
+    def invalidate(self, index=0):
+        """Forget conversions from LMC message `index` onwards."""
+        self._valid = min(self._valid, max(index, 0))
+
+    def convert(self, messages, function_calling=True):
+        """Return the OpenAI messages for `messages`, reusing cached conversions."""
+        if function_calling != self.function_calling:
+            self.function_calling = function_calling
+            self._valid = 0
+
+        self._rewind(min(self._valid, len(messages)))
+        for index in range(len(self._marks), len(messages)):
+            self._append(index, messages[index])
+        self._valid = len(messages)
+
+        converted = list(self._output)
+        converted.extend(_tool_reply(tool_id, "") for tool_id in self._open_tool_ids)
+        return converted
+
+    def _rewind(self, index):
+        if index >= len(self._marks):
+            return
+        length, last, open_tool_ids = self._marks[index]
+        del self._output[length:]
+        if last is not None:
+            self._output[length - 1] = last
+        self._open_tool_ids = open_tool_ids
+        del self._marks[index:]
+
+    def _append(self, index, message):
+        output = self._output
+        self._marks.append((len(output), output[-1] if output else None, self._open_tool_ids))
+
+        converted = convert_message(message, self.function_calling)
+        if not converted:
+            return
+
+        if not self.function_calling:
+            # Combine adjacent same-role messages; copy so earlier marks stay intact
+            last = output[-1] if output else None
+            if last is not None and last["role"] == converted["role"] and isinstance(converted.get("content"), str):
+                output[-1] = {**last, "content": last["content"] + "\n" + converted["content"]}
+            else:
+                output.append(converted)
+            return
+
+        if "function_call" in converted:
+            tool_id = f"toolu_{index}"
+            call = {"id": tool_id, "type": "function", "function": converted.pop("function_call")}
+            last = output[-1] if output else None
+            if self._open_tool_ids and last is not None and last.get("tool_calls"):
+                # Another call of the same response, before any output
+                output[-1] = {**last, "tool_calls": last["tool_calls"] + [call]}
+                self._open_tool_ids += (tool_id,)
+            else:
+                self._close_open_calls()
+                converted["tool_calls"] = [call]
+                output.append(converted)
+                self._open_tool_ids = (tool_id,)
+        elif converted["role"] == "function":
+            if self._open_tool_ids:
+                tool_id = self._open_tool_ids[0]
+                self._open_tool_ids = self._open_tool_ids[1:]
+            else:
+                # Output with no preceding call: synthesize one so the pair is valid
+                tool_id = f"toolu_{index}"
+                output.append({
+                    "role": "assistant",
+                    "tool_calls": [{
+                        "id": tool_id,
+                        "type": "function",
+                        "function": {"name": "execute", "arguments": "{}"},
+                    }],
+                })
+            output.append(_tool_reply(tool_id, converted["content"]))
+        else:
+            self._close_open_calls()
+            output.append(converted)
+
+    def _close_open_calls(self):
+        """Answer tool calls that never got output (e.g. execution was declined)."""
+        for tool_id in self._open_tool_ids:
+            self._output.append(_tool_reply(tool_id, ""))
+        self._open_tool_ids = ()
+
+
+def _tool_reply(tool_id, content):
+    return {"role": "tool", "name": "execute", "tool_call_id": tool_id, "content": content}
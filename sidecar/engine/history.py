@@ -0,0 +1,174 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+try:
+    import orjson
+except ImportError:  # fall back to the stdlib encoder
+    orjson = None
+
+# Most writes one transaction takes from the queue
+BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    epoch INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS messages (
+    session_id TEXT NOT NULL,
+    epoch INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    created REAL NOT NULL,
+    message TEXT NOT NULL,
+    PRIMARY KEY (session_id, epoch, seq)
+) WITHOUT ROWID;
+"""
+
+# Written at the session's current epoch, which a reset moves past
+UPSERT = """
+INSERT OR REPLACE INTO messages (session_id, epoch, seq, created, message)
+VALUES (?, COALESCE((SELECT epoch FROM sessions WHERE session_id = ?), 0), ?, ?, ?)
+"""
+
+RESET = """
+INSERT INTO sessions (session_id, epoch) VALUES (?, 1)
+ON CONFLICT (session_id) DO UPDATE SET epoch = epoch + 1
+"""
+
+CURRENT = """
+SELECT seq, message FROM messages
+WHERE session_id = ?1 AND epoch = COALESCE((SELECT epoch FROM sessions WHERE session_id = ?1), 0)
+"""
+
+
+class MessageStore:
+    """
+    Conversations in a SQLite database (WAL mode), so they survive a
+    restart. Writes are queued and a background thread commits them in
+    batches, keeping disk I/O off the streaming path. The log is
+    append-only: a message is only rewritten in place when the interpreter
+    rewrites it, and a reset starts a new epoch instead of deleting rows.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self.batches = 0
+        self.writes = 0
+        self._queue = queue.Queue()
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=30)
+        # In WAL mode a commit is safe from corruption without an fsync
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def session(self, session_id):
+        return SessionHistory(self, session_id)
+
+    def put(self, session_id, seq, message):
+        """Queue a write of message `seq` of a session."""
+        self._queue.put((UPSERT, (session_id, session_id, seq, time.time(), _encode(message))))
+
+    def reset(self, session_id):
+        """Queue the start of a new, empty conversation for a session."""
+        self._queue.put((RESET, (session_id,)))
+
+    def _write_loop(self):
+        db = self._connect()
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < BATCH_SIZE:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                stop = batch[-1] is None
+                writes = [item for item in batch if item is not None]
+                try:
+                    with db:
+                        for sql, params in writes:
+                            db.execute(sql, params)
+                    self.batches += 1
+                    self.writes += len(writes)
+                except sqlite3.Error:
+                    pass
+                for _ in batch:
+                    self._queue.task_done()
+                if stop:
+                    return
+        finally:
+            db.close()
+
+    def flush(self):
+        """Wait until every queued write is committed."""
+        self._queue.join()
+
+    def load(self, session_id):
+        """The current conversation of a session, oldest first."""
+        self.flush()
+        db = self._connect()
+        try:
+            rows = db.execute(CURRENT + " ORDER BY seq", (session_id,)).fetchall()
+        finally:
+            db.close()
+        return [json.loads(message) for _, message in rows]
+
+    def page(self, session_id, before=None, limit=50):
+        """
+        Up to `limit` messages of the current conversation that come before
+        seq `before` (the newest when None), oldest first, as (seq, message).
+        """
+        self.flush()
+        sql = CURRENT
+        params = [session_id]
+        if before is not None:
+            sql += " AND seq < ?2"
+            params.append(before)
+        sql += " ORDER BY seq DESC LIMIT ?"
+        params.append(limit)
+        db = self._connect()
+        try:
+            rows = db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+        return [(seq, json.loads(message)) for seq, message in reversed(rows)]
+
+    def stats(self):
+        return {"path": self.path, "queued": self._queue.qsize(), "batches": self.batches, "writes": self.writes}
+
+    def close(self):
+        """Commit what is queued and stop the writer."""
+        self._queue.put(None)
+        self._writer.join()
+
+
+class SessionHistory:
+    """One session's view of a MessageStore, as held by its interpreter."""
+
+    def __init__(self, store, session_id):
+        self.store = store
+        self.session_id = session_id
+
+    def load(self):
+        return self.store.load(self.session_id)
+
+    def put(self, seq, message):
+        self.store.put(self.session_id, seq, message)
+
+    def reset(self):
+        self.store.reset(self.session_id)
+
+
+def _encode(message):
+    if orjson is not None:
+        return orjson.dumps(message).decode()
+    return json.dumps(message, ensure_ascii=False)
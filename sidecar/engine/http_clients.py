@@ -0,0 +1,357 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import httpx
+import litellm
+import openai
+
+try:
+    import h2  # noqa: F401
+except ImportError:  # HTTP/2 is optional
+    h2 = None
+
+# litellm's retry count for OpenAI clients it makes itself
+MAX_RETRIES = 2
+WARMUP_TIMEOUT = 5.0
+OPENAI_BASE = "https://api.openai.com/v1"
+SSE_DONE = b"data: [DONE]"
+
+# Timings of the LLM call being made in this context, filled in by _Client._trace
+_timing = ContextVar("llm_timing", default=None)
+
+
+class CallTiming:
+    """Where the time before an LLM call's first token went."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.connect_ms = None
+        self.tls_ms = None
+        self.wait_ms = None
+        self.ttft_ms = None
+        self.queue_ms = None
+        self.reused = None
+        self._steps = {}
+
+    def trace(self, event, now):
+        name, _, phase = event.rpartition(".")
+        step = name.rsplit(".", 1)[-1]
+        if phase == "started":
+            self._steps[step] = now
+            return
+        started = self._steps.pop(step, None)
+        if phase != "complete" or started is None:
+            return
+        elapsed = round((now - started) * 1000, 1)
+        if step == "connect_tcp":
+            self.connect_ms = elapsed
+        elif step == "start_tls":
+            self.tls_ms = elapsed
+        elif step == "send_request_headers":
+            # Waiting for the response starts once the request is out
+            self._steps["response"] = now
+        elif step == "receive_response_headers":
+            response = self._steps.pop("response", started)
+            self.wait_ms = round((now - response) * 1000, 1)
+            self.reused = self.connect_ms is None
+
+    def queued(self, ticket):
+        """Record the wait for rate-limit room, from the scheduler's ticket (None when it is off)."""
+        if ticket is not None:
+            self.queue_ms = round(ticket.waited * 1000, 1)
+
+    def first_token(self):
+        if self.ttft_ms is None:
+            self.ttft_ms = round((time.perf_counter() - self.started) * 1000, 1)
+
+    def as_dict(self):
+        """
+        queue_ms is time spent waiting for rate-limit room, 429s included.
+        connect_ms includes DNS. wait_ms runs from the request being sent to
+        the response headers. ttft_ms runs from the call to the first chunk.
+        reused is None when the call didn't go through a pooled client.
+        """
+        return {
+            "reused": self.reused,
+            "queue_ms": self.queue_ms,
+            "connect_ms": self.connect_ms,
+            "tls_ms": self.tls_ms,
+            "wait_ms": self.wait_ms,
+            "ttft_ms": self.ttft_ms,
+        }
+
+
+@contextmanager
+def traced(timing):
+    """Record connection timings of requests sent in this block into `timing`."""
+    token = _timing.set(timing)
+    try:
+        yield timing
+    finally:
+        _timing.reset(token)
+
+
+class ClientPool:
+    """
+    Keep-alive HTTP clients for LLM calls, one per endpoint (base URL and
+    key), shared by every session. litellm drops its own clients after an
+    hour, and httpx closes idle connections after 5 s. So a turn that
+    followed a pause, or came after a settings change, paid DNS, TCP and
+    TLS set-up on top of time to first token. Here idle connections are
+    kept for `keepalive` seconds, and warm() opens one ahead of the first
+    turn. HTTP/2 is used when asked for and the h2 package is installed.
+
+    Only OpenAI-compatible providers take a client this way; other
+    providers keep litellm's own.
+    """
+
+    def __init__(self):
+        self.max_idle = 16
+        self.keepalive = 120.0
+        self.http2 = False
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        self.max_idle = config.llm_idle_connections
+        self.keepalive = config.llm_keepalive
+        self.http2 = config.llm_http2 and h2 is not None
+
+    def client(self, model, api_base, api_key, is_async):
+        """OpenAI client for the model's endpoint, or None to leave it to litellm."""
+        entry = self._entry(model, api_base, api_key)
+        if entry is None:
+            return None
+        return entry.async_client() if is_async else entry.sync_client()
+
+    def _entry(self, model, api_base, api_key):
+        endpoint = _endpoint(model, api_base, api_key)
+        if endpoint is None:
+            return None
+        with self._lock:
+            entry = self._clients.get(endpoint)
+            if entry is None:
+                entry = self._clients[endpoint] = _Client(*endpoint, self)
+            return entry
+
+    def warm(self, settings):
+        """Open a connection to the settings' endpoint for the sync path."""
+        entry = self._entry(settings.model, settings.api_base, settings.api_key)
+        if entry is not None:
+            entry.warm()
+
+    async def awarm(self, settings):
+        """warm() for the async path, on the loop that will use the client."""
+        entry = self._entry(settings.model, settings.api_base, settings.api_key)
+        if entry is not None:
+            await entry.awarm()
+
+    def stats(self):
+        with self._lock:
+            clients = list(self._clients.values())
+        return {
+            "http2": self.http2,
+            "keepalive": self.keepalive,
+            "max_idle": self.max_idle,
+            "endpoints": [client.stats() for client in clients],
+        }
+
+    def shutdown(self):
+        for client in self._take_clients():
+            client.close()
+
+    async def ashutdown(self):
+        """shutdown() on a loop, which closes that loop's clients before returning."""
+        for client in self._take_clients():
+            await client.aclose()
+
+    def _take_clients(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        return clients
+
+
+llm_clients = ClientPool()
+
+
+def _endpoint(model, api_base, api_key):
+    """(base URL, API key) an OpenAI client would use for a model, or None."""
+    try:
+        _, provider, dynamic_key, provider_base = litellm.get_llm_provider(
+            model, api_base=api_base or None, api_key=api_key or None
+        )
+    except Exception:
+        return None
+    if provider != "openai" and provider not in litellm.openai_compatible_providers:
+        return None
+    key = api_key or dynamic_key or (os.environ.get("OPENAI_API_KEY") if provider == "openai" else None)
+    if not key:
+        return None  # litellm reports the missing key
+    return (api_base or provider_base or OPENAI_BASE).rstrip("/"), key
+
+
+class _Client:
+    """The sync and async OpenAI clients for one endpoint, and their counters."""
+
+    def __init__(self, base_url, api_key, pool):
+        self.base_url = base_url
+        self.api_key = api_key
+        self.http2 = pool.http2
+        # Open streams aren't capped; only the idle connections kept for reuse are
+        self.limits = httpx.Limits(
+            max_connections=None,
+            max_keepalive_connections=pool.max_idle,
+            keepalive_expiry=pool.keepalive,
+        )
+        self.requests = 0
+        self.connections = 0
+        self.warmups = 0
+        self.sync = None
+        self.http = None
+        # loop -> (AsyncOpenAI, AsyncClient): an async client's connections
+        # belong to the loop that opened them, so each loop has its own
+        self._async = weakref.WeakKeyDictionary()
+        self._lock = threading.Lock()
+
+    def sync_client(self):
+        with self._lock:
+            if self.sync is None:
+                self.http = httpx.Client(
+                    transport=_DrainingTransport(http2=self.http2, limits=self.limits),
+                    event_hooks={"request": [self._hook]},
+                )
+                self.sync = self._openai(openai.OpenAI, self.http)
+            return self.sync
+
+    def async_client(self):
+        return self._async_clients()[0]
+
+    def _async_clients(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            clients = self._async.get(loop)
+            if clients is None:
+                # A closed loop can't run aclose(); its client is dropped,
+                # and the sockets close with their transports
+                for old in [old for old in self._async if old.is_closed()]:
+                    del self._async[old]
+                http = httpx.AsyncClient(
+                    http2=self.http2, limits=self.limits,
+                    event_hooks={"request": [self._ahook]},
+                )
+                clients = self._async[loop] = (self._openai(openai.AsyncOpenAI, http), http)
+            return clients
+
+    def _openai(self, cls, http):
+        return cls(api_key=self.api_key, base_url=self.base_url, http_client=http, max_retries=MAX_RETRIES)
+
+    def _hook(self, request):
+        self.requests += 1
+        request.extensions["trace"] = self._trace
+
+    async def _ahook(self, request):
+        self.requests += 1
+        request.extensions["trace"] = self._atrace
+
+    def _trace(self, event, info):
+        if event == "connection.connect_tcp.started":
+            self.connections += 1
+        timing = _timing.get()
+        if timing is not None:
+            timing.trace(event, time.perf_counter())
+
+    async def _atrace(self, event, info):
+        self._trace(event, info)
+
+    def warm(self):
+        """Any response will do: it leaves an open connection in the pool."""
+        self.sync_client()
+        try:
+            self.http.head(self.base_url, timeout=WARMUP_TIMEOUT)
+        except httpx.HTTPError:
+            return
+        self.warmups += 1
+
+    async def awarm(self):
+        _, http = self._async_clients()
+        try:
+            await http.head(self.base_url, timeout=WARMUP_TIMEOUT)
+        except httpx.HTTPError:
+            return
+        self.warmups += 1
+
+    def stats(self):
+        return {
+            "base_url": self.base_url,
+            "requests": self.requests,
+            "connections": self.connections,
+            "reused": max(0, self.requests - self.connections),
+            "warmups": self.warmups,
+        }
+
+    def close(self):
+        """Close the clients; async ones are closed on their loops without waiting."""
+        if self.http is not None:
+            self.http.close()
+        for loop, http in self._take_async():
+            if loop.is_running():
+                asyncio.run_coroutine_threadsafe(http.aclose(), loop)
+
+    async def aclose(self):
+        """close() that waits for the async clients to close."""
+        if self.http is not None:
+            self.http.close()
+        current = asyncio.get_running_loop()
+        for loop, http in self._take_async():
+            if loop is current:
+                await http.aclose()
+            elif loop.is_running():
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(http.aclose(), loop))
+
+    def _take_async(self):
+        with self._lock:
+            clients = [(loop, http) for loop, (_, http) in self._async.items()]
+            self._async.clear()
+        return clients
+
+
+class _DrainingTransport(httpx.HTTPTransport):
+    """
+    Reads the end of an SSE body that the OpenAI SDK's sync Stream leaves
+    unread after [DONE]. Closing an HTTP/1.1 response before its end
+    closes the connection, so without this no sync call reused one. The
+    SDK's async Stream already drains.
+    """
+
+    def handle_request(self, request):
+        response = super().handle_request(request)
+        response.stream = _DrainOnClose(response.stream)
+        return response
+
+
+class _DrainOnClose(httpx.SyncByteStream):
+    def __init__(self, stream):
+        self.stream = stream
+        self.tail = b""
+
+    def __iter__(self):
+        for chunk in self.stream:
+            self.tail = (self.tail + chunk)[-64:]
+            yield chunk
+
+    def close(self):
+        # Only the end of the body is left after [DONE]; a stream closed
+        # before it (the client went away) is not read on
+        if SSE_DONE in self.tail:
+            try:
+                for _ in self.stream:
+                    pass
+            except httpx.HTTPError:
+                pass
+        self.stream.close()
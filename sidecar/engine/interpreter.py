@@ -1,25 +1,87 @@
+import asyncio
 import threading
+import time
+from contextlib import aclosing, contextmanager
 
 from config import BolchaiSettings
+from .conversion import MessageConverter
 from .llm import LLMWrapper
-from .respond import respond
+from .respond import arespond, respond
+from execution.kernel_pool import kernel_pool
+from execution.limits import STOPPED_BY_USER, RunGuard
+from execution.output import OutputSink
+from execution.procinfo import rss_bytes
 from execution.python_kernel import PythonKernel
 from execution.subprocess_lang import PowerShellLanguage, ShellLanguage
 
 
+class WarmupLimiter:
+    """
+    Caps speculatively started executors that haven't been used yet,
+    process-wide. A slot is held from the warm-up until its executor runs
+    code or is torn down.
+    """
+
+    def __init__(self, limit=2):
+        self.limit = limit
+        self._active = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self._active >= self.limit:
+                return False
+            self._active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self._active -= 1
+
+
+warmup_limiter = WarmupLimiter()
+
+
 class BolchaiInterpreter:
-    def __init__(self, settings: BolchaiSettings):
+    def __init__(self, settings: BolchaiSettings, history=None):
         self.settings = settings
         self.messages = []
+        # Durable copy of the conversation (a SessionHistory), loaded on the
+        # first turn; messages[:_persisted] have been handed to it
+        self.history = history
+        self._rehydrated = history is None
+        self._persisted = 0
+        self.converter = MessageConverter()
         self.llm = LLMWrapper(settings)
 
         # Code execution engines
         self._languages = {}
+        # Guards _languages; reentrant, as creating an executor looks for an existing one
+        self._create_lock = threading.RLock()
         self._init_languages()
 
+        # Executors started speculatively while their code was streaming,
+        # by class: "starting" until used, or "discard" if the turn ended first
+        self._warmups = {}
+        self._warmup_lock = threading.Lock()
+        self.warmup_stats = {"started": 0, "used": 0, "wasted": 0, "skipped": 0}
+
         # Confirmation flow
         self._confirm_event = threading.Event()
         self._confirm_result = False
+        self._confirm_waiter = None
+        self._confirm_waiting = False
+        self._stopped = False
+
+        # One RunGuard per execution in progress
+        self._guards = set()
+        self._guards_lock = threading.Lock()
+
+        # When each executor last finished running code; only these hold state
+        self._last_used = {}
+        # Executor class -> notice for its next run, after one holding state
+        # was shut down behind the model's back
+        self._lost_state = {}
 
     def _init_languages(self):
         """Initialize language executors lazily."""
@@ -39,98 +101,465 @@ class BolchaiInterpreter:
             "batch": ShellLanguage,
         }
 
+    def supports_language(self, name):
+        return name.lower().strip() in self._language_classes
+
+    def executor_class(self, name):
+        """The executor class behind a language name; aliases share one."""
+        return self._language_classes.get(name.lower().strip())
+
     def get_language(self, name):
         """Get a language executor, creating it if needed."""
         name = name.lower().strip()
         if name not in self._language_classes:
             return None
 
-        if name not in self._languages:
-            cls = self._language_classes[name]
-            # Share instances between aliases
-            for alias, existing in self._languages.items():
-                if isinstance(existing, cls):
+        executor = self._languages.get(name)
+        if executor is not None:
+            return executor
+
+        # Serialized so a warm-up and the real run never start two executors
+        with self._create_lock:
+            if name not in self._languages:
+                cls = self._language_classes[name]
+                existing = self._find_executor(cls)
+                if existing is not None:
+                    # Share instances between aliases
                     self._languages[name] = existing
-                    return existing
-            self._languages[name] = cls()
+                else:
+                    self._languages[name] = kernel_pool.acquire() if cls is PythonKernel else cls()
+            return self._languages[name]
+
+    def _find_executor(self, cls):
+        for existing in self._executors():
+            if isinstance(existing, cls):
+                return existing
+        return None
+
+    def warm_up(self, language):
+        """
+        Start the executor for `language` in the background, so its start-up
+        overlaps with the model still streaming the code. At most one
+        warm-up per executor is outstanding, warmup_limiter caps unused
+        ones across sessions, and one the turn never runs code on is torn
+        down when the turn ends.
+        """
+        cls = self.executor_class(language)
+        if cls is None or self._find_executor(cls) is not None:
+            return
+        with self._warmup_lock:
+            if cls in self._warmups:
+                return
+            if not warmup_limiter.try_acquire():
+                self.warmup_stats["skipped"] += 1
+                return
+            self._warmups[cls] = "starting"
+            self.warmup_stats["started"] += 1
+        threading.Thread(target=self._warm, args=(language, cls), daemon=True).start()
+
+    def _warm(self, language, cls):
+        executor = None
+        try:
+            executor = self.get_language(language)
+        except Exception:
+            pass
+        with self._warmup_lock:
+            state = self._warmups.get(cls)
+            if state is not None and (executor is None or state == "discard"):
+                del self._warmups[cls]
+                warmup_limiter.release()
+                if executor is not None:
+                    self.warmup_stats["wasted"] += 1
+        if executor is not None and state == "discard":
+            self._drop_executor(executor)
 
-        return self._languages[name]
+    def _claim_warmup(self, executor):
+        """Count a run on a speculatively started executor as a hit."""
+        with self._warmup_lock:
+            if self._warmups.get(type(executor)) == "starting":
+                del self._warmups[type(executor)]
+                warmup_limiter.release()
+                self.warmup_stats["used"] += 1
 
-    def run_code(self, language, code):
-        """Execute code in the given language. Yields output chunks."""
+    def _discard_warmups(self):
+        """End of turn: tear down warm-ups that were never used."""
+        unused = []
+        with self._warmup_lock:
+            for cls in list(self._warmups):
+                executor = self._find_executor(cls)
+                if executor is None:
+                    # Still starting; _warm tears it down when it's ready
+                    self._warmups[cls] = "discard"
+                    continue
+                del self._warmups[cls]
+                warmup_limiter.release()
+                self.warmup_stats["wasted"] += 1
+                unused.append(executor)
+        for executor in unused:
+            self._drop_executor(executor)
+
+    def executor_stats(self):
+        """
+        (executor, info) per live executor; info has its language, process,
+        idle time and whether it's running.
+        """
+        now = time.monotonic()
+        with self._guards_lock:
+            running = {id(guard.executor) for guard in self._guards}
+        stats = []
+        for executor in self._executors():
+            last_used = self._last_used.get(executor)
+            stats.append((executor, {
+                "language": executor.name,
+                "pid": executor.process_id(),
+                "running": id(executor) in running,
+                "idle_seconds": None if last_used is None else round(now - last_used, 1),
+            }))
+        return stats
+
+    def recycle_executor(self, executor, reason):
+        """
+        Shut down one executor; it is started fresh on next use. If it held
+        state, that run's output opens with a notice saying so and why.
+        """
+        self._record_lost_state(executor, reason)
+        self._drop_executor(executor)
+
+    def _record_lost_state(self, executor, reason):
+        if self._last_used.pop(executor, None) is None:
+            return
+        if isinstance(executor, PythonKernel):
+            what = "Python kernel restarted"
+            lost = "variables, imports and loaded data were lost"
+        else:
+            what = f"{executor.name} restarted"
+            lost = "working directory and variables were reset"
+        self._lost_state[type(executor)] = {
+            "type": "console",
+            "format": "output",
+            "content": f"[{what} ({reason}); {lost}]\n",
+        }
+
+    def _drop_executor(self, executor):
+        with self._create_lock:
+            for name in [n for n, e in self._languages.items() if e is executor]:
+                del self._languages[name]
+        try:
+            executor.terminate()
+        except Exception:
+            pass
+
+    def run_code(self, language, code, outputs=None):
+        """
+        Execute code in the given language. Yields output chunks. The output
+        message is appended to the conversation, or to `outputs` if given,
+        for a caller that records several blocks' results in its own order.
+        If the output was too big to keep whole, the last chunk carries the
+        output_id of its spill file.
+        """
         executor = self.get_language(language)
         if executor is None:
-            yield {
-                "type": "console",
-                "format": "output",
-                "content": f"Language '{language}' is not supported.",
-            }
+            yield _unsupported(language)
             return
 
-        output_parts = []
-        for chunk in executor.run(code):
-            output_parts.append(chunk)
-            yield chunk
-
-        # Collect output and add to messages
-        output_text = ""
-        for part in output_parts:
-            if part.get("type") == "console" and part.get("format") == "output":
-                output_text += part.get("content", "")
-
-        # Truncate output if too long
-        max_output = 5000
-        if len(output_text) > max_output:
-            output_text = (
-                output_text[:max_output]
-                + f"\n\n[Output truncated to {max_output} characters]"
-            )
+        self._claim_warmup(executor)
+        sink = OutputSink()
+        try:
+            lost = self._lost_state.pop(type(executor), None)
+            if lost:
+                _collect(sink, lost)
+                yield lost
+            with self._guard(executor) as guard:
+                for chunk in executor.run(code):
+                    _collect(sink, chunk)
+                    yield chunk
+            notice = guard.notice(sink.text())
+            if notice:
+                _collect(sink, notice)
+                yield notice
+        finally:
+            sink.close()
+        self._append_output(sink, outputs)
+        if sink.output_id is not None:
+            yield _output_ref(sink.output_id)
 
-        self.messages.append({
+    async def arun_code(self, language, code, outputs=None):
+        """run_code() for the event loop, through the executor's arun()."""
+        # Starting an executor (e.g. a cold kernel) blocks
+        executor = await asyncio.to_thread(self.get_language, language)
+        if executor is None:
+            yield _unsupported(language)
+            return
+
+        self._claim_warmup(executor)
+        sink = OutputSink()
+        try:
+            lost = self._lost_state.pop(type(executor), None)
+            if lost:
+                _collect(sink, lost)
+                yield lost
+            with self._guard(executor) as guard:
+                async with aclosing(executor.arun(code)) as chunks:
+                    async for chunk in chunks:
+                        _collect(sink, chunk)
+                        yield chunk
+            notice = guard.notice(sink.text())
+            if notice:
+                _collect(sink, notice)
+                yield notice
+        finally:
+            sink.close()
+        self._append_output(sink, outputs)
+        if sink.output_id is not None:
+            yield _output_ref(sink.output_id)
+
+    @contextmanager
+    def _guard(self, executor):
+        """Enforce the execution limits on one run; stop() cancels it too."""
+        guard = RunGuard(executor)
+        with self._guards_lock:
+            self._guards.add(guard)
+        guard.start()
+        try:
+            yield guard
+        finally:
+            guard.close()
+            with self._guards_lock:
+                self._guards.discard(guard)
+            self._last_used[executor] = time.monotonic()
+
+    def _append_output(self, sink, outputs=None):
+        # The model sees the head and tail; the full text stays in the spill file
+        output = {
             "role": "computer",
             "type": "console",
             "format": "output",
-            "content": output_text,
-        })
+            "content": sink.text(),
+        }
+        if sink.output_id is not None:
+            output["output_id"] = sink.output_id
+        (self.messages if outputs is None else outputs).append(output)
+
+    def replace_message(self, index, message):
+        """Rewrite an existing message, invalidating its cached conversion."""
+        if index < 0:
+            index += len(self.messages)
+        self.messages[index] = message
+        if index < self._persisted:
+            self.history.put(index, message)
+        self.converter.invalidate(index)
 
     def chat(self, message):
         """
         Main entry point. Takes a user message, yields LMC chunks.
         Message accumulation is handled by respond().
         """
+        self._stopped = False
+        self._rehydrate()
         self.messages.append({
             "role": "user",
             "type": "message",
             "content": message,
         })
 
-        yield from respond(self)
+        try:
+            for chunk in respond(self):
+                self._persist()
+                yield chunk
+        finally:
+            self._persist()
+            self._discard_warmups()
+
+    async def achat(self, message):
+        """chat() for the event loop; the LLM call doesn't hold a thread."""
+        self._stopped = False
+        if not self._rehydrated:
+            await asyncio.to_thread(self._rehydrate)
+        self.messages.append({
+            "role": "user",
+            "type": "message",
+            "content": message,
+        })
+
+        stream = arespond(self)
+        try:
+            async with aclosing(stream):
+                async for chunk in stream:
+                    self._persist()
+                    yield chunk
+        finally:
+            self._persist()
+            self._discard_warmups()
+
+    def _rehydrate(self):
+        """Load the stored conversation, the first time this session is used."""
+        if self._rehydrated:
+            return
+        self._rehydrated = True
+        self.messages = self.history.load()
+        self.converter = MessageConverter()
+        self._persisted = len(self.messages)
+
+    def _persist(self):
+        """
+        Hand messages added since the last call to the history store. Only
+        whole messages are ever appended (respond() accumulates a message
+        before adding it), and rewrites go through replace_message().
+        """
+        if self.history is None or len(self.messages) == self._persisted:
+            return
+        for seq in range(self._persisted, len(self.messages)):
+            self.history.put(seq, self.messages[seq])
+        self._persisted = len(self.messages)
+
+    def expect_confirmation(self):
+        """
+        Arm a confirmation before the prompt goes out, so an answer that
+        arrives quickly isn't lost. On an event loop the turn will wait on a
+        future, which parks it without holding a thread.
+        """
+        self._confirm_event.clear()
+        self._confirm_result = False
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._confirm_waiter = None
+        else:
+            self._confirm_waiter = (loop, loop.create_future())
+
+    @property
+    def awaiting_confirmation(self):
+        return self._confirm_waiting
 
     def confirm(self, approved):
         """Called from the API when user confirms/denies code execution."""
         self._confirm_result = approved
         self._confirm_event.set()
+        waiter = self._confirm_waiter
+        if waiter is not None:
+            loop, future = waiter
+            loop.call_soon_threadsafe(_resolve, future, approved)
 
     def wait_for_confirmation(self, timeout=300):
         """Block until user confirms or denies. Returns True/False."""
-        self._confirm_event.clear()
-        self._confirm_result = False
-        self._confirm_event.wait(timeout=timeout)
+        if self._stopped:
+            return False
+        self._confirm_waiting = True
+        try:
+            self._confirm_event.wait(timeout=timeout)
+        finally:
+            self._confirm_waiting = False
         return self._confirm_result
 
+    async def await_confirmation(self, timeout=300):
+        """wait_for_confirmation() for a turn running on the event loop."""
+        waiter = self._confirm_waiter
+        if self._stopped or waiter is None:
+            return False
+        self._confirm_waiting = True
+        try:
+            return await asyncio.wait_for(waiter[1], timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self._confirm_waiting = False
+            self._confirm_waiter = None
+
+    @property
+    def stopped(self):
+        """Whether stop() was called during the current turn."""
+        return self._stopped
+
+    def stop(self):
+        """
+        Abort the current turn from another thread: deny a pending
+        confirmation and interrupt whatever code is running, killing it if
+        it doesn't stop. Idle executors are left alone, so a shell keeps
+        its working directory and variables.
+        """
+        self._stopped = True
+        self.confirm(False)
+        with self._guards_lock:
+            guards = list(self._guards)
+        for guard in guards:
+            guard.cancel(STOPPED_BY_USER)
+
     def reset(self):
         """Clear conversation history."""
         self.messages = []
+        self.converter = MessageConverter()
+        self.llm.reset()
+        self._lost_state = {}
+        self._persisted = 0
+        if self.history is not None:
+            # Nothing older needs loading now
+            self._rehydrated = True
+            self.history.reset()
 
     def update_settings(self, settings: BolchaiSettings):
         """Update settings and propagate to LLM."""
         self.settings = settings
         self.llm.update_settings(settings)
 
-    def cleanup(self):
-        """Clean up all resources."""
-        for lang in self._languages.values():
+    def _executors(self):
+        """Distinct live executors (aliases share one instance)."""
+        # Warm-ups, the monitor and the API use _languages from other threads
+        with self._create_lock:
+            languages = list(self._languages.values())
+        unique = []
+        for lang in languages:
+            if not any(lang is seen for seen in unique):
+                unique.append(lang)
+        return unique
+
+    def kernel_count(self):
+        """Number of executors holding a child process."""
+        return sum(1 for lang in self._executors() if lang.process_id())
+
+    def memory_usage(self):
+        """Total resident memory of this session's executor processes, in bytes."""
+        return sum(rss_bytes(lang.process_id()) for lang in self._executors())
+
+    def cleanup(self, reason=None):
+        """
+        Clean up all resources. Executors are recreated lazily on next use;
+        with a `reason`, the model is told about any state that was lost.
+        """
+        # A warm-up still starting is marked for discard, and drops its
+        # executor once started, so none outlives the cleanup
+        self._discard_warmups()
+        with self._create_lock:
+            languages = self._executors()
+            self._languages = {}
+        for lang in languages:
+            if reason:
+                self._record_lost_state(lang, reason)
+            else:
+                self._last_used.pop(lang, None)
             try:
                 lang.terminate()
             except Exception:
                 pass
+
+
+def _resolve(future, result):
+    if not future.done():
+        future.set_result(result)
+
+
+def _unsupported(language):
+    return {
+        "type": "console",
+        "format": "output",
+        "content": f"Language '{language}' is not supported.",
+    }
+
+
+def _output_ref(output_id):
+    """Ends a block whose output was spilled: where GET /outputs/{output_id} finds all of it."""
+    return {"type": "console", "format": "output", "content": "", "output_id": output_id}
+
+
+def _collect(sink, chunk):
+    if chunk.get("type") == "console" and chunk.get("format") == "output":
+        sink.write(chunk.get("content", ""))
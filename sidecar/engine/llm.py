@@ -6,9 +6,19 @@ import litellm
 litellm.suppress_debug_info = True
 litellm.REPEATED_STREAMING_CHUNK_LIMIT = 99999999
 
-import tokentrim as tt
-
-from .utils import merge_deltas, parse_partial_json, convert_to_openai_messages
+import asyncio
+import inspect
+import socket
+import time
+from contextlib import aclosing
+
+from .completion_cache import completion_cache, record_delta
+from .conversion import MessageConverter
+from .http_clients import CallTiming, llm_clients, traced
+from .rate_limits import llm_scheduler
+from .routing import delta_chunk, endpoint_label, llm_router
+from .parsers import CodeFenceParser, ToolArgumentsParser
+from .tokens import trim_messages
 
 # Tool schema for function-calling models
 TOOL_SCHEMA = {
@@ -49,7 +59,11 @@ class LLMWrapper:
         self.max_tokens = settings.max_tokens
         self.api_key = settings.api_key
         self.api_base = settings.api_base
+        self.prompt_caching = settings.prompt_caching
+        self.fallbacks = _fallbacks(settings)
         self.supports_functions = None
+        self.stats = {}
+        self._trim_start = 0
 
     def update_settings(self, settings):
         self.model = settings.model
@@ -58,12 +72,37 @@ class LLMWrapper:
         self.max_tokens = settings.max_tokens
         self.api_key = settings.api_key
         self.api_base = settings.api_base
+        self.prompt_caching = settings.prompt_caching
+        self.fallbacks = _fallbacks(settings)
         self.supports_functions = None
 
-    def run(self, messages):
+    def reset(self):
+        """Forget per-conversation state (the sticky trim point)."""
+        self._trim_start = 0
+
+    def run(self, system_message, messages, converter=None):
         """
-        Takes LMC messages, converts to OpenAI format, calls LLM, yields LMC chunks.
+        Takes a system prompt and LMC messages, converts them to OpenAI format,
+        calls the LLM and yields LMC chunks. Pass the conversation's
+        MessageConverter to reuse conversions from earlier calls.
         """
+        params = self._prepare(system_message, messages, converter)
+        if self.supports_functions:
+            yield from _run_tool_calling_llm(self._stream(params))
+        else:
+            yield from _run_text_llm(self._stream(params))
+
+    async def arun(self, system_message, messages, converter=None):
+        """run() on the event loop, streaming through litellm.acompletion."""
+        params = self._prepare(system_message, messages, converter)
+        decoder = _ToolCallDecoder() if self.supports_functions else _TextDecoder()
+        parse = _adecode(decoder, self._astream(params))
+        async with aclosing(parse):
+            async for chunk in parse:
+                yield chunk
+
+    def _prepare(self, system_message, messages, converter):
+        """Build the completion request: convert, trim and add the system prompt."""
         if self.supports_functions is None:
             try:
                 self.supports_functions = litellm.supports_function_calling(self.model)
@@ -71,38 +110,38 @@ class LLMWrapper:
                 self.supports_functions = False
 
         # Convert LMC messages to OpenAI format
-        openai_messages = convert_to_openai_messages(
-            messages, function_calling=self.supports_functions
-        )
-
-        system_message = openai_messages[0]["content"]
-        chat_messages = openai_messages[1:]
-
-        # Trim messages to fit context window
-        try:
-            trim_to = self.context_window - self.max_tokens - 25
-            chat_messages = tt.trim(
-                chat_messages,
-                system_message=system_message,
-                max_tokens=trim_to,
+        if converter is None:
+            converter = MessageConverter()
+        chat_messages = converter.convert(messages, function_calling=self.supports_functions)
+
+        # Add execution instructions for text-based models
+        if not self.supports_functions:
+            system_message += "\n" + EXECUTION_INSTRUCTIONS
+
+        # Trim messages to fit the context window
+        trim_to = self.context_window - self.max_tokens - 25
+        if trim_to <= 0:
+            trim_to = 8000
+        trim_start = time.perf_counter()
+        if self.prompt_caching:
+            # Keep the cut point fixed between turns so the prefix stays cacheable
+            chat_messages, trim_stats = trim_messages(
+                chat_messages, system_message, trim_to, self.model,
+                keep_from=self._trim_start, headroom=0.25,
             )
-        except Exception:
-            try:
-                chat_messages = tt.trim(
-                    chat_messages,
-                    system_message=system_message,
-                    model=self.model,
-                )
-            except Exception:
-                chat_messages = tt.trim(
-                    chat_messages,
-                    system_message=system_message,
-                    max_tokens=8000,
-                )
+            self._trim_start = trim_stats["messages_dropped"]
+        else:
+            chat_messages, trim_stats = trim_messages(
+                chat_messages, system_message, trim_to, self.model
+            )
+        self.stats = {
+            "trim_ms": round((time.perf_counter() - trim_start) * 1000, 3),
+            **trim_stats,
+        }
 
-        # Ensure system message is first
-        if not chat_messages or chat_messages[0].get("role") != "system":
-            chat_messages = [{"role": "system", "content": system_message}] + chat_messages
+        chat_messages = [{"role": "system", "content": system_message}] + chat_messages
+        if self.prompt_caching and _supports_cache_control(self.model):
+            chat_messages = _add_cache_breakpoints(chat_messages)
 
         # Build request params
         params = {
@@ -119,171 +158,402 @@ class LLMWrapper:
             params["max_tokens"] = self.max_tokens
         if self.temperature is not None:
             params["temperature"] = self.temperature
+        if self.prompt_caching:
+            params["stream_options"] = {"include_usage": True}
 
         if self.supports_functions:
             params["tools"] = [TOOL_SCHEMA]
-            # Process messages for tool calling format
-            chat_messages = _process_messages_for_tools(chat_messages)
-            params["messages"] = chat_messages
-            yield from _run_tool_calling_llm(params)
-        else:
-            # Add execution instructions for text-based models
-            if chat_messages and chat_messages[0]["role"] == "system":
-                chat_messages[0]["content"] += "\n" + EXECUTION_INSTRUCTIONS
-                params["messages"] = chat_messages
-            yield from _run_text_llm(params)
-
-
-def _process_messages_for_tools(messages):
-    """Convert function_call format to tool_calls format."""
-    processed = []
-    last_tool_id = 0
-
-    i = 0
-    while i < len(messages):
-        message = messages[i]
-
-        if message.get("function_call"):
-            last_tool_id += 1
-            tool_id = f"toolu_{last_tool_id}"
-            msg = dict(message)
-            function = msg.pop("function_call")
-            msg["tool_calls"] = [
-                {"id": tool_id, "type": "function", "function": function}
-            ]
-            processed.append(msg)
-
-            if i + 1 < len(messages) and messages[i + 1].get("role") == "function":
-                next_msg = dict(messages[i + 1])
-                next_msg["role"] = "tool"
-                next_msg["tool_call_id"] = tool_id
-                processed.append(next_msg)
-                i += 1
-            else:
-                processed.append(
-                    {"role": "tool", "tool_call_id": tool_id, "content": ""}
-                )
-        elif message.get("role") == "function":
-            last_tool_id += 1
-            tool_id = f"toolu_{last_tool_id}"
-            processed.append({
-                "role": "assistant",
-                "tool_calls": [{
-                    "id": tool_id,
-                    "type": "function",
-                    "function": {
-                        "name": "execute",
-                        "arguments": "{}",
-                    },
-                }],
-            })
-            msg = dict(message)
-            msg["role"] = "tool"
-            msg["tool_call_id"] = tool_id
-            processed.append(msg)
+        return params
+
+    def _stream(self, params):
+        """
+        Stream completion chunks, recording provider-reported usage. A
+        request in the completion cache is replayed from it instead;
+        otherwise the router picks the endpoint, falling back as needed.
+        """
+        key = completion_cache.key(params)
+        if key is not None:
+            deltas = completion_cache.get(key)
+            self.stats["cache"] = "miss" if deltas is None else "hit"
+            if deltas is not None:
+                yield from _replay(deltas)
+                return
+
+        deltas = []
+        timings = {}
+        route = self.stats["route"] = {}
+        endpoints = self._endpoints()
+        # With somewhere to fail over to, that beats retrying the same endpoint
+        retries = None if len(endpoints) == 1 else 0
+        tokens = self._estimate()
+        stream = llm_router.route(
+            endpoints, lambda attempt: self._open(params, attempt, timings, tokens, retries), route
+        )
+        try:
+            for chunk in stream:
+                self._first_chunk(timings, route)
+                self._record_usage(chunk)
+                if key is not None:
+                    _record(deltas, chunk)
+                yield chunk
+        finally:
+            stream.close()
+        # Only a stream read to the end, and answered by the model it is keyed on, is stored
+        if key is not None and _answered_by_primary(route, endpoints):
+            completion_cache.put(key, deltas)
+
+    async def _astream(self, params):
+        key = completion_cache.key(params)
+        if key is not None:
+            deltas = await asyncio.to_thread(completion_cache.get, key)
+            self.stats["cache"] = "miss" if deltas is None else "hit"
+            if deltas is not None:
+                for chunk in _replay(deltas):
+                    yield chunk
+                return
+
+        deltas = []
+        timings = {}
+        route = self.stats["route"] = {}
+        endpoints = self._endpoints()
+        # With somewhere to fail over to, that beats retrying the same endpoint
+        retries = None if len(endpoints) == 1 else 0
+        tokens = self._estimate()
+        stream = llm_router.aroute(
+            endpoints, lambda attempt: self._aopen(params, attempt, timings, tokens, retries), route
+        )
+        try:
+            async for chunk in stream:
+                self._first_chunk(timings, route)
+                self._record_usage(chunk)
+                if key is not None:
+                    _record(deltas, chunk)
+                yield chunk
+        finally:
+            await stream.aclose()
+        if key is not None and _answered_by_primary(route, endpoints):
+            await asyncio.to_thread(completion_cache.put, key, deltas)
+
+    def _endpoints(self):
+        """The primary (model, api_base, api_key), then the fallbacks."""
+        endpoints = [(self.model, self.api_base, self.api_key)]
+        for endpoint in self.fallbacks:
+            if endpoint not in endpoints:
+                endpoints.append(endpoint)
+        return endpoints
+
+    def _estimate(self):
+        """Tokens a request may use against a tokens-per-minute limit: the trimmed prompt and max_tokens."""
+        return self.stats.get("prompt_tokens", 0) + (self.max_tokens or 0)
+
+    def _open(self, params, attempt, timings, tokens, retries=None):
+        """
+        Stream one endpoint's chunks, through the pooled client when it has
+        one, once the endpoint's rate limits have room.
+        """
+        model, api_base, api_key = attempt.endpoint
+        timing = timings[endpoint_label(attempt.endpoint)] = CallTiming()
+        client = llm_clients.client(model, api_base, api_key, False)
+        # 429s and other retries are the scheduler's when it is on
+        sent_retries = llm_scheduler.client_retries(retries)
+        with traced(timing):
+            ticket, response = llm_scheduler.call(
+                attempt.endpoint, self, tokens,
+                lambda: litellm.completion(
+                    **_endpoint_params(params, attempt.endpoint, sent_retries),
+                    **_client_param(client, sent_retries),
+                ),
+                attempt, retries,
+            )
+        timing.queued(ticket)
+        attempt.abort = lambda: _abort_stream(response)
+        used = None
+        try:
+            for chunk in response:
+                timing.first_token()
+                used = _usage_tokens(chunk) or used
+                yield chunk
+        finally:
+            # Closed early (e.g. the client went away): drop the HTTP stream
+            _close_stream(response)
+        llm_scheduler.settle(ticket, used)
+
+    async def _aopen(self, params, attempt, timings, tokens, retries=None):
+        model, api_base, api_key = attempt.endpoint
+        timing = timings[endpoint_label(attempt.endpoint)] = CallTiming()
+        client = llm_clients.client(model, api_base, api_key, True)
+        sent_retries = llm_scheduler.client_retries(retries)
+        with traced(timing):
+            ticket, response = await llm_scheduler.acall(
+                attempt.endpoint, self, tokens,
+                lambda: litellm.acompletion(
+                    **_endpoint_params(params, attempt.endpoint, sent_retries),
+                    **_client_param(client, sent_retries),
+                ),
+                retries,
+            )
+        timing.queued(ticket)
+        used = None
+        try:
+            async for chunk in response:
+                timing.first_token()
+                used = _usage_tokens(chunk) or used
+                yield chunk
+        finally:
+            await _aclose_stream(response)
+        llm_scheduler.settle(ticket, used)
+
+    def _first_chunk(self, timings, route):
+        if "timing" not in self.stats and route.get("endpoint") in timings:
+            self.stats["timing"] = timings[route["endpoint"]].as_dict()
+
+    def _record_usage(self, chunk):
+        usage = getattr(chunk, "usage", None)
+        if not usage:
+            return
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) or getattr(usage, "cache_read_input_tokens", None) or 0
+        self.stats["usage"] = {
+            "prompt_tokens": getattr(usage, "prompt_tokens", 0) or 0,
+            "completion_tokens": getattr(usage, "completion_tokens", 0) or 0,
+            "cached_tokens": cached,
+        }
+
+
+def _usage_tokens(chunk):
+    """Tokens a chunk's reported usage counts, or None."""
+    usage = getattr(chunk, "usage", None)
+    if not usage:
+        return None
+    return (getattr(usage, "prompt_tokens", 0) or 0) + (getattr(usage, "completion_tokens", 0) or 0) or None
+
+
+def _answered_by_primary(route, endpoints):
+    """
+    Whether the primary endpoint gave the whole answer. A fallback's, or
+    one pieced together after a failover, isn't cached under the
+    primary's key.
+    """
+    return route.get("endpoint") == endpoint_label(endpoints[0]) and not route.get("failovers")
+
+
+def _fallbacks(settings):
+    return [(endpoint.model, endpoint.api_base, endpoint.api_key) for endpoint in settings.fallbacks]
+
+
+def _endpoint_params(params, endpoint, retries=None):
+    """Request params for one endpoint of the route."""
+    model, api_base, api_key = endpoint
+    params = {**params, "model": model}
+    if retries is not None:
+        params["max_retries"] = retries
+    for name, value in (("api_base", api_base), ("api_key", api_key)):
+        if value:
+            params[name] = value
         else:
-            processed.append(message)
+            params.pop(name, None)
+    return params
 
-        i += 1
 
-    return processed
+def _client_param(client, retries=None):
+    """litellm's client argument, when the pool has a client for the endpoint."""
+    if client is None:
+        return {}
+    if retries is not None:
+        client = client.with_options(max_retries=retries)
+    return {"client": client}
 
 
-def _run_tool_calling_llm(params):
-    """Parse tool-calling LLM output into LMC chunks."""
-    accumulated_deltas = {}
-    language = None
-    code = ""
+def _record(deltas, chunk):
+    delta = record_delta(chunk)
+    if delta is not None:
+        deltas.append(delta)
 
-    for chunk in litellm.completion(**params):
-        if "choices" not in chunk or len(chunk["choices"]) == 0:
-            continue
 
-        delta = chunk["choices"][0]["delta"]
+def _replay(deltas):
+    """Stream chunks rebuilt from cached deltas, for the same decoders."""
+    for delta in deltas:
+        yield delta_chunk(delta)
+
+
+def _close_stream(response):
+    """Close the provider stream under a litellm stream wrapper, if it has one."""
+    stream = getattr(response, "completion_stream", response)
+    close = getattr(stream, "close", None)
+    if callable(close):
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def _abort_stream(response):
+    """
+    End a stream that another thread may be blocked reading. Closing a
+    socket doesn't wake a blocked read; shutting it down does. An HTTP/2
+    connection carries other streams, so it is only closed.
+    """
+    stream = getattr(response, "completion_stream", response)
+    http = getattr(stream, "response", None)
+    network = getattr(http, "extensions", {}).get("network_stream")
+    if network is not None and http.http_version == "HTTP/1.1":
+        sock = network.get_extra_info("socket")
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+                return
+            except OSError:
+                pass
+    _close_stream(response)
+
+
+async def _aclose_stream(response):
+    stream = getattr(response, "completion_stream", response)
+    close = getattr(stream, "aclose", None) or getattr(stream, "close", None)
+    if callable(close):
+        try:
+            result = close()
+            if inspect.isawaitable(result):
+                await result
+        except Exception:
+            pass
+
+
+def _supports_cache_control(model):
+    """Whether a model takes explicit cache_control breakpoints (Anthropic)."""
+    try:
+        return litellm.get_llm_provider(model)[1] == "anthropic"
+    except Exception:
+        return False
+
+
+def _add_cache_breakpoints(messages):
+    """
+    Mark the system prompt and the newest text message as cache breakpoints.
+    Returns a new list; the converter's cached messages are left untouched.
+    """
+    marked = list(messages)
+    breakpoints = [0]
+    for index in range(len(marked) - 1, 0, -1):
+        message = marked[index]
+        if message.get("role") in ("user", "assistant") and isinstance(message.get("content"), str) and message["content"]:
+            breakpoints.append(index)
+            break
+
+    for index in breakpoints:
+        message = marked[index]
+        marked[index] = {
+            **message,
+            "content": [{
+                "type": "text",
+                "text": message["content"],
+                "cache_control": {"type": "ephemeral"},
+            }],
+        }
+    return marked
+
+
+class _ToolCallDecoder:
+    """
+    Turns tool-calling stream chunks into LMC chunks. A response can carry
+    several calls, told apart by their index; each one becomes its own code
+    block, opened with a start flag.
+    """
 
-        if "tool_calls" in delta and delta["tool_calls"]:
-            if len(delta["tool_calls"]) > 0 and delta["tool_calls"][0].function:
-                delta = {
-                    "function_call": {
-                        "name": delta["tool_calls"][0].function.name,
-                        "arguments": delta["tool_calls"][0].function.arguments,
-                    }
-                }
+    def __init__(self):
+        self.calls = {}
+        self.streaming = None
 
-        accumulated_deltas = merge_deltas(accumulated_deltas, delta)
+    def feed(self, chunk):
+        if "choices" not in chunk or len(chunk["choices"]) == 0:
+            return
+
+        delta = chunk["choices"][0]["delta"]
 
         if "content" in delta and delta["content"]:
             yield {"type": "message", "content": delta["content"]}
 
-        if (
-            accumulated_deltas.get("function_call")
-            and "arguments" in accumulated_deltas["function_call"]
-            and accumulated_deltas["function_call"]["arguments"]
-        ):
-            arguments = parse_partial_json(
-                accumulated_deltas["function_call"]["arguments"]
-            )
-            if arguments:
-                if (
-                    language is None
-                    and "language" in arguments
-                    and "code" in arguments
-                    and arguments["language"]
-                ):
-                    language = arguments["language"]
-
-                if language is not None and "code" in arguments:
-                    code_delta = arguments["code"][len(code):]
-                    code = arguments["code"]
-                    if code_delta:
-                        yield {
-                            "type": "code",
-                            "format": language,
-                            "content": code_delta,
-                        }
-
-
-def _run_text_llm(params):
-    """Parse text-based LLM output, detecting code blocks via triple backticks."""
-    inside_code_block = False
-    accumulated_block = ""
-    language = None
-
-    for chunk in litellm.completion(**params):
+        for position, tool_call in enumerate(delta.get("tool_calls") or ()):
+            if not tool_call.function or not tool_call.function.arguments:
+                continue
+            index = getattr(tool_call, "index", None)
+            key = position if index is None else index
+            call = self.calls.get(key)
+            if call is None:
+                call = self.calls[key] = _ToolCall()
+            code_delta = call.feed(tool_call.function.arguments)
+            if not code_delta:
+                continue
+            lmc = {"type": "code", "format": call.language, "content": code_delta}
+            if self.streaming is not call:
+                self.streaming = call
+                lmc["start"] = True
+            yield lmc
+
+    def finish(self):
+        return ()
+
+
+class _ToolCall:
+    """Argument state for one tool call in a streamed response."""
+
+    def __init__(self):
+        self.parser = ToolArgumentsParser()
+        self.language = None
+        self.pending_code = []
+
+    def feed(self, arguments):
+        """Take an arguments fragment; returns the code that can be emitted."""
+        code_parts = [text for key, text in self.parser.feed(arguments) if key == "code"]
+
+        # Code can stream before the language is known; hold it until then
+        if self.language is None:
+            self.pending_code.extend(code_parts)
+            if "language" not in self.parser.complete or not self.parser.value("language"):
+                return ""
+            self.language = self.parser.value("language")
+            code_parts = self.pending_code
+            self.pending_code = []
+
+        return "".join(code_parts)
+
+
+class _TextDecoder:
+    """Turns text stream chunks into LMC chunks, detecting markdown code fences."""
+
+    def __init__(self):
+        self.parser = CodeFenceParser()
+
+    def feed(self, chunk):
         if "choices" not in chunk or len(chunk["choices"]) == 0:
-            continue
-
+            return ()
         content = chunk["choices"][0]["delta"].get("content", "")
-        if content is None:
-            continue
+        return self.parser.feed(content) if content else ()
 
-        accumulated_block += content
+    def finish(self):
+        return self.parser.finish()
 
-        if accumulated_block.endswith("`"):
-            continue
 
-        # Entering a code block
-        if "```" in accumulated_block and not inside_code_block:
-            inside_code_block = True
-            accumulated_block = accumulated_block.split("```")[1]
+def _run_tool_calling_llm(stream):
+    """Parse a tool-calling LLM stream into LMC chunks."""
+    yield from _decode(_ToolCallDecoder(), stream)
 
-        # Exiting a code block
-        if inside_code_block and "```" in accumulated_block:
-            return
 
-        if inside_code_block:
-            if language is None and "\n" in accumulated_block:
-                language = accumulated_block.split("\n")[0]
-                if language == "":
-                    language = "python"
-                else:
-                    language = "".join(c for c in language if c.isalpha())
-
-            if language:
-                yield {
-                    "type": "code",
-                    "format": language,
-                    "content": content.replace(language, ""),
-                }
-        else:
-            yield {"type": "message", "content": content}
+def _run_text_llm(stream):
+    """Parse a text-based LLM stream, detecting code blocks via markdown fences."""
+    yield from _decode(_TextDecoder(), stream)
+
+
+def _decode(decoder, stream):
+    for chunk in stream:
+        yield from decoder.feed(chunk)
+    yield from decoder.finish()
+
+
+async def _adecode(decoder, stream):
+    async with aclosing(stream):
+        async for chunk in stream:
+            for lmc in decoder.feed(chunk):
+                yield lmc
+    for lmc in decoder.finish():
+        yield lmc
@@ -0,0 +1,104 @@
+import threading
+import time
+
+from execution.procinfo import session_usage
+
+MB = 1024 * 1024
+
+
+class ExecutorMonitor:
+    """
+    Samples the memory and CPU use of every session's executors (shells and
+    kernels, including their children) from /proc, and recycles executors
+    that use too much memory or sit unused for too long. The model is told
+    on its next run that the executor's state was lost.
+    """
+
+    def __init__(self, sessions, config):
+        self.sessions = sessions
+        self.config = config
+        self.recycled = {"memory": 0, "idle": 0}
+        self._samples = []
+        # id(executor) -> (time, CPU seconds) at the previous sample
+        self._previous = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        """Take one sample of every executor and recycle the ones over a threshold."""
+        now = time.monotonic()
+        entries = [
+            (session_id, executor, info)
+            for session_id, interpreter in self.sessions.interpreters()
+            for executor, info in interpreter.executor_stats()
+        ]
+        usage = session_usage([info["pid"] for _, _, info in entries])
+
+        samples = []
+        previous = {}
+        for session_id, executor, info in entries:
+            rss, cpu = usage.get(info["pid"], (0, 0.0))
+            cpu_percent = None
+            last = self._previous.get(id(executor))
+            if last is not None and now > last[0]:
+                cpu_percent = round(100 * (cpu - last[1]) / (now - last[0]), 1)
+            previous[id(executor)] = (now, cpu)
+            samples.append({
+                "session_id": session_id,
+                **info,
+                "rss_bytes": rss,
+                "cpu_seconds": round(cpu, 2),
+                "cpu_percent": cpu_percent,
+            })
+
+            recycle = self._recycle_reason(info, rss)
+            if recycle is not None:
+                kind, reason = recycle
+                if self.sessions.recycle(session_id, executor, reason):
+                    self.recycled[kind] += 1
+
+        with self._lock:
+            self._samples = samples
+            self._previous = previous
+
+    def _recycle_reason(self, info, rss):
+        """(kind, reason) if the executor should be recycled, else None."""
+        if info["running"]:
+            return None
+        max_memory = self.config.executor_max_memory_mb
+        if max_memory and rss > max_memory * MB:
+            return "memory", f"memory use of {rss / MB:.0f} MB was over the {max_memory} MB limit"
+        idle = info["idle_seconds"]
+        timeout = self.config.executor_idle_timeout
+        if timeout and idle is not None and idle >= timeout:
+            return "idle", f"unused for {idle:.0f} s"
+        return None
+
+    def _monitor_loop(self):
+        while not self._stop_event.wait(self.config.monitor_interval):
+            try:
+                self.sample()
+            except Exception:
+                pass
+
+    def start(self):
+        """Start the background sampling thread."""
+        if self._thread is None and self.config.monitor_interval > 0:
+            self._thread = threading.Thread(target=self._monitor_loop, daemon=True)
+            self._thread.start()
+
+    def shutdown(self):
+        self._stop_event.set()
+
+    def stats(self):
+        with self._lock:
+            samples = list(self._samples)
+        return {
+            "interval": self.config.monitor_interval,
+            "max_memory_mb": self.config.executor_max_memory_mb,
+            "idle_timeout": self.config.executor_idle_timeout,
+            "recycled": dict(self.recycled),
+            "rss_bytes": sum(s["rss_bytes"] for s in samples),
+            "executors": samples,
+        }
@@ -0,0 +1,335 @@
+import re
+
+# Parser states
+_OBJECT_START = 0
+_KEY_OR_END = 1
+_KEY = 2
+_COLON = 3
+_VALUE = 4
+_STRING = 5
+_OTHER = 6
+_DONE = 7
+
+_STRING_SPECIAL = re.compile(r'["\\]')
+_WHITESPACE = " \t\r\n"
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    "\\": "\\",
+    "/": "/",
+    "b": "\b",
+    "f": "\f",
+    "n": "\n",
+    "r": "\r",
+    "t": "\t",
+}
+
+
+class ToolArgumentsParser:
+    """
+    Resumable parser for the JSON arguments of a streamed tool call.
+    Feed it argument deltas as they arrive. It keeps its position between
+    calls and returns only the newly decoded characters of top-level string
+    values, so each delta costs O(len(delta)) however long the call gets.
+    Unescaped newlines inside strings, which models often emit, are accepted.
+    """
+
+    def __init__(self):
+        self.complete = set()
+        self._values = {}
+        self._state = _OBJECT_START
+        self._key_parts = []
+        self._key = None
+        self._escape = ""
+        self._high_surrogate = None
+        self._depth = 0
+        self._other_in_string = False
+        self._other_escaped = False
+
+    def value(self, key):
+        """The decoded string value of a key so far, or None if not seen."""
+        parts = self._values.get(key)
+        return "".join(parts) if parts is not None else None
+
+    def feed(self, delta):
+        """Consume a delta. Returns [(key, new_text), ...] for string values."""
+        fragments = []
+        i = 0
+        n = len(delta)
+
+        while i < n:
+            state = self._state
+
+            if state == _STRING or state == _KEY:
+                parts = []
+                i, closed = self._scan_string(delta, i, parts)
+                text = "".join(parts)
+                if state == _KEY:
+                    self._key_parts.append(text)
+                    if closed:
+                        self._key = "".join(self._key_parts)
+                        self._key_parts = []
+                        self._state = _COLON
+                else:
+                    if text:
+                        self._values[self._key].append(text)
+                        fragments.append((self._key, text))
+                    if closed:
+                        self.complete.add(self._key)
+                        self._state = _KEY_OR_END
+                continue
+
+            char = delta[i]
+            i += 1
+
+            if state == _OTHER:
+                self._scan_other(char)
+            elif char in _WHITESPACE:
+                continue
+            elif state == _OBJECT_START:
+                if char == "{":
+                    self._state = _KEY_OR_END
+            elif state == _KEY_OR_END:
+                if char == '"':
+                    self._state = _KEY
+                elif char == "}":
+                    self._state = _DONE
+            elif state == _COLON:
+                if char == ":":
+                    self._state = _VALUE
+            elif state == _VALUE:
+                if char == '"':
+                    self._values[self._key] = []
+                    self._state = _STRING
+                else:
+                    self._depth = 0
+                    self._other_in_string = False
+                    self._other_escaped = False
+                    self._state = _OTHER
+                    self._scan_other(char)
+
+        return fragments
+
+    def _scan_string(self, delta, i, parts):
+        """Decode string content from delta[i:]. Returns (next index, closed)."""
+        n = len(delta)
+        while i < n:
+            if self._escape:
+                i = self._scan_escape(delta, i, parts)
+                continue
+
+            match = _STRING_SPECIAL.search(delta, i)
+            end = match.start() if match else n
+            if end > i:
+                self._flush_surrogate(parts)
+                parts.append(delta[i:end])
+            if match is None:
+                return n, False
+            if delta[end] == '"':
+                self._flush_surrogate(parts)
+                return end + 1, True
+            self._escape = "\\"
+            i = end + 1
+        return i, False
+
+    def _scan_escape(self, delta, i, parts):
+        """Continue a backslash escape that may have been split across deltas."""
+        if self._escape == "\\":
+            char = delta[i]
+            if char != "u":
+                self._escape = ""
+                self._flush_surrogate(parts)
+                parts.append(_SIMPLE_ESCAPES.get(char, char))
+                return i + 1
+            self._escape = "\\u"
+            i += 1
+
+        needed = 6 - len(self._escape)
+        self._escape += delta[i:i + needed]
+        i += min(needed, len(delta) - i)
+        if len(self._escape) < 6:
+            return i
+
+        try:
+            code_point = int(self._escape[2:], 16)
+        except ValueError:
+            code_point = 0xFFFD
+        self._escape = ""
+
+        if 0xD800 <= code_point < 0xDC00:
+            self._flush_surrogate(parts)
+            self._high_surrogate = code_point
+        elif 0xDC00 <= code_point < 0xE000 and self._high_surrogate is not None:
+            combined = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code_point - 0xDC00)
+            self._high_surrogate = None
+            parts.append(chr(combined))
+        else:
+            self._flush_surrogate(parts)
+            parts.append(chr(code_point))
+        return i
+
+    def _flush_surrogate(self, parts):
+        if self._high_surrogate is not None:
+            parts.append("\ufffd")
+            self._high_surrogate = None
+
+    def _scan_other(self, char):
+        """Skip over a non-string value (number, literal, nested object or array)."""
+        if self._other_in_string:
+            if self._other_escaped:
+                self._other_escaped = False
+            elif char == "\\":
+                self._other_escaped = True
+            elif char == '"':
+                self._other_in_string = False
+        elif char == '"':
+            self._other_in_string = True
+        elif char in "{[":
+            self._depth += 1
+        elif char in "}]":
+            if self._depth == 0:
+                self._state = _DONE
+            else:
+                self._depth -= 1
+        elif char == "," and self._depth == 0:
+            self._state = _KEY_OR_END
+
+
+# Outcome of classifying the start of a line
+_UNDECIDED = 0
+_NOT_FENCE = 1
+_FENCE = 2
+
+# A fence line longer than this is treated as text rather than buffered further
+_MAX_FENCE_LINE = 256
+
+
+class CodeFenceParser:
+    """
+    Streaming tokenizer for markdown code fences in a text response.
+    Feed it content chunks; it returns LMC chunks: "message" for prose and
+    "code" for fenced code, with an empty start/end chunk around each block.
+    Only the start of a line that could still turn out to be a fence is held
+    back, so work per chunk is proportional to the chunk. Supports ``` and
+    ~~~ fences of any length, info strings, fences split across chunks and
+    any number of code blocks per response.
+    """
+
+    def __init__(self, default_language="python"):
+        self.default_language = default_language
+        self.language = None
+        self._fence = None
+        self._line = None
+        self._at_line_start = True
+        self._out = []
+
+    @property
+    def in_code(self):
+        return self._fence is not None
+
+    def feed(self, text):
+        """Consume a chunk. Returns the LMC chunks it completes."""
+        i = 0
+        n = len(text)
+        while i < n:
+            if self._line is not None:
+                end = text.find("\n", i)
+                end = n if end < 0 else end + 1
+                self._line += text[i:end]
+                i = end
+                self._resolve_line(complete=self._line.endswith("\n"))
+            elif self._at_line_start:
+                self._line = ""
+            else:
+                end = text.find("\n", i)
+                if end < 0:
+                    self._emit(text[i:])
+                    i = n
+                else:
+                    self._emit(text[i:end + 1])
+                    i = end + 1
+                    self._at_line_start = True
+        return self._take()
+
+    def finish(self):
+        """Flush whatever is held back at the end of the stream."""
+        if self._line:
+            self._resolve_line(complete=True)
+        return self._take()
+
+    def _resolve_line(self, complete):
+        line = self._line
+        verdict, info = self._classify(line, complete)
+        if verdict == _UNDECIDED:
+            return
+        self._line = None
+        if verdict == _NOT_FENCE:
+            self._at_line_start = line.endswith("\n")
+            self._emit(line)
+        elif self._fence is None:
+            self._fence, self.language = info
+            self._out.append({"type": "code", "format": self.language, "content": "", "start": True})
+            self._at_line_start = True
+        else:
+            self._out.append({"type": "code", "format": self.language, "content": "", "end": True})
+            self._fence = None
+            self.language = None
+            self._at_line_start = True
+
+    def _classify(self, line, complete):
+        """Decide whether a (possibly partial) line is an opening or closing fence."""
+        stripped = line.lstrip(" ")
+        if len(line) - len(stripped) > 3:
+            return _NOT_FENCE, None
+        if not stripped:
+            return (_NOT_FENCE, None) if complete else (_UNDECIDED, None)
+
+        char = stripped[0]
+        if char not in "`~" or (self._fence is not None and char != self._fence[0]):
+            return _NOT_FENCE, None
+
+        run = len(stripped) - len(stripped.lstrip(char))
+        rest = stripped[run:]
+        if run < 3:
+            return (_UNDECIDED, None) if run == len(stripped) and not complete else (_NOT_FENCE, None)
+        if not rest and not complete:
+            return _UNDECIDED, None
+
+        if self._fence is not None:
+            # Closing fence: at least as long as the opening one, nothing after it
+            if run < len(self._fence):
+                return _NOT_FENCE, None
+            if rest.strip():
+                return _NOT_FENCE, None
+            if not complete and not rest.endswith("\n"):
+                return _UNDECIDED, None
+            return _FENCE, None
+
+        # Opening fence: wait for the whole info string
+        if not complete and not rest.endswith("\n"):
+            if len(line) > _MAX_FENCE_LINE:
+                return _NOT_FENCE, None
+            return _UNDECIDED, None
+        info = rest.strip()
+        if char == "`" and "`" in info:
+            return _NOT_FENCE, None
+        word = info.split()[0] if info else ""
+        language = "".join(c for c in word if c.isalnum()) or self.default_language
+        return _FENCE, (char * run, language)
+
+    def _emit(self, text):
+        if not text:
+            return
+        last = self._out[-1] if self._out else None
+        if self._fence is None:
+            chunk = {"type": "message", "content": text}
+        else:
+            chunk = {"type": "code", "format": self.language, "content": text}
+        if last and last["type"] == chunk["type"] and last["content"] and not last.get("end"):
+            last["content"] += text
+        else:
+            self._out.append(chunk)
+
+    def _take(self):
+        out = self._out
+        self._out = []
+        return out
@@ -0,0 +1,532 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+import openai
+
+from .http_clients import MAX_RETRIES
+from .routing import endpoint_label
+
+# Back-off after a 429 that carried no Retry-After, doubled for each one in a row
+BACKOFF = 1.0
+MAX_BACKOFF = 30.0
+# Back-off before sending again after another transient failure, as the OpenAI SDK's
+RESEND_BACKOFF = 0.5
+MAX_RESEND_BACKOFF = 8.0
+# Statuses the OpenAI SDK retries, 429 aside
+TRANSIENT_STATUSES = (408, 409)
+# litellm prefixes the provider's raw headers with this
+PROVIDER_PREFIX = "llm_provider-"
+
+# (limit, remaining, reset) headers per bucket, OpenAI's then Anthropic's
+REQUEST_HEADERS = [
+    ("x-ratelimit-limit-requests", "x-ratelimit-remaining-requests", "x-ratelimit-reset-requests"),
+    ("anthropic-ratelimit-requests-limit", "anthropic-ratelimit-requests-remaining",
+     "anthropic-ratelimit-requests-reset"),
+]
+TOKEN_HEADERS = [
+    ("x-ratelimit-limit-tokens", "x-ratelimit-remaining-tokens", "x-ratelimit-reset-tokens"),
+    ("anthropic-ratelimit-tokens-limit", "anthropic-ratelimit-tokens-remaining",
+     "anthropic-ratelimit-tokens-reset"),
+]
+
+
+class RateLimited(Exception):
+    pass
+
+
+class RateScheduler:
+    """
+    Paces LLM requests to each endpoint's requests-per-minute and
+    tokens-per-minute limits, so a burst of turns waits for room instead
+    of drawing 429s. Each limit is a token bucket that refills at limit/60
+    per second. A request takes one request and its estimated tokens:
+    the trimmed prompt plus max_tokens.
+
+    - Requests that don't fit yet wait in one queue per owner (an
+      LLMWrapper, so a session), served in turn. A session with many
+      requests can't starve one with a single request.
+    - Limits start from BOLCHAI_LLM_RPM and BOLCHAI_LLM_TPM, 0 meaning
+      none. The provider's x-ratelimit-* (or anthropic-ratelimit-*)
+      headers then set them, and the remaining counts lower the buckets.
+    - A 429 pauses the endpoint for its Retry-After, or a doubling
+      back-off, and the request queues again. A request that would wait
+      longer than max_wait in total fails instead.
+    - Callers send with the client's own retries off, so 429s reach the
+      scheduler. Other transient failures (timeouts, connection errors,
+      5xx) are sent again here instead, up to `retries` times.
+
+    A request that finishes with reported usage gives back what it was
+    estimated above it.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.rpm = 0
+        self.tpm = 0
+        self.max_wait = 120.0
+        self._limits = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        self.enabled = config.llm_rate_limits
+        self.rpm = config.llm_rpm
+        self.tpm = config.llm_tpm
+        self.max_wait = config.llm_max_queue_wait
+
+    def _entry(self, endpoint):
+        """Caller holds the lock."""
+        limits = self._limits.get(endpoint)
+        if limits is None:
+            limits = self._limits[endpoint] = _Limits(self.rpm, self.tpm)
+        return limits
+
+    def client_retries(self, retries):
+        """max_retries for the client that sends: none while the scheduler retries."""
+        return 0 if self.enabled else retries
+
+    def call(self, endpoint, owner, tokens, send, attempt=None, retries=None):
+        """
+        send() once the endpoint's limits have room; returns (ticket,
+        response). A 429 is waited out and sent again; another transient
+        failure is sent again up to `retries` times (None: MAX_RETRIES).
+        `attempt` is the router's, whose cancel ends the wait.
+        """
+        if not self.enabled:
+            return None, send()
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        failures = 0
+        while True:
+            ticket = self.acquire(endpoint, owner, tokens, deadline, attempt)
+            ticket.waited = time.monotonic() - started
+            try:
+                response = send()
+            except Exception as e:
+                if self._retry(ticket, e, deadline):
+                    continue
+                delay = self._resend_delay(ticket, e, deadline, failures, retries)
+                if delay is None:
+                    raise
+                failures += 1
+                time.sleep(delay)
+                continue
+            self._sent(endpoint, response)
+            return ticket, response
+
+    async def acall(self, endpoint, owner, tokens, send, retries=None):
+        """call() on the event loop; send() returns an awaitable."""
+        if not self.enabled:
+            return None, await send()
+        started = time.monotonic()
+        deadline = started + self.max_wait
+        failures = 0
+        while True:
+            ticket = await self.aacquire(endpoint, owner, tokens, deadline)
+            ticket.waited = time.monotonic() - started
+            try:
+                response = await send()
+            except Exception as e:
+                if self._retry(ticket, e, deadline):
+                    continue
+                delay = self._resend_delay(ticket, e, deadline, failures, retries)
+                if delay is None:
+                    raise
+                failures += 1
+                await asyncio.sleep(delay)
+                continue
+            self._sent(endpoint, response)
+            return ticket, response
+
+    def acquire(self, endpoint, owner, tokens, deadline, attempt=None):
+        """Block until a request of `tokens` may go to the endpoint."""
+        event = threading.Event()
+        ticket = self._enqueue(endpoint, owner, tokens, event.set)
+        if attempt is not None:
+            attempt.abort = ticket.cancel
+            if attempt.cancelled:
+                ticket.cancel()
+        try:
+            while True:
+                delay = self._admit(ticket, deadline)
+                if delay is None:
+                    return ticket
+                event.wait(delay)
+                event.clear()
+        finally:
+            self._leave(ticket)
+
+    async def aacquire(self, endpoint, owner, tokens, deadline):
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        ticket = self._enqueue(endpoint, owner, tokens, lambda: loop.call_soon_threadsafe(event.set))
+        try:
+            while True:
+                delay = self._admit(ticket, deadline)
+                if delay is None:
+                    return ticket
+                try:
+                    await asyncio.wait_for(event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+        finally:
+            self._leave(ticket)
+
+    def _enqueue(self, endpoint, owner, tokens, wake):
+        with self._lock:
+            limits = self._entry(endpoint)
+            ticket = _Ticket(endpoint, owner, tokens, wake)
+            limits.queues.setdefault(owner, deque()).append(ticket)
+            limits.queued += 1
+            limits.dispatch(time.monotonic())
+        return ticket
+
+    def _admit(self, ticket, deadline):
+        """None once the ticket is granted, else seconds to wait before looking again."""
+        now = time.monotonic()
+        with self._lock:
+            limits = self._entry(ticket.endpoint)
+            delay = limits.dispatch(now)
+            left = deadline - now
+            if not ticket.cancelled:
+                if ticket.granted:
+                    return None
+                if left > 0:
+                    return min(delay, left) if delay is not None else left
+        label = endpoint_label(ticket.endpoint)
+        if ticket.cancelled:
+            raise RateLimited(f"request to {label} cancelled while queued")
+        raise RateLimited(f"{label} rate limit: no room within {self.max_wait:g} s")
+
+    def _leave(self, ticket):
+        """Take a ticket out of its queue; one granted but not used gives its room back."""
+        with self._lock:
+            limits = self._entry(ticket.endpoint)
+            if ticket.granted:
+                limits.waited += time.monotonic() - ticket.queued
+                if ticket.cancelled:
+                    limits.refund(ticket.tokens, requests=1)
+                return
+            queue = limits.queues.get(ticket.owner)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del limits.queues[ticket.owner]
+            limits.dispatch(time.monotonic())
+
+    def _retry(self, ticket, error, deadline):
+        """After a failed send: pause on a 429 and say whether to queue again."""
+        if getattr(error, "status_code", None) != 429:
+            return False
+        headers = _error_headers(error)
+        now = time.monotonic()
+        self.observe(ticket.endpoint, headers)
+        with self._lock:
+            limits = self._entry(ticket.endpoint)
+            limits.throttled += 1
+            limits.strikes += 1
+            pause = _retry_after(headers)
+            if pause is None:
+                pause = min(BACKOFF * 2 ** (limits.strikes - 1), MAX_BACKOFF)
+            limits.paused_until = max(limits.paused_until, now + pause)
+            # Turned away, so it didn't count against the limits
+            limits.refund(ticket.tokens, requests=1)
+            if now + pause >= deadline:
+                return False
+            limits.retries += 1
+        return True
+
+    def _resend_delay(self, ticket, error, deadline, failures, retries):
+        """
+        After a failed send that wasn't a 429: seconds to wait before
+        sending again, or None to give up.
+        """
+        if not _transient(error) or failures >= (MAX_RETRIES if retries is None else retries):
+            return None
+        delay = min(RESEND_BACKOFF * 2 ** failures, MAX_RESEND_BACKOFF)
+        if time.monotonic() + delay >= deadline:
+            return None
+        with self._lock:
+            # It produced nothing, so it doesn't count against the token limit
+            self._entry(ticket.endpoint).refund(ticket.tokens)
+        return delay
+
+    def _sent(self, endpoint, response):
+        self.observe(endpoint, _response_headers(response))
+        with self._lock:
+            self._entry(endpoint).strikes = 0
+
+    def observe(self, endpoint, headers):
+        """Adapt an endpoint's limits to the rate-limit headers of a response."""
+        if not headers:
+            return
+        headers = _plain_headers(headers)
+        now = time.monotonic()
+        with self._lock:
+            limits = self._entry(endpoint)
+            for bucket, names in ((limits.requests, REQUEST_HEADERS), (limits.tokens, TOKEN_HEADERS)):
+                for limit, remaining, reset in names:
+                    if limit in headers or remaining in headers:
+                        bucket.adapt(
+                            _number(headers.get(limit)), _number(headers.get(remaining)),
+                            _reset_seconds(headers.get(reset)), now,
+                        )
+                        limits.adapted = True
+                        break
+            limits.dispatch(now)
+
+    def settle(self, ticket, used):
+        """A finished request used `used` tokens; give back what was estimated above that."""
+        if ticket is None or used is None:
+            return
+        with self._lock:
+            limits = self._entry(ticket.endpoint)
+            limits.refund(ticket.tokens - used)
+            limits.dispatch(time.monotonic())
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "max_wait": self.max_wait,
+                "endpoints": [
+                    {"endpoint": endpoint_label(endpoint), **limits.stats(now)}
+                    for endpoint, limits in self._limits.items()
+                ],
+            }
+
+
+llm_scheduler = RateScheduler()
+
+
+class _Ticket:
+    """One request's place in an endpoint's queue."""
+
+    def __init__(self, endpoint, owner, tokens, wake):
+        self.endpoint = endpoint
+        self.owner = owner
+        self.tokens = tokens
+        self.queued = time.monotonic()
+        # Seconds from the call to this ticket's grant, earlier 429s included
+        self.waited = 0.0
+        self.granted = False
+        self.cancelled = False
+        self.wake = wake
+
+    def cancel(self):
+        self.cancelled = True
+        self.wake()
+
+
+class _Bucket:
+    """A per-minute limit as a token bucket; a limit of 0 means none."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.level = float(limit)
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        if self.limit:
+            self.level = min(self.limit, self.level + (now - self.updated) * self.limit / 60)
+        self.updated = now
+
+    def delay(self, amount):
+        """Seconds until `amount` fits, after refill(). More than the whole limit waits for a full bucket."""
+        if not self.limit:
+            return 0.0
+        short = min(amount, self.limit) - self.level
+        return max(0.0, short * 60 / self.limit)
+
+    def take(self, amount):
+        if self.limit:
+            self.level -= amount
+
+    def give(self, amount):
+        if self.limit:
+            self.level = min(self.limit, self.level + amount)
+
+    def adapt(self, limit, remaining, reset, now):
+        self.refill(now)
+        if limit and limit != self.limit:
+            # A first limit starts full; the remaining count below corrects it
+            self.level = limit if not self.limit else min(self.level, limit)
+            self.limit = limit
+        if remaining is not None and self.limit:
+            self.level = min(self.level, remaining)
+        if remaining == 0 and reset and self.limit:
+            # Nothing left until the provider's window resets, whatever the refill rate says
+            self.level = min(self.level, -reset * self.limit / 60)
+
+
+class _Limits:
+    """An endpoint's buckets, its pause after a 429, its queues and counters."""
+
+    def __init__(self, rpm, tpm):
+        self.requests = _Bucket(rpm)
+        self.tokens = _Bucket(tpm)
+        self.paused_until = 0.0
+        self.strikes = 0
+        self.adapted = False
+        # owner -> its waiting tickets; owners are served in turn
+        self.queues = OrderedDict()
+        self.queued = 0
+        self.sent = 0
+        self.waited = 0.0
+        self.throttled = 0
+        self.retries = 0
+
+    def dispatch(self, now):
+        """
+        Grant waiting tickets, one owner at a time, while the buckets have
+        room. Returns seconds until the next could go, or None if none wait.
+        """
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        while self.queues:
+            owner, queue = next(iter(self.queues.items()))
+            ticket = queue[0]
+            if ticket.cancelled:
+                self._pop(owner, queue)
+                continue
+            delay = max(self.paused_until - now, self.requests.delay(1), self.tokens.delay(ticket.tokens))
+            if delay > 0:
+                return delay
+            self.requests.take(1)
+            self.tokens.take(ticket.tokens)
+            self.sent += 1
+            self._pop(owner, queue)
+            ticket.granted = True
+            ticket.wake()
+        return None
+
+    def _pop(self, owner, queue):
+        """Take the owner's first ticket; the owner goes to the back of the line."""
+        queue.popleft()
+        if queue:
+            self.queues.move_to_end(owner)
+        else:
+            del self.queues[owner]
+
+    def refund(self, tokens, requests=0):
+        self.requests.give(requests)
+        self.tokens.give(tokens)
+
+    def stats(self, now):
+        return {
+            "rpm": self.requests.limit,
+            "tpm": self.tokens.limit,
+            "requests_left": round(max(self.requests.level, 0)) if self.requests.limit else None,
+            "tokens_left": round(max(self.tokens.level, 0)) if self.tokens.limit else None,
+            "from_headers": self.adapted,
+            "paused_s": round(max(0.0, self.paused_until - now), 1),
+            "waiting": sum(len(queue) for queue in self.queues.values()),
+            "sessions_waiting": len(self.queues),
+            "queued": self.queued,
+            "sent": self.sent,
+            "wait_s": round(self.waited, 1),
+            "throttled": self.throttled,
+            "retries": self.retries,
+        }
+
+
+def _response_headers(response):
+    """The HTTP headers behind a litellm stream, if it kept them."""
+    headers = getattr(response, "_response_headers", None)
+    if headers:
+        return headers
+    return (getattr(response, "_hidden_params", None) or {}).get("additional_headers")
+
+
+def _error_headers(error):
+    headers = getattr(error, "litellm_response_headers", None)
+    if headers:
+        return headers
+    return getattr(getattr(error, "response", None), "headers", None)
+
+
+def _plain_headers(headers):
+    """Lower-cased header names, without litellm's provider prefix."""
+    plain = {}
+    for name, value in headers.items():
+        name = name.lower()
+        if name.startswith(PROVIDER_PREFIX):
+            name = name[len(PROVIDER_PREFIX):]
+        plain.setdefault(name, value)
+    return plain
+
+
+def _number(value):
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+def _transient(error):
+    """Whether a failed request is worth sending again: a timeout, a lost connection or a server error."""
+    if isinstance(error, openai.APIConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status in TRANSIENT_STATUSES or status >= 500)
+
+
+def _retry_after(headers):
+    """Seconds a 429 asks to wait, from retry-after-ms or Retry-After (seconds or a date)."""
+    if not headers:
+        return None
+    headers = _plain_headers(headers)
+    try:
+        return float(headers["retry-after-ms"]) / 1000
+    except (KeyError, TypeError, ValueError):
+        pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _reset_seconds(value):
+    """
+    Seconds until a limit resets: OpenAI writes a duration ("1s", "6m0s",
+    "20ms"), Anthropic a timestamp.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if "T" in value:
+        try:
+            reset = datetime.fromisoformat(value.replace("Z", "+00:00"))
+        except ValueError:
+            return None
+        return max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
+    seconds, number = 0.0, ""
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    i = 0
+    while i < len(value):
+        char = value[i]
+        if char.isdigit() or char == ".":
+            number += char
+            i += 1
+            continue
+        unit = "ms" if value.startswith("ms", i) else char
+        if unit not in units or not number:
+            return None
+        seconds += float(number) * units[unit]
+        number = ""
+        i += len(unit)
+    if number:
+        seconds += float(number)
+    return seconds
@@ -1,5 +1,9 @@
+import asyncio
 import json
+import queue
+import threading
 import traceback
+from contextlib import aclosing
 
 
 def respond(interpreter):
@@ -10,172 +14,500 @@ def respond(interpreter):
     from .system_message import build_system_message
 
     while True:
-        # Build system message
-        system_message = build_system_message(interpreter.settings.custom_instructions)
-
-        rendered_system_message = {
-            "role": "system",
-            "type": "message",
-            "content": system_message,
-        }
-
-        # Create messages for LLM
-        messages_for_llm = [rendered_system_message] + interpreter.messages.copy()
-
-        # Must have at least one user message
-        if len(interpreter.messages) == 0:
+        # Must have at least one user message; a stopped turn goes no further
+        if len(interpreter.messages) == 0 or interpreter.stopped:
             break
 
+        system_message = build_system_message(interpreter.settings.custom_instructions)
+
         # If last message is code, skip LLM call and go straight to execution
         if interpreter.messages[-1]["type"] == "code":
-            pass  # Fall through to code execution below
+            code_indexes = [len(interpreter.messages) - 1]
         else:
             # Call LLM and accumulate the response
-            current_msg = None
-
+            turn = _Turn(interpreter)
             try:
-                for chunk in interpreter.llm.run(messages_for_llm):
+                for chunk in interpreter.llm.run(
+                    system_message, interpreter.messages, interpreter.converter
+                ):
                     yield {"role": "assistant", **chunk}
+                    turn.add(chunk)
+                    if interpreter.stopped:
+                        break
+                turn.finish()
+            except Exception as e:
+                yield _llm_error(e)
+                break
+            code_indexes = turn.code_indexes()
 
-                    # Accumulate into messages
-                    if chunk.get("type") == "message":
-                        if current_msg is None or current_msg["type"] != "message":
-                            if current_msg is not None:
-                                interpreter.messages.append(current_msg)
-                            current_msg = {
-                                "role": "assistant",
-                                "type": "message",
-                                "content": chunk.get("content", ""),
-                            }
-                        else:
-                            current_msg["content"] += chunk.get("content", "")
-                    elif chunk.get("type") == "code":
-                        if current_msg is not None and current_msg["type"] != "code":
-                            interpreter.messages.append(current_msg)
-                            current_msg = {
-                                "role": "assistant",
-                                "type": "code",
-                                "format": chunk.get("format", "python"),
-                                "content": chunk.get("content", ""),
-                            }
-                        elif current_msg is None:
-                            current_msg = {
-                                "role": "assistant",
-                                "type": "code",
-                                "format": chunk.get("format", "python"),
-                                "content": chunk.get("content", ""),
-                            }
-                        else:
-                            current_msg["content"] += chunk.get("content", "")
-
-                # Append final accumulated message
-                if current_msg is not None:
-                    interpreter.messages.append(current_msg)
+        # LLM didn't produce code — we're done
+        if not code_indexes or interpreter.stopped:
+            break
 
-            except Exception as e:
-                error_msg = str(e)
-                if "auth" in error_msg.lower() or "api key" in error_msg.lower():
-                    yield {
-                        "role": "computer",
-                        "type": "error",
-                        "content": f"Authentication error: {error_msg}\n\nPlease check your API key in Settings.",
-                    }
-                else:
-                    yield {
-                        "role": "computer",
-                        "type": "error",
-                        "content": f"LLM Error: {error_msg}",
-                    }
+        # Independent blocks run side by side; with confirmations, one at a time
+        if interpreter.settings.auto_run and len(code_indexes) > 1:
+            status = yield from _run_code_blocks(interpreter, code_indexes)
+            if status == "stop":
+                break
+            continue
+
+        # Run every code block of the response in order
+        stopped = False
+        for index in code_indexes:
+            status = yield from _run_code_block(interpreter, index)
+            if status == "stop" or interpreter.stopped:
+                stopped = True
                 break
+        if stopped:
+            break
+
+
+async def arespond(interpreter):
+    """
+    respond() for the event loop. The LLM is streamed with LLMWrapper.arun
+    and code runs through the executors' arun(). A turn waiting for
+    confirmation is a suspended coroutine and holds no thread.
+    """
+    from .system_message import build_system_message
+
+    while True:
+        if len(interpreter.messages) == 0 or interpreter.stopped:
+            break
+
+        system_message = build_system_message(interpreter.settings.custom_instructions)
 
-        # Check if we have code to run
         if interpreter.messages[-1]["type"] == "code":
-            language = interpreter.messages[-1].get("format", "python").lower().strip()
-            code = interpreter.messages[-1]["content"]
-
-            # Clean up common hallucinations
-            if code.startswith("`\n"):
-                code = code[2:].strip()
-                interpreter.messages[-1]["content"] = code
-
-            # Handle JSON-wrapped code
-            clean = code.replace("\n", "").replace(" ", "")
-            if clean.startswith('{"language":'):
-                try:
-                    code_dict = json.loads(code)
-                    if set(code_dict.keys()) == {"language", "code"}:
-                        language = code_dict["language"]
-                        code = code_dict["code"]
-                        interpreter.messages[-1]["content"] = code
-                        interpreter.messages[-1]["format"] = language
-                except Exception:
-                    pass
-
-            # Skip text/markdown code blocks (LLM taking notes)
-            if language in ("text", "markdown", "plaintext"):
-                interpreter.messages[-1] = {
+            code_indexes = [len(interpreter.messages) - 1]
+        else:
+            turn = _Turn(interpreter)
+            try:
+                stream = interpreter.llm.arun(
+                    system_message, interpreter.messages, interpreter.converter
+                )
+                async with aclosing(stream):
+                    async for chunk in stream:
+                        yield {"role": "assistant", **chunk}
+                        turn.add(chunk)
+                        if interpreter.stopped:
+                            break
+                turn.finish()
+            except Exception as e:
+                yield _llm_error(e)
+                break
+            code_indexes = turn.code_indexes()
+
+        if not code_indexes or interpreter.stopped:
+            break
+
+        if interpreter.settings.auto_run and len(code_indexes) > 1:
+            result = {}
+            steps = _arun_code_blocks(interpreter, code_indexes, result)
+            async with aclosing(steps):
+                async for chunk in steps:
+                    yield chunk
+            if result.get("value") == "stop":
+                break
+            continue
+
+        stopped = False
+        for index in code_indexes:
+            result = {}
+            steps = _arun_code_block(interpreter, index, result)
+            async with aclosing(steps):
+                async for chunk in steps:
+                    yield chunk
+            if result.get("value") == "stop" or interpreter.stopped:
+                stopped = True
+                break
+        if stopped:
+            break
+
+
+class _Turn:
+    """Accumulates one LLM response's chunks into interpreter.messages."""
+
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.messages = interpreter.messages
+        self.start = len(self.messages)
+        self.current = None
+
+    def add(self, chunk):
+        current = self.current
+        if chunk.get("type") == "message":
+            if current is None or current["type"] != "message":
+                if current is not None:
+                    self.messages.append(current)
+                self.current = {
                     "role": "assistant",
                     "type": "message",
-                    "content": f"```\n{code}\n```",
+                    "content": chunk.get("content", ""),
                 }
-                continue
-
-            # Check if language is supported
-            if not interpreter.get_language(language):
-                yield {
-                    "role": "computer",
-                    "type": "console",
-                    "format": "output",
-                    "content": f"`{language}` is not supported. Available: python, powershell, shell",
+            else:
+                current["content"] += chunk.get("content", "")
+        elif chunk.get("type") == "code":
+            # A start flag opens a new block even right after another one
+            if (
+                current is None
+                or current["type"] != "code"
+                or chunk.get("start")
+            ):
+                if current is not None:
+                    self.messages.append(current)
+                self.current = {
+                    "role": "assistant",
+                    "type": "code",
+                    "format": chunk.get("format", "python"),
+                    "content": chunk.get("content", ""),
                 }
-                break
+                # Start the executor while the rest of the code streams in
+                if chunk.get("format"):
+                    self.interpreter.warm_up(chunk["format"])
+            else:
+                current["content"] += chunk.get("content", "")
 
-            # Skip empty code
-            if not code.strip():
-                yield {
-                    "role": "computer",
-                    "type": "console",
-                    "format": "output",
-                    "content": "Code block was empty.",
-                }
-                continue
-
-            # Yield confirmation request (unless auto_run is on)
-            if not interpreter.settings.auto_run:
-                yield {
-                    "role": "computer",
-                    "type": "confirmation",
-                    "format": "execution",
-                    "content": json.dumps({
-                        "type": "code",
-                        "format": language,
-                        "content": code,
-                    }),
-                }
+    def finish(self):
+        """Append the final accumulated message."""
+        if self.current is not None:
+            self.messages.append(self.current)
+            self.current = None
+
+    def code_indexes(self):
+        return [
+            i for i in range(self.start, len(self.messages))
+            if self.messages[i]["type"] == "code"
+        ]
+
+
+def _llm_error(e):
+    error_msg = str(e)
+    if "auth" in error_msg.lower() or "api key" in error_msg.lower():
+        return {
+            "role": "computer",
+            "type": "error",
+            "content": f"Authentication error: {error_msg}\n\nPlease check your API key in Settings.",
+        }
+    return {
+        "role": "computer",
+        "type": "error",
+        "content": f"LLM Error: {error_msg}",
+    }
+
+
+def _run_code_block(interpreter, index):
+    """
+    Prepare, confirm and execute the code message at `index`. Yields LMC chunks.
+    Returns "ran", "skipped" (nothing to execute) or "stop" (end the turn).
+    """
+    language, code, early = _prepare_code_block(interpreter, index)
+    if early is not None:
+        chunks, status, output = early
+        if output is not None:
+            interpreter.messages.append(output)
+        yield from chunks
+        return status
+
+    # Yield confirmation request (unless auto_run is on)
+    if not interpreter.settings.auto_run:
+        interpreter.expect_confirmation()
+        yield _confirmation(language, code)
+
+        # Wait for user confirmation
+        approved = interpreter.wait_for_confirmation()
+        if not approved:
+            yield _skipped_by_user()
+            return "stop"
 
-                # Wait for user confirmation
-                approved = interpreter.wait_for_confirmation()
-                if not approved:
-                    yield {
-                        "role": "computer",
-                        "type": "console",
-                        "format": "output",
-                        "content": "Code execution skipped by user.",
-                    }
-                    break
-
-            # Execute code
+    # Execute code
+    try:
+        for line in interpreter.run_code(language, code):
+            yield {"role": "computer", **line}
+    except Exception:
+        yield _traceback_chunk()
+    return "ran"
+
+
+async def _arun_code_block(interpreter, index, result):
+    """_run_code_block() for arespond(); the status goes in result["value"]."""
+    language, code, early = _prepare_code_block(interpreter, index)
+    if early is not None:
+        chunks, result["value"], output = early
+        if output is not None:
+            interpreter.messages.append(output)
+        for chunk in chunks:
+            yield chunk
+        return
+
+    if not interpreter.settings.auto_run:
+        # The turn parks on a future here; no thread waits for the user
+        interpreter.expect_confirmation()
+        yield _confirmation(language, code)
+        approved = await interpreter.await_confirmation()
+        if not approved:
+            yield _skipped_by_user()
+            result["value"] = "stop"
+            return
+
+    try:
+        async with aclosing(interpreter.arun_code(language, code)) as lines:
+            async for line in lines:
+                yield {"role": "computer", **line}
+    except Exception:
+        yield _traceback_chunk()
+    result["value"] = "ran"
+
+
+def _run_code_blocks(interpreter, code_indexes):
+    """
+    Run several code blocks of one response at once (auto_run only). Blocks
+    that share an executor run in order on one thread; each executor gets
+    its own. Returns "ran" or "stop", like _run_code_block().
+    """
+    plan, status = _plan_code_blocks(interpreter, code_indexes)
+    results = [None] * len(plan)
+    events = queue.Queue()
+
+    def run_group(positions):
+        for position in positions:
+            language, code, _ = plan[position]
+            outputs = []
             try:
-                for line in interpreter.run_code(language, code):
-                    yield {"role": "computer", **line}
+                for line in interpreter.run_code(language, code, outputs):
+                    events.put((position, {"role": "computer", **line}))
             except Exception:
-                yield {
-                    "role": "computer",
-                    "type": "console",
-                    "format": "output",
-                    "content": traceback.format_exc(),
-                }
+                events.put((position, _traceback_chunk()))
+            results[position] = outputs
+            events.put((position, None))
+
+    threads = []
+    for position, (_, _, early) in enumerate(plan):
+        if early is not None:
+            _queue_early(events.put, position, early, results)
+    for positions in _executor_groups(interpreter, plan):
+        thread = threading.Thread(target=run_group, args=(positions,), daemon=True)
+        thread.start()
+        threads.append(thread)
+
+    order = _CallOrder(len(plan))
+    try:
+        while not order.complete:
+            position, chunk = events.get()
+            yield from order.feed(position, chunk)
+    finally:
+        if not order.complete:
+            # Closed early: interrupt whatever is still running
+            interpreter.stop()
+        for thread in threads:
+            thread.join()
+    _record_outputs(interpreter, results)
+    return status
+
+
+async def _arun_code_blocks(interpreter, code_indexes, result):
+    """_run_code_blocks() for arespond(), with a task per executor."""
+    plan, result["value"] = _plan_code_blocks(interpreter, code_indexes)
+    results = [None] * len(plan)
+    events = asyncio.Queue()
+
+    async def run_group(positions):
+        for position in positions:
+            language, code, _ = plan[position]
+            outputs = []
+            try:
+                async with aclosing(interpreter.arun_code(language, code, outputs)) as lines:
+                    async for line in lines:
+                        events.put_nowait((position, {"role": "computer", **line}))
+            except Exception:
+                events.put_nowait((position, _traceback_chunk()))
+            results[position] = outputs
+            events.put_nowait((position, None))
+
+    for position, (_, _, early) in enumerate(plan):
+        if early is not None:
+            _queue_early(events.put_nowait, position, early, results)
+    loop = asyncio.get_running_loop()
+    tasks = [
+        loop.create_task(run_group(positions))
+        for positions in _executor_groups(interpreter, plan)
+    ]
+
+    order = _CallOrder(len(plan))
+    try:
+        while not order.complete:
+            position, chunk = await events.get()
+            for ready in order.feed(position, chunk):
+                yield ready
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    _record_outputs(interpreter, results)
+
+
+def _plan_code_blocks(interpreter, code_indexes):
+    """
+    Prepare the blocks to run together: everything up to and including the
+    first one that ends the turn. Returns (plan, status).
+    """
+    plan = []
+    for index in code_indexes:
+        language, code, early = _prepare_code_block(interpreter, index)
+        plan.append((language, code, early))
+        if early is not None and early[1] == "stop":
+            return plan, "stop"
+    return plan, "ran"
+
+
+def _executor_groups(interpreter, plan):
+    """Positions of the runnable blocks, grouped by the executor they need."""
+    groups = {}
+    for position, (language, _, early) in enumerate(plan):
+        if early is None:
+            groups.setdefault(interpreter.executor_class(language), []).append(position)
+    return list(groups.values())
+
+
+def _queue_early(put, position, early, results):
+    chunks, _, output = early
+    for chunk in chunks:
+        put((position, chunk))
+    results[position] = [output] if output is not None else []
+    put((position, None))
+
 
+def _record_outputs(interpreter, results):
+    # In block order, so each output answers its own tool call
+    for outputs in results:
+        if outputs:
+            interpreter.messages.extend(outputs)
+
+
+class _CallOrder:
+    """
+    Orders the interleaved output of concurrently running blocks. The
+    earliest unfinished block streams live; later ones are held back until
+    it is done, so each block's output arrives in one piece, opening its own
+    message.
+    """
+
+    def __init__(self, count):
+        self._buffers = [[] for _ in range(count)]
+        self._done = [False] * count
+        self._started = [False] * count
+        self._next = 0
+
+    @property
+    def complete(self):
+        return self._next >= len(self._done)
+
+    def feed(self, position, chunk):
+        """Take a chunk (None once the block is done); returns chunks to emit."""
+        if chunk is None:
+            self._done[position] = True
         else:
-            # LLM didn't produce code — we're done
-            break
+            if not self._started[position]:
+                self._started[position] = True
+                chunk = {**chunk, "start": True}
+            self._buffers[position].append(chunk)
+        if position != self._next:
+            return []
+        ready = []
+        while not self.complete:
+            ready.extend(self._buffers[self._next])
+            self._buffers[self._next] = []
+            if not self._done[self._next]:
+                break
+            self._next += 1
+        return ready
+
+
+def _prepare_code_block(interpreter, index):
+    """
+    Clean up the code message at `index` and check it can run. Returns
+    (language, code, early); early is None, or (chunks, status, output) when
+    the block ends here without executing. output is a message for the
+    caller to record as the block's result, or None.
+    """
+    message = interpreter.messages[index]
+    language = message.get("format", "python").lower().strip()
+    code = message["content"]
+
+    # Clean up common hallucinations
+    if code.startswith("`\n"):
+        code = code[2:].strip()
+        interpreter.replace_message(index, {**message, "content": code})
+
+    # Handle JSON-wrapped code
+    clean = code.replace("\n", "").replace(" ", "")
+    if clean.startswith('{"language":'):
+        try:
+            code_dict = json.loads(code)
+            if set(code_dict.keys()) == {"language", "code"}:
+                language = code_dict["language"]
+                code = code_dict["code"]
+                interpreter.replace_message(
+                    index, {**message, "content": code, "format": language}
+                )
+        except Exception:
+            pass
+
+    # Skip text/markdown code blocks (LLM taking notes)
+    if language in ("text", "markdown", "plaintext"):
+        interpreter.replace_message(index, {
+            "role": "assistant",
+            "type": "message",
+            "content": f"```\n{code}\n```",
+        })
+        return language, code, ([], "skipped", None)
+
+    # Check if language is supported; its executor starts when the code runs
+    if not interpreter.supports_language(language):
+        return language, code, ([{
+            "role": "computer",
+            "type": "console",
+            "format": "output",
+            "content": f"`{language}` is not supported. Available: python, powershell, shell",
+        }], "stop", None)
+
+    # Skip empty code, and tell the model so it doesn't wait for output
+    if not code.strip():
+        output = {
+            "role": "computer",
+            "type": "console",
+            "format": "output",
+            "content": "Code block was empty.",
+        }
+        return language, code, ([output], "skipped", output)
+
+    return language, code, None
+
+
+def _confirmation(language, code):
+    return {
+        "role": "computer",
+        "type": "confirmation",
+        "format": "execution",
+        "content": json.dumps({
+            "type": "code",
+            "format": language,
+            "content": code,
+        }),
+    }
+
+
+def _skipped_by_user():
+    return {
+        "role": "computer",
+        "type": "console",
+        "format": "output",
+        "content": "Code execution skipped by user.",
+    }
+
+
+def _traceback_chunk():
+    return {
+        "role": "computer",
+        "type": "console",
+        "format": "output",
+        "content": traceback.format_exc(),
+    }
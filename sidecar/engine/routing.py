@@ -0,0 +1,569 @@
+import asyncio
+import queue
+import threading
+import time
+
+import litellm
+
+from .completion_cache import record_delta
+
+# Weight of the newest time-to-first-token sample in an endpoint's average
+LATENCY_WEIGHT = 0.3
+FENCE = "```"
+
+
+class RoutingError(Exception):
+    pass
+
+
+def endpoint_label(endpoint):
+    model, api_base, _ = endpoint
+    return f"{model} @ {api_base}" if api_base else model
+
+
+def delta_chunk(delta):
+    """A litellm stream chunk carrying a recorded delta, for the decoders."""
+    return litellm.ModelResponseStream(choices=[{"delta": delta}])
+
+
+class Router:
+    """
+    Routes an LLM call over the primary endpoint and its fallbacks. An
+    endpoint is a (model, api_base, api_key) tuple.
+
+    - No token before the first-token deadline: a hedged request goes to
+      the next endpoint. The first to send a token wins; the others are
+      closed.
+    - An error before the first token moves on to the next endpoint.
+    - A stream that errors or goes quiet for longer than the stall
+      timeout fails over to the next endpoint. The new response is
+      matched against what was already streamed, and only the rest goes
+      out.
+    - Endpoints are tried fastest first, by their average time to first
+      token. Ones never measured come after, in the configured order.
+    - After `breaker_failures` failures in a row, an endpoint's breaker
+      opens and it is skipped for `breaker_cooldown` seconds. Then one
+      request may try it again.
+
+    With no fallbacks a call goes straight to the primary, as before.
+    """
+
+    def __init__(self):
+        self.first_token_timeout = 0.0
+        self.stall_timeout = 0.0
+        self.breaker_failures = 3
+        self.breaker_cooldown = 30.0
+        self._health = {}
+        self._lock = threading.Lock()
+
+    def configure(self, config):
+        self.first_token_timeout = config.llm_first_token_timeout
+        self.stall_timeout = config.llm_stall_timeout
+        self.breaker_failures = config.llm_breaker_failures
+        self.breaker_cooldown = config.llm_breaker_cooldown
+
+    def _entry(self, endpoint):
+        """Caller holds the lock."""
+        health = self._health.get(endpoint)
+        if health is None:
+            health = self._health[endpoint] = _Health()
+        return health
+
+    def rank(self, endpoints):
+        """
+        (endpoints in the order to try them, forced). Ones whose breaker is
+        open are left out, unless every breaker is: then all are returned
+        and forced is True, since trying one beats failing outright.
+        """
+        now = time.monotonic()
+        with self._lock:
+            ranked = [
+                (self._entry(endpoint).ttft or float("inf"), position, endpoint)
+                for position, endpoint in enumerate(endpoints)
+                if self._entry(endpoint).available(now, self.breaker_cooldown)
+            ]
+        if not ranked:
+            return list(endpoints), True
+        return [endpoint for _, _, endpoint in sorted(ranked)], False
+
+    def claim(self, endpoint):
+        """
+        Take an endpoint for an attempt about to be made. A breaker past its
+        cooldown lets this attempt through as its probe; False if the
+        breaker is open or another request holds the probe.
+        """
+        with self._lock:
+            return self._entry(endpoint).claim(time.monotonic(), self.breaker_cooldown)
+
+    def succeeded(self, endpoint, ttft):
+        with self._lock:
+            health = self._entry(endpoint)
+            health.failures = 0
+            health.opened = None
+            health.requests += 1
+            if ttft is not None:
+                health.ttft = ttft if health.ttft is None else (
+                    LATENCY_WEIGHT * ttft + (1 - LATENCY_WEIGHT) * health.ttft
+                )
+
+    def failed(self, endpoint):
+        with self._lock:
+            health = self._entry(endpoint)
+            health.failures += 1
+            health.errors += 1
+            health.requests += 1
+            if health.failures >= self.breaker_failures:
+                health.opened = time.monotonic()
+
+    def count(self, endpoint, event):
+        with self._lock:
+            setattr(self._entry(endpoint), event, getattr(self._entry(endpoint), event) + 1)
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "first_token_timeout": self.first_token_timeout,
+                "stall_timeout": self.stall_timeout,
+                "endpoints": [
+                    {"endpoint": endpoint_label(endpoint), **health.stats(now, self.breaker_cooldown)}
+                    for endpoint, health in self._health.items()
+                ],
+            }
+
+    def route(self, endpoints, open_stream, info):
+        """
+        Stream chunks for a call, from blocking `open_stream(attempt)`
+        generators run on threads. `info` gets the endpoint that answered,
+        and how many attempts, hedges and failovers it took.
+        """
+        if len(endpoints) == 1:
+            yield from _single(self, endpoints[0], open_stream, info)
+            return
+        race = _Race(self, endpoints, info)
+        events = queue.Queue()
+        attempts = []
+        try:
+            for action, value in race.start():
+                attempts.append(_ThreadAttempt(value, open_stream, events))
+                race.add(attempts[-1])
+            while True:
+                try:
+                    event = events.get(timeout=race.wait())
+                except queue.Empty:
+                    event = None
+                for action, value in race.handle(event):
+                    if action == "start":
+                        attempts.append(_ThreadAttempt(value, open_stream, events))
+                        race.add(attempts[-1])
+                    elif action == "cancel":
+                        value.cancel()
+                    elif action == "chunk":
+                        yield value
+                    elif action == "error":
+                        raise value
+                    else:
+                        return
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def aroute(self, endpoints, open_stream, info):
+        """route() on the event loop; `open_stream(attempt)` is an async generator."""
+        if len(endpoints) == 1:
+            async for chunk in _asingle(self, endpoints[0], open_stream, info):
+                yield chunk
+            return
+        race = _Race(self, endpoints, info)
+        events = asyncio.Queue()
+        attempts = []
+        try:
+            for action, value in race.start():
+                attempts.append(_TaskAttempt(value, open_stream, events))
+                race.add(attempts[-1])
+            while True:
+                try:
+                    event = await asyncio.wait_for(events.get(), race.wait())
+                except asyncio.TimeoutError:
+                    event = None
+                for action, value in race.handle(event):
+                    if action == "start":
+                        attempts.append(_TaskAttempt(value, open_stream, events))
+                        race.add(attempts[-1])
+                    elif action == "cancel":
+                        value.cancel()
+                    elif action == "chunk":
+                        yield value
+                    elif action == "error":
+                        raise value
+                    else:
+                        return
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+            await asyncio.gather(*(attempt.task for attempt in attempts), return_exceptions=True)
+
+
+llm_router = Router()
+
+
+class _Health:
+    """Breaker state and first-token latency of one endpoint."""
+
+    def __init__(self):
+        self.failures = 0
+        self.opened = None
+        self.ttft = None
+        self.requests = 0
+        self.errors = 0
+        self.hedges = 0
+        self.failovers = 0
+
+    def available(self, now, cooldown):
+        """Whether the endpoint could be tried: its breaker is closed or past its cooldown."""
+        return self.opened is None or now - self.opened >= cooldown
+
+    def claim(self, now, cooldown):
+        """available(), and take the probe: a breaker past its cooldown lets one request through per cooldown."""
+        if not self.available(now, cooldown):
+            return False
+        if self.opened is not None:
+            self.opened = now
+        return True
+
+    def stats(self, now, cooldown):
+        if self.opened is None:
+            state = "closed"
+        elif now - self.opened >= cooldown:
+            state = "half-open"
+        else:
+            state = "open"
+        return {
+            "breaker": state,
+            "failures": self.failures,
+            "ttft_ms": None if self.ttft is None else round(self.ttft * 1000, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "hedges": self.hedges,
+            "failovers": self.failovers,
+        }
+
+
+class _Attempt:
+    """One request of a routed call. open_stream may set `abort` to a callable that drops its HTTP stream."""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.monotonic()
+        self.abort = None
+        self.cancelled = False
+
+    def _abort(self):
+        abort, self.abort = self.abort, None
+        if abort is not None:
+            try:
+                abort()
+            except Exception:
+                pass
+
+
+class _ThreadAttempt(_Attempt):
+    def __init__(self, endpoint, open_stream, events):
+        super().__init__(endpoint)
+        self.events = events
+        self.stream = open_stream(self)
+        threading.Thread(target=self._pump, daemon=True).start()
+
+    def _pump(self):
+        try:
+            for chunk in self.stream:
+                if self.cancelled:
+                    return
+                self.events.put((self, "chunk", chunk))
+            self.events.put((self, "end", None))
+        except Exception as e:
+            self.events.put((self, "error", e))
+        finally:
+            self.stream.close()
+
+    def cancel(self):
+        # The pump may be blocked on a read; dropping the stream ends it
+        if not self.cancelled:
+            self.cancelled = True
+            self._abort()
+
+
+class _TaskAttempt(_Attempt):
+    def __init__(self, endpoint, open_stream, events):
+        super().__init__(endpoint)
+        self.events = events
+        self.stream = open_stream(self)
+        self.task = asyncio.ensure_future(self._pump())
+
+    async def _pump(self):
+        try:
+            async for chunk in self.stream:
+                self.events.put_nowait((self, "chunk", chunk))
+            self.events.put_nowait((self, "end", None))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.events.put_nowait((self, "error", e))
+        finally:
+            await self.stream.aclose()
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self.task.cancel()
+
+
+def _single(router, endpoint, open_stream, info):
+    """A call with no fallbacks: the primary's stream as is, with its health recorded."""
+    attempt = _Attempt(endpoint)
+    info.update(endpoint=endpoint_label(endpoint), attempts=1)
+    ttft = None
+    stream = open_stream(attempt)
+    try:
+        for chunk in stream:
+            if ttft is None:
+                ttft = time.monotonic() - attempt.started
+            yield chunk
+    except Exception:
+        router.failed(endpoint)
+        raise
+    finally:
+        stream.close()
+    router.succeeded(endpoint, ttft)
+
+
+async def _asingle(router, endpoint, open_stream, info):
+    attempt = _Attempt(endpoint)
+    info.update(endpoint=endpoint_label(endpoint), attempts=1)
+    ttft = None
+    stream = open_stream(attempt)
+    try:
+        async for chunk in stream:
+            if ttft is None:
+                ttft = time.monotonic() - attempt.started
+            yield chunk
+    except Exception:
+        router.failed(endpoint)
+        raise
+    finally:
+        await stream.aclose()
+    router.succeeded(endpoint, ttft)
+
+
+class _Race:
+    """
+    The decisions of one routed call, shared by the thread and task
+    drivers. A driver starts an attempt for each ("start", endpoint) action
+    and passes it to add(). handle() takes an event, (attempt, "chunk" |
+    "end" | "error", value), or None for a timeout. It returns actions:
+    ("start", endpoint), ("cancel", attempt), ("chunk", chunk),
+    ("error", exception) or ("done", None).
+    """
+
+    def __init__(self, router, endpoints, info):
+        self.router = router
+        self.queue, self.forced = router.rank(endpoints)
+        self.info = info
+        self.running = []
+        self.winner = None
+        self.ttft = None
+        self.last_chunk = None
+        self.error = None
+        self.transcript = _Transcript()
+        info.update(attempts=0, hedges=0, failovers=0)
+
+    def start(self):
+        return self._launch()
+
+    def add(self, attempt):
+        self.running.append(attempt)
+
+    def _launch(self):
+        # The breaker is checked again as the attempt is made, which claims a half-open probe
+        while self.queue:
+            endpoint = self.queue.pop(0)
+            if self.forced or self.router.claim(endpoint):
+                self.info["attempts"] += 1
+                return [("start", endpoint)]
+        return []
+
+    def wait(self):
+        """Seconds until the next deadline, or None."""
+        now = time.monotonic()
+        if self.winner is not None:
+            if not self.router.stall_timeout:
+                return None
+            return max(0.0, self.last_chunk + self.router.stall_timeout - now)
+        if not self.router.first_token_timeout or not self.queue or not self.running:
+            return None
+        newest = max(attempt.started for attempt in self.running)
+        return max(0.0, newest + self.router.first_token_timeout - now)
+
+    def handle(self, event):
+        if event is None:
+            return self._timeout()
+        attempt, kind, value = event
+        if attempt not in self.running:
+            return []  # cancelled, or already given up on
+        if kind == "chunk":
+            return self._chunk(attempt, value)
+        if kind == "end":
+            return self._end(attempt)
+        return self._error(attempt, value)
+
+    def _timeout(self):
+        if self.winner is None:
+            # No token yet: hedge on the next endpoint
+            actions = self._launch()
+            for _, endpoint in actions:
+                self.info["hedges"] += 1
+                self.router.count(endpoint, "hedges")
+            return actions
+        stalled = self.winner
+        self.router.failed(stalled.endpoint)
+        self.error = RoutingError(
+            f"{endpoint_label(stalled.endpoint)} sent nothing for {self.router.stall_timeout:g} s"
+        )
+        return [("cancel", stalled)] + self._fail_over(stalled)
+
+    def _fail_over(self, attempt):
+        """The answering stream is gone: carry on from the next endpoint."""
+        self.running.remove(attempt)
+        self.winner = None
+        self.transcript.replay()
+        actions = self._launch()
+        if not actions:
+            return [("error", self.error)]
+        self.info["failovers"] += 1
+        self.router.count(actions[0][1], "failovers")
+        return actions
+
+    def _chunk(self, attempt, chunk):
+        delta = record_delta(chunk)
+        actions = []
+        if self.winner is None:
+            if delta is None:
+                return []  # role or usage only: not a token yet
+            self.winner = attempt
+            self.ttft = time.monotonic() - attempt.started
+            self.info["endpoint"] = endpoint_label(attempt.endpoint)
+            actions = [("cancel", other) for other in self.running if other is not attempt]
+            self.running = [attempt]
+        elif attempt is not self.winner:
+            return []
+        self.last_chunk = time.monotonic()
+        if delta is None or not self.transcript.replaying:
+            self.transcript.add(delta)
+            return actions + [("chunk", chunk)]
+        try:
+            deltas = self.transcript.follow(delta, self.info["endpoint"])
+        except RoutingError as e:
+            self.router.failed(attempt.endpoint)
+            return actions + [("cancel", attempt), ("error", e)]
+        return actions + [("chunk", delta_chunk(delta)) for delta in deltas]
+
+    def _end(self, attempt):
+        if self.winner is None:
+            # An empty answer is still an answer
+            self.winner = attempt
+            self.ttft = time.monotonic() - attempt.started
+            self.info["endpoint"] = endpoint_label(attempt.endpoint)
+        if attempt is not self.winner:
+            return []
+        self.router.succeeded(attempt.endpoint, self.ttft)
+        return [("done", None)]
+
+    def _error(self, attempt, error):
+        self.router.failed(attempt.endpoint)
+        self.error = error
+        if attempt is self.winner:
+            return self._fail_over(attempt)
+        self.running.remove(attempt)
+        actions = self._launch()
+        if actions:
+            self.info["failovers"] += 1
+            self.router.count(actions[0][1], "failovers")
+            return actions
+        if self.running:
+            return []  # a hedge may still answer
+        return [("error", error)]
+
+
+class _Transcript:
+    """
+    The text and tool-call arguments a call has streamed. After a
+    failover, the replacement stream is followed through it: what it
+    repeats is dropped and only the rest goes out.
+    """
+
+    def __init__(self):
+        self.content = ""
+        self.calls = {}
+        self.replaying = False
+        self.seen = ""
+        self.seen_calls = {}
+
+    def add(self, delta):
+        if delta is None:
+            return
+        self.content += delta.get("content") or ""
+        for call in delta.get("tool_calls") or ():
+            arguments = call["function"]["arguments"] or ""
+            self.calls[call["index"]] = self.calls.get(call["index"], "") + arguments
+
+    def replay(self):
+        self.replaying = bool(self.content or self.calls)
+        self.seen = ""
+        self.seen_calls = {}
+
+    def follow(self, delta, label):
+        """The deltas to send for one of the replacement's; raises RoutingError if the answers differ."""
+        seen = self.seen + (delta.get("content") or "")
+        if not _agrees(seen, self.content):
+            return self._diverged(delta, label)
+        out = {}
+        if len(seen) > len(self.content):
+            out["content"] = seen[max(len(self.seen), len(self.content)):]
+        seen_calls = dict(self.seen_calls)
+        calls = []
+        for call in delta.get("tool_calls") or ():
+            index = call["index"]
+            before = seen_calls.get(index, "")
+            now = before + (call["function"]["arguments"] or "")
+            sent = self.calls.get(index, "")
+            if not _agrees(now, sent):
+                return self._diverged(delta, label)
+            seen_calls[index] = now
+            new = now[max(len(before), len(sent)):]
+            if new:
+                calls.append({**call, "function": {**call["function"], "arguments": new}})
+        if calls:
+            out["tool_calls"] = calls
+
+        self.seen, self.seen_calls = seen, seen_calls
+        self.add(out)
+        self.replaying = len(seen) < len(self.content) or any(
+            len(seen_calls.get(index, "")) < len(sent) for index, sent in self.calls.items()
+        )
+        return [out] if out else []
+
+    def _diverged(self, delta, label):
+        # Half a code block can't be taken back; plain text can be followed by the new answer
+        if self.calls or self.content.count(FENCE) % 2:
+            raise RoutingError(f"the stream failed mid code block and {label} answered differently")
+        answer = {**delta, "content": self.seen + (delta.get("content") or "")}
+        self.content, self.calls = "", {}
+        self.replaying = False
+        self.add(answer)
+        notice = f"\n\n[The model stopped responding; answer from {label}:]\n\n"
+        return [{**answer, "content": notice + answer["content"]}]
+
+
+def _agrees(a, b):
+    """Whether one string is a prefix of the other."""
+    return a[:len(b)] == b[:len(a)]
@@ -0,0 +1,240 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
+
+from .interpreter import BolchaiInterpreter
+
+DEFAULT_SESSION = "default"
+
+
+class _Session:
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.last_used = time.monotonic()
+        self.busy = 0
+
+
+class SessionManager:
+    """
+    Bounded pool of per-session interpreters.
+    Sessions are kept in LRU order. Idle sessions have their kernels shut down,
+    and the least recently used ones are evicted when the pool is over its caps.
+    With a MessageStore, conversations are kept there too, so an evicted
+    session (or one from before a restart) picks up where it left off.
+    """
+
+    def __init__(self, settings, config, store=None):
+        self.settings = settings
+        self.config = config
+        self.store = store
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._reaper = None
+
+    def get(self, session_id):
+        """Return the interpreter for a session, creating it if needed."""
+        return self._checkout(session_id).interpreter
+
+    def _checkout(self, session_id, hold=False):
+        """
+        Find or create a session and, with `hold`, mark it busy in the same
+        critical section, so the reaper can't evict it in between.
+        """
+        evicted = []
+        with self._lock:
+            session = self._sessions.get(session_id)
+            created = session is None
+            if created:
+                history = self.store.session(session_id) if self.store else None
+                session = _Session(BolchaiInterpreter(self.settings, history))
+                self._sessions[session_id] = session
+            if hold:
+                session.busy += 1
+            if created:
+                evicted = self._evict_over_capacity()
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+        self._cleanup(evicted)
+        return session
+
+    def peek(self, session_id):
+        """Return an existing session's interpreter without creating one."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return session.interpreter if session else None
+
+    @contextmanager
+    def acquire(self, session_id):
+        """Hold a session busy so it is never reaped or evicted while in use."""
+        session = self._checkout(session_id, hold=True)
+        try:
+            yield session.interpreter
+        finally:
+            with self._lock:
+                session.busy -= 1
+                session.last_used = time.monotonic()
+
+    @asynccontextmanager
+    async def acquire_async(self, session_id):
+        """acquire() for the event loop; creating or evicting sessions runs in a thread."""
+        session = await asyncio.to_thread(self._checkout, session_id, True)
+        try:
+            yield session.interpreter
+        finally:
+            with self._lock:
+                session.busy -= 1
+                session.last_used = time.monotonic()
+
+    def remove(self, session_id):
+        """Drop a session and shut down its kernels."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._cleanup([session.interpreter])
+        return session is not None
+
+    def interpreters(self):
+        """Snapshot of (session_id, interpreter) for every session."""
+        with self._lock:
+            return [(session_id, s.interpreter) for session_id, s in self._sessions.items()]
+
+    def recycle(self, session_id, executor, reason):
+        """Shut down one executor of a session, unless the session is in use."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            return False
+        return self._while_idle(
+            session, lambda: session.interpreter.recycle_executor(executor, reason)
+        )
+
+    def update_settings(self, settings):
+        self.settings = settings
+        with self._lock:
+            interpreters = [s.interpreter for s in self._sessions.values()]
+        for interpreter in interpreters:
+            interpreter.update_settings(settings)
+
+    def _evict_over_capacity(self):
+        """Pop least recently used idle sessions beyond max_sessions. Caller holds the lock."""
+        evicted = []
+        excess = len(self._sessions) - self.config.max_sessions
+        for session_id in list(self._sessions):
+            if excess <= 0:
+                break
+            session = self._sessions[session_id]
+            if session.busy:
+                continue
+            del self._sessions[session_id]
+            evicted.append(session.interpreter)
+            excess -= 1
+        return evicted
+
+    def _cleanup(self, interpreters):
+        for interpreter in interpreters:
+            try:
+                interpreter.cleanup()
+            except Exception:
+                pass
+
+    def _release_kernels(self, session, reason):
+        """Shut down a session's kernels unless it became busy meanwhile."""
+        return self._while_idle(session, lambda: session.interpreter.cleanup(reason))
+
+    def _while_idle(self, session, action):
+        """Run action() holding the session busy, unless it is in use. Returns whether it ran."""
+        with self._lock:
+            if session.busy:
+                return False
+            session.busy += 1
+        try:
+            action()
+        except Exception:
+            pass
+        finally:
+            with self._lock:
+                session.busy -= 1
+        return True
+
+    def reap(self):
+        """Shut down kernels of idle sessions and enforce kernel and memory caps."""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+
+        # Idle timeout: release kernels, keep the conversation
+        for session in sessions:
+            if (
+                now - session.last_used >= self.config.session_idle_timeout
+                and session.interpreter.kernel_count()
+            ):
+                self._release_kernels(
+                    session, f"session idle for {self.config.session_idle_timeout:g} s"
+                )
+
+        # Caps: release kernels of least recently used sessions first
+        kernels = sum(s.interpreter.kernel_count() for s in sessions)
+        max_memory = self.config.max_kernel_memory_mb * 1024 * 1024
+        memory = sum(s.interpreter.memory_usage() for s in sessions) if max_memory else 0
+
+        for session in sessions:
+            over_kernels = kernels > self.config.max_kernels
+            over_memory = max_memory and memory > max_memory
+            if not (over_kernels or over_memory):
+                break
+            session_kernels = session.interpreter.kernel_count()
+            if not session_kernels:
+                continue
+            session_memory = session.interpreter.memory_usage() if max_memory else 0
+            reason = "too many kernels running" if over_kernels else "kernel memory cap reached"
+            if self._release_kernels(session, reason):
+                kernels -= session_kernels
+                memory -= session_memory
+
+    def _reap_loop(self):
+        while not self._stop_event.wait(self.config.reap_interval):
+            try:
+                self.reap()
+            except Exception:
+                pass
+
+    def start(self):
+        """Start the background reaper thread."""
+        if self._reaper is None:
+            self._reaper = threading.Thread(target=self._reap_loop, daemon=True)
+            self._reaper.start()
+
+    def shutdown(self):
+        """Stop the reaper and shut down every session."""
+        self._stop_event.set()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        self._cleanup([s.interpreter for s in sessions])
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            items = list(self._sessions.items())
+        return {
+            "count": len(items),
+            "max_sessions": self.config.max_sessions,
+            "kernels": sum(s.interpreter.kernel_count() for _, s in items),
+            "max_kernels": self.config.max_kernels,
+            "sessions": [
+                {
+                    "session_id": session_id,
+                    "busy": session.busy > 0,
+                    "awaiting_confirmation": session.interpreter.awaiting_confirmation,
+                    "idle_seconds": round(now - session.last_used, 1),
+                    "kernels": session.interpreter.kernel_count(),
+                    "messages": len(session.interpreter.messages),
+                    "llm": session.interpreter.llm.stats,
+                    "warmups": session.interpreter.warmup_stats,
+                }
+                for session_id, session in items
+            ],
+        }
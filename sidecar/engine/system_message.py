@@ -1,8 +1,11 @@
+import functools
 import getpass
 import platform
 
 
+@functools.lru_cache(maxsize=32)
 def build_system_message(custom_instructions: str = "") -> str:
+    """Built once per distinct instructions so the prompt prefix stays byte-identical."""
     try:
         username = getpass.getuser()
     except Exception:
@@ -0,0 +1,161 @@
+import functools
+import itertools
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+
+import tiktoken
+
+# Overheads used by OpenAI chat formats; close enough for other providers
+TOKENS_PER_MESSAGE = 4
+TOKENS_PER_REPLY = 3
+
+MAX_CACHED_COUNTS = 50000
+
+
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """Tokenizer for a model, loaded once. Unknown models fall back to cl100k_base."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except Exception:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenCounter:
+    """
+    Token counts for message text, cached by (tokenizer, text).
+    Strings cache their own hash, so looking up a message that was already
+    counted costs a dict hit instead of a re-encode.
+    """
+
+    def __init__(self, max_entries=MAX_CACHED_COUNTS):
+        self.max_entries = max_entries
+        self._counts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def count(self, text, encoding):
+        if not text:
+            return 0
+        key = (encoding.name, text)
+        with self._lock:
+            cached = self._counts.get(key)
+            if cached is not None:
+                self._counts.move_to_end(key)
+                return cached
+        tokens = len(encoding.encode(text, disallowed_special=()))
+        with self._lock:
+            self._counts[key] = tokens
+            if len(self._counts) > self.max_entries:
+                self._counts.popitem(last=False)
+        return tokens
+
+    def message_tokens(self, message, encoding):
+        tokens = TOKENS_PER_MESSAGE
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += self.count(content, encoding)
+        for call in message.get("tool_calls") or ():
+            function = call.get("function", {})
+            tokens += self.count(function.get("name", ""), encoding)
+            tokens += self.count(function.get("arguments", ""), encoding)
+        return tokens
+
+
+token_counter = TokenCounter()
+
+
+def trim_messages(
+    messages, system_message, max_tokens, model,
+    counter=token_counter, keep_from=0, headroom=0.0,
+):
+    """
+    Keep the most recent messages that fit in max_tokens alongside the system
+    message. Returns (messages, stats). The cut point is found by bisecting
+    prefix sums of cached per-message counts; only a message that has to be
+    shortened is ever re-encoded.
+
+    keep_from makes the cut sticky: the history keeps starting at that index
+    for as long as it fits. When it no longer does, the new cut leaves
+    `headroom` (a fraction of the budget) free so it holds for several turns.
+    """
+    encoding = get_encoding(model)
+    system_tokens = TOKENS_PER_MESSAGE + counter.count(system_message, encoding)
+    budget = max_tokens - system_tokens - TOKENS_PER_REPLY
+
+    counts = [counter.message_tokens(m, encoding) for m in messages]
+    prefix = list(itertools.accumulate(counts, initial=0))
+    total = prefix[-1]
+
+    start = bisect_left(prefix, total - budget) if total > budget else 0
+    if keep_from > len(messages):
+        keep_from = 0
+    if start <= keep_from:
+        start = keep_from
+    elif headroom:
+        start = bisect_left(prefix, total - int(budget * (1 - headroom)))
+
+    # The newest message alone is too big: keep a shortened copy of it
+    shorten_newest = start == len(messages) and bool(messages)
+    if shorten_newest:
+        start = len(messages) - 1
+
+    if start < len(messages) and messages[start].get("role") == "tool":
+        # A tool reply can't lead the history without its call
+        start, kept, kept_tokens = _lead_with_call(messages, start, counts, prefix, budget, encoding, counter)
+    elif shorten_newest:
+        kept = [_shorten(messages[-1], budget, encoding)]
+        kept_tokens = counter.message_tokens(kept[0], encoding)
+    else:
+        kept = messages[start:]
+        kept_tokens = total - prefix[start]
+
+    return kept, {
+        "prompt_tokens": system_tokens + kept_tokens + TOKENS_PER_REPLY,
+        "tokens_dropped": total - kept_tokens,
+        "messages_dropped": start,
+    }
+
+
+def _lead_with_call(messages, start, counts, prefix, budget, encoding, counter):
+    """
+    Moves a cut that landed on a tool reply back to the assistant message
+    that made the call, shortening the group's replies if the group doesn't
+    fit otherwise. If no call precedes the replies, or the call doesn't fit
+    even then, the cut moves past them instead. Returns (start, kept, kept_tokens).
+    """
+    call = start
+    while call > 0 and messages[call].get("role") == "tool":
+        call -= 1
+    end = start
+    while end < len(messages) and messages[end].get("role") == "tool":
+        end += 1
+    later = prefix[-1] - prefix[end]
+
+    if messages[call].get("role") == "assistant" and messages[call].get("tool_calls"):
+        room = budget - later
+        if prefix[end] - prefix[call] <= room:
+            return call, messages[call:], prefix[-1] - prefix[call]
+        replies = messages[call + 1:end]
+        share = (room - counts[call]) // len(replies)
+        if share > TOKENS_PER_MESSAGE:
+            shortened = [_shorten(reply, share, encoding) for reply in replies]
+            group = counts[call] + sum(counter.message_tokens(reply, encoding) for reply in shortened)
+            return call, [messages[call], *shortened, *messages[end:]], group + later
+
+    return end, messages[end:], later
+
+
+def _shorten(message, budget, encoding):
+    """Copy of a message with the middle of its content cut to fit the budget."""
+    content = message.get("content")
+    if not isinstance(content, str):
+        return message
+    tokens = encoding.encode(content, disallowed_special=())
+    keep = max(budget - TOKENS_PER_MESSAGE, 0)
+    if len(tokens) <= keep:
+        return message
+    half = keep // 2
+    tail = tokens[len(tokens) - half:] if half else []
+    shortened = encoding.decode(tokens[:half]) + "..." + encoding.decode(tail)
+    return {**message, "content": shortened}
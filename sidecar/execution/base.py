@@ -1,3 +1,7 @@
+import asyncio
+import threading
+
+
 class BaseLanguage:
     name = "Language"
     aliases = []
@@ -7,10 +11,61 @@ class BaseLanguage:
         """Execute code, yield output chunks as dicts."""
         raise NotImplementedError
 
+    async def arun(self, code):
+        """
+        Execute code from the event loop, yielding output chunks. By default
+        run() is driven from a worker thread; languages with an async
+        backend override this so that waiting on output holds no thread.
+        """
+        steps = iterate_in_thread(self.run(code))
+        try:
+            async for chunk in steps:
+                yield chunk
+        finally:
+            await steps.aclose()
+
     def stop(self):
         """Stop current execution."""
         pass
 
+    def kill(self):
+        """Stop current execution by force, when stop() didn't end it."""
+        self.stop()
+
     def terminate(self):
         """Clean up resources."""
         pass
+
+    def process_id(self):
+        """PID of the long-lived child process backing this language, if any."""
+        return None
+
+
+async def iterate_in_thread(gen, result=None):
+    """
+    Drive a blocking generator from worker threads, one item per hop.
+    If `result` is a dict, the generator's return value is stored in
+    result["value"].
+    """
+    done = object()
+    lock = threading.Lock()
+
+    def step():
+        with lock:
+            try:
+                return next(gen)
+            except StopIteration as stop:
+                if result is not None:
+                    result["value"] = stop.value
+                return done
+
+    def close():
+        # Waits for a step still running in another thread
+        with lock:
+            gen.close()
+
+    try:
+        while (item := await asyncio.to_thread(step)) is not done:
+            yield item
+    finally:
+        asyncio.get_running_loop().run_in_executor(None, close)
@@ -0,0 +1,169 @@
+import hashlib
+import io
+import os
+import queue
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:  # previews are optional
+    Image = None
+
+PREVIEW_SIZE = 320
+
+# Rich outputs shorter than this stay inline
+INLINE_HTML_CHARS = 2048
+
+
+class BlobStore:
+    """
+    Content-addressed files for images and large rich outputs, so the SSE
+    stream carries a URL instead of the data. A blob's id is the SHA-256 of
+    its bytes: an output produced again (the same plot) is stored once.
+    Blobs live in one temp directory and the least recently used are
+    deleted once their total size is over max_bytes.
+
+    Images also get a downscaled PNG preview, made on a background thread
+    when Pillow is installed.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        # blob id -> (media type, size), in LRU order
+        self._blobs = OrderedDict()
+        self._previews = set()
+        self._size = 0
+        self._dir = None
+        self._lock = threading.Lock()
+        self._pending = queue.Queue()
+        self._worker = None
+
+    def put(self, data, media_type):
+        """Store bytes; returns their blob id."""
+        blob_id = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if blob_id in self._blobs:
+                self._blobs.move_to_end(blob_id)
+                return blob_id
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix="bolchai_blobs_")
+            directory = self._dir
+        path = os.path.join(directory, blob_id)
+        # Written under a temp name, so a reader never sees part of a blob
+        partial = f"{path}.{threading.get_ident()}.part"
+        with open(partial, "wb") as f:
+            f.write(data)
+        os.replace(partial, path)
+
+        with self._lock:
+            if blob_id not in self._blobs:
+                self._blobs[blob_id] = (media_type, len(data))
+                self._size += len(data)
+            evicted = self._evict(keep=blob_id)
+        for old in evicted:
+            _unlink(os.path.join(directory, old))
+            _unlink(os.path.join(directory, old + ".preview"))
+
+        if Image is not None and media_type.startswith("image/"):
+            self._queue_preview(blob_id)
+        return blob_id
+
+    def _evict(self, keep):
+        """Pop least recently used blobs while over max_bytes. Caller holds the lock."""
+        evicted = []
+        for blob_id in list(self._blobs):
+            if self._size <= self.max_bytes:
+                break
+            if blob_id == keep:
+                continue
+            self._size -= self._blobs.pop(blob_id)[1]
+            self._previews.discard(blob_id)
+            evicted.append(blob_id)
+        return evicted
+
+    def get(self, blob_id, preview=False):
+        """
+        (path, media type) of a blob, or None if it is unknown or evicted.
+        With preview, the preview if it is ready and the blob itself if not.
+        """
+        with self._lock:
+            entry = self._blobs.get(blob_id)
+            if entry is None or self._dir is None:
+                return None
+            self._blobs.move_to_end(blob_id)
+            path = os.path.join(self._dir, blob_id)
+            if preview and blob_id in self._previews:
+                return path + ".preview", "image/png"
+            return path, entry[0]
+
+    def _queue_preview(self, blob_id):
+        self._pending.put(blob_id)
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._preview_loop, daemon=True)
+                self._worker.start()
+
+    def _preview_loop(self):
+        while True:
+            blob_id = self._pending.get()
+            if blob_id is None:
+                return
+            try:
+                self._make_preview(blob_id)
+            except Exception:
+                pass
+
+    def _make_preview(self, blob_id):
+        found = self.get(blob_id)
+        if found is None:
+            return
+        path = found[0]
+        with Image.open(path) as image:
+            if max(image.size) <= PREVIEW_SIZE:
+                return
+            image.thumbnail((PREVIEW_SIZE, PREVIEW_SIZE))
+            buffer = io.BytesIO()
+            image.save(buffer, format="PNG", optimize=True)
+        with open(path + ".preview", "wb") as f:
+            f.write(buffer.getvalue())
+        with self._lock:
+            if blob_id in self._blobs:
+                self._previews.add(blob_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "blobs": len(self._blobs),
+                "bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "previews": len(self._previews),
+            }
+
+    def shutdown(self):
+        with self._lock:
+            directory, self._dir = self._dir, None
+            self._blobs.clear()
+            self._previews.clear()
+            self._size = 0
+            worker, self._worker = self._worker, None
+        if worker is not None:
+            self._pending.put(None)
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+blob_store = BlobStore()
+
+
+def blob_url(blob_id):
+    return f"/blobs/{blob_id}"
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
@@ -0,0 +1,121 @@
+import threading
+from collections import deque
+
+from .python_kernel import PythonKernel
+
+
+class KernelPool:
+    """
+    Keeps a number of started, initialized PythonKernels ready to hand out.
+    A background thread refills the pool after each acquire and replaces
+    pooled kernels that died while waiting.
+    """
+
+    def __init__(self, factory=PythonKernel):
+        self.factory = factory
+        self.size = 0
+        self.warm_hits = 0
+        self.cold_hits = 0
+        self.replaced = 0
+        self._ready = deque()
+        self._starting = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, size):
+        """Start filling the pool in the background."""
+        self.size = max(0, size)
+        if self.size and self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._fill_loop, daemon=True)
+            self._thread.start()
+        self._wake.set()
+
+    def acquire(self):
+        """Return a ready kernel, or start one synchronously if the pool is empty."""
+        kernel = None
+        dead = []
+        with self._lock:
+            while self._ready:
+                candidate = self._ready.popleft()
+                if candidate.is_alive():
+                    kernel = candidate
+                    break
+                dead.append(candidate)
+            if kernel is not None:
+                self.warm_hits += 1
+            else:
+                self.cold_hits += 1
+            self.replaced += len(dead)
+        self._terminate(dead)
+        self._wake.set()
+        return kernel if kernel is not None else self.factory()
+
+    def _fill_loop(self):
+        while not self._stopped.is_set():
+            self._prune()
+            with self._lock:
+                missing = self.size - len(self._ready) - self._starting
+                if missing > 0:
+                    self._starting += 1
+            if missing > 0 and self._start_kernel():
+                continue
+            self._wake.wait(timeout=5)
+            self._wake.clear()
+
+    def _start_kernel(self):
+        """Start one kernel into the pool. Returns False if it could not be added."""
+        try:
+            kernel = self.factory()
+        except Exception:
+            kernel = None
+        with self._lock:
+            self._starting -= 1
+            added = kernel is not None and not self._stopped.is_set()
+            if added:
+                self._ready.append(kernel)
+        if kernel is not None and not added:
+            self._terminate([kernel])
+        return added
+
+    def _prune(self):
+        """Drop pooled kernels whose process has exited."""
+        with self._lock:
+            dead = [k for k in self._ready if not k.is_alive()]
+            for kernel in dead:
+                self._ready.remove(kernel)
+            self.replaced += len(dead)
+        self._terminate(dead)
+
+    def _terminate(self, kernels):
+        for kernel in kernels:
+            try:
+                kernel.terminate()
+            except Exception:
+                pass
+
+    def shutdown(self):
+        """Stop refilling and shut down every pooled kernel."""
+        self._stopped.set()
+        self._wake.set()
+        self._thread = None
+        with self._lock:
+            kernels = list(self._ready)
+            self._ready.clear()
+        self._terminate(kernels)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "ready": len(self._ready),
+                "starting": self._starting,
+                "warm_hits": self.warm_hits,
+                "cold_hits": self.cold_hits,
+                "replaced": self.replaced,
+            }
+
+
+kernel_pool = KernelPool()
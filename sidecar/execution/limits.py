@@ -0,0 +1,147 @@
+import threading
+import time
+
+from .procinfo import session_cpu_seconds
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# How often a running execution is checked against its time limits
+POLL_INTERVAL = 0.25
+# How long an interrupted run gets to finish before its executor is killed
+KILL_GRACE = 3.0
+
+STOPPED_BY_USER = "cancelled by the user"
+
+# How running out of address space shows up in output
+MEMORY_ERRORS = ("MemoryError", "Cannot allocate memory", "std::bad_alloc")
+
+
+class ExecutionLimits:
+    """
+    Caps on what code run by the model may use. Zero turns a limit off.
+
+    Wall-clock and CPU time are per execution, enforced by a RunGuard that
+    interrupts the run and kills its executor if that doesn't end it. Memory
+    (address space) and open files are rlimits set on shell and kernel
+    processes when they start, so everything they run inherits them (POSIX
+    only). CPU time isn't an rlimit because RLIMIT_CPU would count a
+    long-lived shell's or kernel's whole lifetime.
+    """
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.memory_mb = 0
+        self.max_files = 0
+
+    def configure(self, config):
+        self.wall_seconds = config.exec_timeout
+        self.cpu_seconds = config.exec_cpu_seconds
+        self.memory_mb = config.exec_memory_mb
+        self.max_files = config.exec_max_files
+
+    def popen_kwargs(self):
+        """Extra Popen arguments that apply the rlimits in the child."""
+        if resource is None or not (self.memory_mb or self.max_files):
+            return {}
+        limits = []
+        if self.memory_mb:
+            limits.append((resource.RLIMIT_AS, self.memory_mb * 1024 * 1024))
+        if self.max_files:
+            limits.append((resource.RLIMIT_NOFILE, self.max_files))
+        return {"preexec_fn": lambda: _set_rlimits(limits)}
+
+
+execution_limits = ExecutionLimits()
+
+
+def _set_rlimits(limits):
+    for which, value in limits:
+        _, hard = resource.getrlimit(which)
+        # The hard limit can only be lowered; the code can't raise it back
+        if hard != resource.RLIM_INFINITY:
+            value = min(value, hard)
+        resource.setrlimit(which, (value, value))
+
+
+class RunGuard:
+    """
+    Watches one execution: stops it when it goes over a time limit or when
+    cancel() is called, and records why, for notice(). Stopping interrupts
+    first; an executor whose run hasn't ended KILL_GRACE seconds later is
+    killed.
+    """
+
+    def __init__(self, executor, limits=execution_limits):
+        self.executor = executor
+        self.wall_seconds = limits.wall_seconds
+        self.cpu_seconds = limits.cpu_seconds
+        self.memory_mb = limits.memory_mb
+        self.reason = None
+        self._started = time.monotonic()
+        self._cpu_start = None
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+
+    def start(self):
+        if self.wall_seconds or self.cpu_seconds:
+            threading.Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self):
+        while not self._done.wait(POLL_INTERVAL):
+            reason = self._over_limit()
+            if reason:
+                self.cancel(reason)
+                return
+
+    def _over_limit(self):
+        if self.wall_seconds and time.monotonic() - self._started >= self.wall_seconds:
+            return f"wall-clock limit of {self.wall_seconds:g} s reached"
+        if self.cpu_seconds:
+            # The process may only start once the run does
+            used = session_cpu_seconds(self.executor.process_id())
+            if self._cpu_start is None:
+                self._cpu_start = used
+            elif used - self._cpu_start >= self.cpu_seconds:
+                return f"CPU time limit of {self.cpu_seconds:g} s reached"
+        return None
+
+    def cancel(self, reason):
+        """Stop the run, unless it already ended or was stopped."""
+        with self._lock:
+            if self.reason is not None or self._done.is_set():
+                return
+            self.reason = reason
+        try:
+            self.executor.stop()
+        except Exception:
+            pass
+        threading.Thread(target=self._escalate, daemon=True).start()
+
+    def _escalate(self):
+        if not self._done.wait(KILL_GRACE):
+            try:
+                self.executor.kill()
+            except Exception:
+                pass
+
+    def close(self):
+        """The run has ended; stop watching."""
+        with self._lock:
+            self._done.set()
+
+    def notice(self, output=""):
+        """
+        Output chunk saying which limit the run hit, or None. The memory cap
+        is only visible in the run's `output`, as an allocation failure.
+        """
+        if self.reason is not None:
+            content = f"\n[Execution stopped: {self.reason}]"
+        elif self.memory_mb and any(error in output for error in MEMORY_ERRORS):
+            content = f"\n[Memory limit of {self.memory_mb} MB reached]"
+        else:
+            return None
+        return {"type": "console", "format": "output", "content": content}
@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import threading
+import uuid
+from collections import OrderedDict, deque
+
+HEAD_CHARS = 2500
+TAIL_CHARS = 2500
+
+
+class OutputStore:
+    """
+    Spill files holding the full text of outputs too large to keep in memory.
+    Files live in one temp directory and are addressed by id; the oldest are
+    deleted once more than max_entries exist.
+    """
+
+    def __init__(self, max_entries=64):
+        self.max_entries = max_entries
+        self._paths = OrderedDict()
+        self._dir = None
+        self._lock = threading.Lock()
+
+    def create(self):
+        """Open a new spill file. Returns (output_id, writable text file)."""
+        output_id = uuid.uuid4().hex
+        with self._lock:
+            if self._dir is None:
+                self._dir = tempfile.mkdtemp(prefix="bolchai_outputs_")
+            path = os.path.join(self._dir, output_id + ".txt")
+            self._paths[output_id] = path
+            evicted = []
+            while len(self._paths) > max(self.max_entries, 1):
+                evicted.append(self._paths.popitem(last=False)[1])
+        for old in evicted:
+            _unlink(old)
+        return output_id, open(path, "w", encoding="utf-8", errors="replace")
+
+    def path(self, output_id):
+        """Path of a spilled output, or None if it is unknown or was evicted."""
+        with self._lock:
+            return self._paths.get(output_id)
+
+    def shutdown(self):
+        with self._lock:
+            directory, self._dir = self._dir, None
+            self._paths.clear()
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+output_store = OutputStore()
+
+
+class OutputSink:
+    """
+    Collects one code block's output in bounded memory. The first head_chars
+    and a ring buffer of the last tail_chars are kept; once the output grows
+    past both, everything (including what was buffered so far) is written to
+    a spill file in `store` and output_id is set.
+    """
+
+    def __init__(self, head_chars=HEAD_CHARS, tail_chars=TAIL_CHARS, store=output_store):
+        self.head_chars = head_chars
+        self.tail_chars = tail_chars
+        self.store = store
+        self.total = 0
+        self.output_id = None
+        self._head = []
+        self._head_len = 0
+        self._tail = deque()
+        self._tail_len = 0
+        self._file = None
+
+    def write(self, text):
+        if not text:
+            return
+        self.total += len(text)
+        if self._file is None and self.total > self.head_chars + self.tail_chars:
+            self._spill()
+        if self._file is not None:
+            self._file.write(text)
+
+        room = self.head_chars - self._head_len
+        if room > 0:
+            self._head.append(text[:room])
+            self._head_len += min(room, len(text))
+            text = text[room:]
+            if not text:
+                return
+
+        tail = self._tail
+        tail.append(text)
+        self._tail_len += len(text)
+        while self._tail_len - len(tail[0]) >= self.tail_chars:
+            self._tail_len -= len(tail.popleft())
+        excess = self._tail_len - self.tail_chars
+        if excess > 0:
+            tail[0] = tail[0][excess:]
+            self._tail_len -= excess
+
+    def _spill(self):
+        # Until now head and tail together hold the whole output
+        try:
+            self.output_id, self._file = self.store.create()
+            self._file.write("".join(self._head))
+            self._file.write("".join(self._tail))
+        except OSError:
+            self.output_id = self._file = None
+
+    @property
+    def elided(self):
+        """Characters left out of text()."""
+        return self.total - self._head_len - self._tail_len
+
+    def text(self):
+        """The output, with the middle replaced by a marker if it was too long."""
+        head = "".join(self._head)
+        tail = "".join(self._tail)
+        if not self.elided:
+            return head + tail
+        marker = f"\n\n[... {self.elided} characters omitted ...]\n\n"
+        return head + marker + tail
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _unlink(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
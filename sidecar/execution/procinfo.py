@@ -0,0 +1,70 @@
+import os
+
+try:
+    _PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+except (AttributeError, ValueError, OSError):
+    _PAGE_SIZE = 4096
+
+
+def rss_bytes(pid):
+    """Resident set size of a process, read from /proc. Returns 0 if unknown."""
+    if not pid:
+        return 0
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+try:
+    _CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+except (AttributeError, ValueError, OSError):
+    _CLOCK_TICKS = 100
+
+
+def session_cpu_seconds(sid):
+    """
+    CPU time used by every process in session `sid`, in seconds. Executors
+    start their process as a session leader, so this covers the code they
+    run, including reaped children. Returns 0 if unknown (no /proc).
+    """
+    return session_usage([sid]).get(sid, (0, 0.0))[1]
+
+
+def session_usage(sids):
+    """
+    Resident memory (bytes) and CPU time (seconds) of the processes in each
+    of the sessions `sids`, from one pass over /proc. Returns {sid: (rss,
+    cpu)}; sessions with no processes are left out.
+    """
+    wanted = {sid for sid in sids if sid}
+    usage = {}
+    if not wanted:
+        return usage
+    try:
+        pids = os.listdir("/proc")
+    except OSError:
+        return usage
+    for pid in pids:
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                stat = f.read()
+        except OSError:
+            continue
+        # Fields after the command name, which may contain spaces: state is 3
+        fields = stat[stat.rfind(")") + 2:].split()
+        try:
+            sid = int(fields[3])
+            if sid not in wanted:
+                continue
+            # utime, stime, cutime, cstime; then rss in pages
+            ticks = sum(int(value) for value in fields[11:15])
+            rss = int(fields[21]) * _PAGE_SIZE
+        except (ValueError, IndexError):
+            continue
+        total_rss, total_cpu = usage.get(sid, (0, 0.0))
+        usage[sid] = (total_rss + rss, total_cpu + ticks / _CLOCK_TICKS)
+    return usage
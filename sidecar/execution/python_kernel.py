@@ -1,12 +1,15 @@
+import asyncio
+import base64
 import os
 import queue
 import re
+import signal
 import sys
-import threading
-import time
 import traceback
 
 from .base import BaseLanguage
+from .blobs import INLINE_HTML_CHARS, blob_store, blob_url
+from .limits import execution_limits
 
 # PyInstaller guard: when running from an executable, ipykernel calls itself
 if "ipykernel_launcher" in sys.argv:
@@ -16,6 +19,19 @@ if "ipykernel_launcher" in sys.argv:
     app.launch_new_instance()
     sys.exit(0)
 
+ANSI_ESCAPE = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
+
+KERNEL_DIED = "Python kernel died during execution."
+KERNEL_RESTARTED = "\n[Python kernel restarted; variables and imports were lost]"
+
+SETUP_CODE = "%matplotlib inline\nimport matplotlib.pyplot as plt"
+
+# How long a blocking iopub read waits before re-checking that the kernel is alive
+LIVENESS_INTERVAL = 1.0
+
+# iopub messages that can carry images or HTML for the blob store
+RICH_OUTPUTS = ("display_data", "execute_result")
+
 
 class PythonKernel(BaseLanguage):
     name = "Python"
@@ -26,118 +42,251 @@ class PythonKernel(BaseLanguage):
         from jupyter_client import KernelManager
 
         self.km = KernelManager(kernel_name="python3")
-        self.km.start_kernel()
-        self.kc = self.km.client()
-        self.kc.start_channels()
-
-        while not self.kc.is_alive():
-            time.sleep(0.1)
-        time.sleep(0.5)
+        self.km.start_kernel(**execution_limits.popen_kwargs())
+        self.kc = self._blocking_client()
 
-        self.listener_thread = None
-        self.finish_flag = False
+        self.executing = False
+        self._akc = None
+        self._akc_loop = None
+        # Bumped by kill(), so a run waiting on the old kernel gives up
+        self._generation = 0
+        self._needs_setup = False
 
         # Set up matplotlib inline
-        for _ in self.run("%matplotlib inline\nimport matplotlib.pyplot as plt"):
+        for _ in self.run(SETUP_CODE):
             pass
 
     def terminate(self):
         try:
+            if self._akc is not None:
+                _close_client(self._akc)
+                self._akc = None
             self.kc.stop_channels()
             self.km.shutdown_kernel()
         except Exception:
             pass
 
-    def run(self, code):
-        while not self.kc.is_alive():
-            time.sleep(0.1)
+    def is_alive(self):
+        try:
+            return self.km.is_alive()
+        except Exception:
+            return False
 
-        self.finish_flag = False
+    def process_id(self):
+        provisioner = getattr(self.km, "provisioner", None)
+        return getattr(provisioner, "pid", None)
+
+    def run(self, code):
         try:
-            message_queue = queue.Queue()
-            self._execute_code(code, message_queue)
-            yield from self._capture_output(message_queue)
+            self._claim_iopub()
+            self._drain_shell()
+            generation = self._generation
+            self._setup_after_restart(self.kc)
+            msg_id = self.kc.execute(code)
+            self.executing = True
+            try:
+                yield from self._capture_output(msg_id, generation)
+            finally:
+                self.executing = False
         except GeneratorExit:
             raise
         except Exception:
             yield {"type": "console", "format": "output", "content": traceback.format_exc()}
 
-    def _execute_code(self, code, message_queue):
-        def iopub_listener():
-            while True:
-                if self.finish_flag:
-                    self.km.interrupt_kernel()
+    def _capture_output(self, msg_id, generation):
+        """
+        Read iopub messages for one execution until the kernel reports idle.
+        get_iopub_msg blocks on the zmq socket, so output is forwarded as soon
+        as it arrives; the timeout only bounds how long a dead kernel goes unnoticed.
+        """
+        while True:
+            try:
+                msg = self.kc.get_iopub_msg(timeout=LIVENESS_INTERVAL)
+            except queue.Empty:
+                notice = self._lost_kernel_notice(generation)
+                if notice is not None:
+                    yield notice
                     return
+                continue
+
+            done, chunk = self._handle_iopub(msg, msg_id)
+            if chunk is not None:
+                yield chunk
+            if done:
+                return
+
+    async def arun(self, code):
+        """run() over an AsyncKernelClient: waiting for output holds no thread."""
+        try:
+            client = await self._async_client()
+            while True:
                 try:
-                    msg = self.kc.iopub_channel.get_msg(timeout=0.05)
+                    await client.get_shell_msg(timeout=0)
                 except queue.Empty:
-                    continue
-                except Exception:
-                    continue
-
-                if (
-                    msg["header"]["msg_type"] == "status"
-                    and msg["content"]["execution_state"] == "idle"
-                ):
-                    self.finish_flag = True
-                    return
+                    break
+            generation = self._generation
+            self._setup_after_restart(client)
+            msg_id = client.execute(code)
+            self.executing = True
+            try:
+                while True:
+                    try:
+                        msg = await client.get_iopub_msg(timeout=LIVENESS_INTERVAL)
+                    except queue.Empty:
+                        notice = self._lost_kernel_notice(generation)
+                        if notice is not None:
+                            yield notice
+                            return
+                        continue
+
+                    if msg["header"]["msg_type"] in RICH_OUTPUTS:
+                        # Storing an image or large HTML hashes and writes it: off the loop
+                        done, chunk = await asyncio.to_thread(self._handle_iopub, msg, msg_id)
+                    else:
+                        done, chunk = self._handle_iopub(msg, msg_id)
+                    if chunk is not None:
+                        yield chunk
+                    if done:
+                        return
+            finally:
+                self.executing = False
+        except (GeneratorExit, asyncio.CancelledError):
+            raise
+        except Exception:
+            yield {"type": "console", "format": "output", "content": traceback.format_exc()}
+
+    async def _async_client(self):
+        """
+        An AsyncKernelClient on the same kernel, bound to the running loop.
+        Replies to its requests come back on its own shell socket; on iopub
+        it sees everything, and _handle_iopub filters by msg_id as usual.
+        """
+        loop = asyncio.get_running_loop()
+        if self._akc is None or self._akc_loop is not loop:
+            import zmq.asyncio
+            from jupyter_client.asynchronous import AsyncKernelClient
+
+            if self._akc is not None:
+                _close_client(self._akc)
+            # A context of our own, so _close_client can destroy it
+            client = AsyncKernelClient(context=zmq.asyncio.Context())
+            client.load_connection_info(self.km.get_connection_info())
+            client.start_channels()
+            # Also waits until the iopub subscription is live
+            await client.wait_for_ready(timeout=60)
+            self._akc, self._akc_loop = client, loop
+            # Nothing reads self.kc's iopub while the async client runs code;
+            # left subscribed, it would queue every message until the
+            # high-water mark. run() reconnects it.
+            self.kc.iopub_channel.stop()
+        return self._akc
+
+    def _blocking_client(self):
+        import zmq
+
+        client = self.km.client(context=zmq.Context())
+        client.start_channels()
+        client.wait_for_ready(timeout=60)
+        return client
+
+    def _claim_iopub(self):
+        """
+        Make self.kc the one client subscribed to iopub before a sync run:
+        the async client is closed, and self.kc replaced if arun stopped its
+        iopub channel.
+        """
+        if self._akc is not None:
+            _close_client(self._akc)
+            self._akc = self._akc_loop = None
+        if not self.kc.iopub_channel.is_alive():
+            _close_client(self.kc)
+            self.kc = self._blocking_client()
+
+    def _handle_iopub(self, msg, msg_id):
+        """Returns (done, chunk) for one iopub message of the execution msg_id."""
+        if msg["parent_header"].get("msg_id") != msg_id:
+            return False, None
 
-                content = msg["content"]
-
-                if msg["msg_type"] == "stream":
-                    message_queue.put({
-                        "type": "console",
-                        "format": "output",
-                        "content": content["text"],
-                    })
-                elif msg["msg_type"] == "error":
-                    tb = "\n".join(content["traceback"])
-                    ansi_escape = re.compile(r"\x1B\[[0-?]*[ -/]*[@-~]")
-                    tb = ansi_escape.sub("", tb)
-                    message_queue.put({
-                        "type": "console",
-                        "format": "output",
-                        "content": tb,
-                    })
-                elif msg["msg_type"] in ["display_data", "execute_result"]:
-                    data = content["data"]
-                    if "image/png" in data:
-                        message_queue.put({
-                            "type": "image",
-                            "format": "base64.png",
-                            "content": data["image/png"],
-                        })
-                    elif "text/html" in data:
-                        message_queue.put({
-                            "type": "console",
-                            "format": "output",
-                            "content": data["text/html"],
-                        })
-                    elif "text/plain" in data:
-                        message_queue.put({
-                            "type": "console",
-                            "format": "output",
-                            "content": data["text/plain"],
-                        })
-
-        self.listener_thread = threading.Thread(target=iopub_listener)
-        self.listener_thread.start()
-        self.kc.execute(code)
-
-    def _capture_output(self, message_queue):
+        msg_type = msg["header"]["msg_type"]
+        if msg_type == "status":
+            return msg["content"]["execution_state"] == "idle", None
+
+        return False, self._output_chunk(msg_type, msg["content"])
+
+    def _output_chunk(self, msg_type, content):
+        """Convert an iopub message into an LMC chunk, or None if it carries no output."""
+        if msg_type == "stream":
+            return {"type": "console", "format": "output", "content": content["text"]}
+        if msg_type == "error":
+            tb = ANSI_ESCAPE.sub("", "\n".join(content["traceback"]))
+            return {"type": "console", "format": "output", "content": tb}
+        if msg_type in RICH_OUTPUTS:
+            data = content["data"]
+            if "image/png" in data:
+                # The stream carries a link; the image itself goes to the blob store
+                blob_id = blob_store.put(base64.b64decode(data["image/png"]), "image/png")
+                return {"type": "image", "format": "blob.png", "content": blob_url(blob_id)}
+            html = data.get("text/html")
+            if html and len(html) > INLINE_HTML_CHARS:
+                # The model reads the plain text (e.g. a DataFrame's repr); the
+                # client can fetch the rendered table
+                blob_id = blob_store.put(html.encode("utf-8"), "text/html; charset=utf-8")
+                return {
+                    "type": "console",
+                    "format": "output",
+                    "content": data.get("text/plain") or f"[HTML output: {blob_url(blob_id)}]",
+                    "html": blob_url(blob_id),
+                }
+            if html:
+                return {"type": "console", "format": "output", "content": html}
+            if "text/plain" in data:
+                return {"type": "console", "format": "output", "content": data["text/plain"]}
+        return None
+
+    def _drain_shell(self):
+        """Discard execute_reply messages left on the shell channel by earlier runs."""
         while True:
-            time.sleep(0.05)
             try:
-                output = message_queue.get(timeout=0.1)
-                yield output
+                self.kc.get_shell_msg(timeout=0)
             except queue.Empty:
-                if self.finish_flag:
-                    time.sleep(0.1)
-                    try:
-                        output = message_queue.get(timeout=0.1)
-                        yield output
-                    except queue.Empty:
-                        break
+                return
+
+    def _lost_kernel_notice(self, generation):
+        """A notice if the kernel running `generation`'s code is gone, else None."""
+        if self._generation != generation:
+            return {"type": "console", "format": "output", "content": KERNEL_RESTARTED}
+        if not self.is_alive():
+            return {"type": "console", "format": "output", "content": KERNEL_DIED}
+        return None
+
+    def _setup_after_restart(self, client):
+        # Queued ahead of the code; the kernel runs requests in order
+        if self._needs_setup:
+            self._needs_setup = False
+            client.execute(SETUP_CODE, silent=True)
 
     def stop(self):
-        self.finish_flag = True
+        if self.executing:
+            self.km.interrupt_kernel()
+
+    def kill(self):
+        """
+        Kill the kernel with everything it started and start a fresh one on
+        the same ports, for code that ignores interrupts.
+        """
+        self._generation += 1
+        pid = self.process_id()
+        if pid and os.name != "nt":
+            # The kernel leads its own process group
+            try:
+                os.killpg(pid, signal.SIGKILL)
+            except OSError:
+                pass
+        self.km.restart_kernel(now=True)
+        self._needs_setup = True
+
+
+def _close_client(client):
+    """Stop a kernel client's channels and destroy its zmq context, which PythonKernel made for it."""
+    client.stop_channels()
+    client.context.destroy(linger=0)
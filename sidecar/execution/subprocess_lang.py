@@ -1,63 +1,324 @@
+import asyncio
+import codecs
+import io
+import locale
 import os
+import shlex
+import signal
 import subprocess
+import tempfile
 import traceback
+import uuid
 
 from .base import BaseLanguage
+from .limits import execution_limits
 
+READ_SIZE = 65536
+# What the text-mode pipes of run() use
+ENCODING = locale.getpreferredencoding(False)
 
-class PowerShellLanguage(BaseLanguage):
-    name = "PowerShell"
-    aliases = ["powershell", "ps1", "pwsh"]
-    file_extension = "ps1"
 
-    def run(self, code):
-        yield from _run_subprocess(["powershell", "-Command", code])
+class PersistentShell(BaseLanguage):
+    """
+    A long-lived shell process fed over pipes. Each code block is written to
+    a temp file and sourced into the running shell, followed by a sentinel
+    line carrying the exit code, so the working directory, variables and
+    sourced environments carry over between blocks. If the shell dies it is
+    started again on the next run.
+    """
 
-    def stop(self):
-        pass
+    def __init__(self):
+        self.proc = None
+        # Whether self.proc is an asyncio Process (started by arun)
+        self._async = False
+        # Set by stop(): the process is dead even if its exit isn't reaped yet
+        self._killed = False
 
+    def _argv(self):
+        """Command line that starts the shell reading commands from stdin."""
+        raise NotImplementedError
 
-class ShellLanguage(BaseLanguage):
-    name = "Shell"
-    aliases = ["shell", "bash", "sh", "cmd", "bat", "batch"]
-    file_extension = "sh"
+    def _invocation(self, path, marker):
+        """Line(s) that run the script at `path`, then print marker + exit code."""
+        raise NotImplementedError
 
-    def run(self, code):
-        if os.name == "nt":
-            yield from _run_subprocess(["cmd", "/c", code])
-        else:
-            yield from _run_subprocess(["bash", "-c", code])
-
-    def stop(self):
-        pass
-
-
-def _run_subprocess(cmd):
-    """Run a subprocess command and yield output chunks."""
-    try:
-        proc = subprocess.Popen(
-            cmd,
+    def _start(self):
+        self.proc = subprocess.Popen(
+            self._argv(),
+            stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.STDOUT,
             text=True,
+            errors="replace",
             bufsize=1,
+            **_process_group_kwargs(),
+            **execution_limits.popen_kwargs(),
+        )
+        self._async = False
+        self._killed = False
+
+    async def _astart(self):
+        self.proc = await asyncio.create_subprocess_exec(
+            *self._argv(),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            **_process_group_kwargs(),
+            **execution_limits.popen_kwargs(),
         )
-        for line in iter(proc.stdout.readline, ""):
+        self._async = True
+        self._killed = False
+
+    def _alive(self):
+        if self.proc is None or self._killed:
+            return False
+        if self._async:
+            return self.proc.returncode is None
+        return self.proc.poll() is None
+
+    def _restart_notice(self):
+        """
+        Drop the current process, if any. Returns a notice chunk when a shell
+        existed, since its state is lost.
+        """
+        if self.proc is None:
+            return None
+        self.terminate()
+        return {
+            "type": "console",
+            "format": "output",
+            "content": f"[{self.name} restarted; working directory and variables were reset]\n",
+        }
+
+    def run(self, code):
+        try:
+            # A shell started by arun() can't be read synchronously; replace it
+            if not self._alive() or self._async:
+                notice = self._restart_notice()
+                if notice:
+                    yield notice
+                self._start()
+            yield from self._run_script(code)
+        except GeneratorExit:
+            raise
+        except Exception:
             yield {
                 "type": "console",
                 "format": "output",
-                "content": line,
+                "content": traceback.format_exc(),
             }
-        proc.wait()
-        if proc.returncode != 0:
+
+    def _run_script(self, code):
+        marker = f"__BOLCHAI_DONE_{uuid.uuid4().hex}__"
+        fd, path = tempfile.mkstemp(suffix="." + self.file_extension, prefix="bolchai_")
+        finished = False
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(code)
+            self.proc.stdin.write(self._invocation(path, marker))
+            self.proc.stdin.flush()
+
+            for line in iter(self.proc.stdout.readline, ""):
+                index = line.find(marker)
+                if index == -1:
+                    yield {"type": "console", "format": "output", "content": line}
+                    continue
+                if index:
+                    yield {"type": "console", "format": "output", "content": line[:index]}
+                finished = True
+                notice = _exit_code_notice(line[index + len(marker):])
+                if notice:
+                    yield notice
+                return
+
+            # The shell itself went away (e.g. the code called `exit`)
+            finished = True
+            yield self._shell_exited_notice(self.proc.wait())
+        finally:
+            # Abandoned mid-run: the shell's output stream is out of step now
+            if not finished:
+                self.stop()
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    async def arun(self, code):
+        """run() on an asyncio subprocess, so waiting on output holds no thread."""
+        try:
+            if not self._alive() or not self._async:
+                notice = self._restart_notice()
+                if notice:
+                    yield notice
+                await self._astart()
+            async for chunk in self._arun_script(code):
+                yield chunk
+        except (GeneratorExit, asyncio.CancelledError):
+            raise
+        except Exception:
             yield {
                 "type": "console",
                 "format": "output",
-                "content": f"\n[Process exited with code {proc.returncode}]",
+                "content": traceback.format_exc(),
             }
-    except Exception:
-        yield {
+
+    async def _arun_script(self, code):
+        marker = f"__BOLCHAI_DONE_{uuid.uuid4().hex}__"
+        fd, path = tempfile.mkstemp(suffix="." + self.file_extension, prefix="bolchai_")
+        finished = False
+        # Decode leniently and normalize newlines, as the text pipes of run() do
+        decoder = io.IncrementalNewlineDecoder(
+            codecs.getincrementaldecoder(ENCODING)(errors="replace"), translate=True
+        )
+        pending = ""
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(code)
+            self.proc.stdin.write(self._invocation(path, marker).encode(ENCODING))
+            await self.proc.stdin.drain()
+
+            while True:
+                data = await self.proc.stdout.read(READ_SIZE)
+                pending += decoder.decode(data, final=not data)
+                if not data:
+                    break
+
+                index = pending.find(marker)
+                if index != -1:
+                    end = pending.find("\n", index)
+                    if end == -1:
+                        continue  # the exit code is still on its way
+                    if index:
+                        yield {"type": "console", "format": "output", "content": pending[:index]}
+                    finished = True
+                    notice = _exit_code_notice(pending[index + len(marker):end])
+                    if notice:
+                        yield notice
+                    return
+
+                # Forward complete lines; keep a partial one that could hold the marker
+                cut = pending.rfind("\n") + 1
+                if len(pending) - cut > READ_SIZE:
+                    cut = len(pending) - len(marker)
+                if cut:
+                    yield {"type": "console", "format": "output", "content": pending[:cut]}
+                    pending = pending[cut:]
+
+            finished = True
+            if pending:
+                yield {"type": "console", "format": "output", "content": pending}
+            yield self._shell_exited_notice(await self.proc.wait())
+        finally:
+            if not finished:
+                self.stop()
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+
+    def _shell_exited_notice(self, returncode):
+        return {
             "type": "console",
             "format": "output",
-            "content": traceback.format_exc(),
+            "content": f"\n[{self.name} exited with code {returncode}; it will be restarted on the next run]",
         }
+
+    def stop(self):
+        """
+        Kill the shell and whatever it is running; it restarts on the next
+        run. Only called for a block in flight, since the shell's state
+        goes with it.
+        """
+        if not self._alive():
+            return
+        self._killed = True
+        try:
+            if os.name == "nt":
+                self.proc.kill()
+            else:
+                os.killpg(self.proc.pid, signal.SIGKILL)
+        except Exception:
+            pass
+        # Reap it now; an asyncio process is reaped by its event loop
+        if not self._async:
+            try:
+                self.proc.wait(timeout=5)
+            except Exception:
+                pass
+
+    def terminate(self):
+        if self.proc is None:
+            return
+        try:
+            self.proc.stdin.close()
+        except Exception:
+            pass
+        self.stop()
+        self._killed = False
+        # An asyncio process is reaped by its event loop
+        if not self._async:
+            try:
+                self.proc.wait(timeout=5)
+            except Exception:
+                pass
+        self.proc = None
+
+    def process_id(self):
+        return self.proc.pid if self._alive() else None
+
+
+def _process_group_kwargs():
+    """Start the shell in its own process group so stop() can kill its children too."""
+    if os.name == "nt":
+        return {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+    return {"start_new_session": True}
+
+
+def _exit_code_notice(returncode):
+    returncode = returncode.strip()
+    if returncode in ("", "0"):
+        return None
+    return {
+        "type": "console",
+        "format": "output",
+        "content": f"\n[Process exited with code {returncode}]",
+    }
+
+
+class PowerShellLanguage(PersistentShell):
+    name = "PowerShell"
+    aliases = ["powershell", "ps1", "pwsh"]
+    file_extension = "ps1"
+
+    def _argv(self):
+        return [
+            "powershell", "-NoLogo", "-NoProfile", "-NonInteractive",
+            "-ExecutionPolicy", "Bypass", "-Command", "-",
+        ]
+
+    def _invocation(self, path, marker):
+        path = path.replace("'", "''")
+        return (
+            f"$global:LASTEXITCODE = 0; "
+            f"try {{ . '{path}' }} catch {{ Write-Output ($_ | Out-String) }}; "
+            f"Write-Output \"{marker}$LASTEXITCODE\"\n"
+        )
+
+
+class ShellLanguage(PersistentShell):
+    name = "Shell"
+    aliases = ["shell", "bash", "sh", "cmd", "bat", "batch"]
+
+    @property
+    def file_extension(self):
+        return "bat" if os.name == "nt" else "sh"
+
+    def _argv(self):
+        if os.name == "nt":
+            return ["cmd", "/Q", "/K", "@echo off"]
+        return ["bash", "--noprofile", "--norc"]
+
+    def _invocation(self, path, marker):
+        if os.name == "nt":
+            return f'call "{path}"\necho {marker}%ERRORLEVEL%\n'
+        return f"source {shlex.quote(path)} < /dev/null; printf '%s%d\\n' {marker} $?\n"
@@ -11,6 +11,8 @@ export interface LMCMessage {
   content: string;
   start?: boolean;
   end?: boolean;
+  // On the last chunk of a block whose full output was spilled: GET /outputs/{output_id}
+  output_id?: string;
 }
 
 export interface ChatMessage {